@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""Benchmark staffeli commands against a simulated course.
+
+Each workflow runs the command-line interface in-process against a
+``staffeli.simulator.Simulator``, in a temporary directory, and reports the
+wall time (the best of ``--repeat`` runs), the number of requests that reached
+the simulator, and the peak memory allocated by Python (in a separate,
+traced run, since tracing slows things down).
+
+Save the results with ``--json``, and compare a later run against them with
+``--baseline`` to catch regressions:
+
+    $ benchmarks/bench.py --json before.json
+    $ ... hack, hack, hack ...
+    $ benchmarks/bench.py --baseline before.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from typing import Any, Callable, Dict, List, Optional  # noqa: F401
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from staffeli import cli, simulator, transport  # noqa: E402
+from staffeli.simulator import Simulator  # noqa: E402
+
+COURSE_DIR = 'course'
+
+
+def staffeli(*argv: str) -> None:
+    """Run a staffeli command, as if from the command-line."""
+    saved = sys.argv
+    sys.argv = ['staffeli'] + list(argv)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            cli.main()
+    except SystemExit as e:
+        if e.code:
+            raise Exception("staffeli {} exited with {}".format(
+                " ".join(argv), e.code))
+    finally:
+        sys.argv = saved
+
+
+class Bench:
+    def __init__(self, root: str, sim: Simulator, grades: int) -> None:
+        self.root = root
+        self.sim = sim
+        self.grades = grades
+
+    def course(self) -> str:
+        return os.path.join(self.root, COURSE_DIR)
+
+    def reset(self) -> None:
+        """Forget what the transport knows between runs."""
+        os.chdir(self.root)
+        transport.configure(pool_size=transport.pool_size())
+        transport.invalidate()
+
+    def ensure_clone(self) -> None:
+        if not os.path.isdir(self.course()):
+            staffeli('clone', self.sim.course['name'], COURSE_DIR)
+            os.chdir(self.root)
+
+    def first_assignment(self) -> str:
+        subs = os.path.join(self.course(), 'subs')
+        if not os.path.isdir(subs):
+            os.chdir(self.course())
+            staffeli('fetch', 'subs')
+        return os.path.join('subs', sorted(os.listdir(subs))[0])
+
+    # Workflows; each returns the step to measure.
+
+    def clone(self) -> Callable[[], None]:
+        if os.path.isdir(self.course()):
+            shutil.rmtree(self.course())
+
+        def step() -> None:
+            staffeli('clone', self.sim.course['name'], COURSE_DIR)
+        return step
+
+    def fetch_all_subs(self) -> Callable[[], None]:
+        self.ensure_clone()
+        shutil.rmtree(os.path.join(self.course(), 'subs'), True)
+        os.chdir(self.course())
+
+        def step() -> None:
+            staffeli('fetch', 'subs')
+        return step
+
+    def fetch_subs(self) -> Callable[[], None]:
+        self.ensure_clone()
+        path = self.first_assignment()
+        for name in os.listdir(os.path.join(self.course(), path)):
+            sub = os.path.join(self.course(), path, name)
+            if os.path.isdir(sub):
+                shutil.rmtree(sub)
+        os.chdir(self.course())
+
+        def step() -> None:
+            staffeli('fetch', path)
+        return step
+
+    def grade(self) -> Callable[[], None]:
+        self.ensure_clone()
+        path = os.path.join(self.course(), self.first_assignment())
+        os.chdir(self.course())
+        staffeli('--metadata', 'fetch', os.path.relpath(path))
+        subdirs = sorted(
+            os.path.join(path, name) for name in os.listdir(path)
+            if os.path.isdir(os.path.join(path, name)))[:self.grades]
+
+        def step() -> None:
+            for subdir in subdirs:
+                os.chdir(subdir)
+                staffeli('grade', 'pass', '-m', 'Well done.')
+        return step
+
+    def groups(self) -> Callable[[], None]:
+        self.ensure_clone()
+        os.chdir(self.course())
+        category = self.sim.group_categories[simulator.GCAT_BASE]['name']
+
+        def step() -> None:
+            staffeli('group', 'add', 'group', category, 'Benchmark group')
+        return step
+
+    def sections(self) -> Callable[[], None]:
+        self.ensure_clone()
+        os.chdir(self.course())
+        section = self.sim.sections[simulator.SECTION_BASE]['name']
+        student = self.sim.students[-1]['name']
+
+        def step() -> None:
+            staffeli('section', 'add', 'member', section, student)
+        return step
+
+
+WORKFLOWS = [
+    ('clone', Bench.clone),
+    ('fetch-all-subs', Bench.fetch_all_subs),
+    ('fetch-subs', Bench.fetch_subs),
+    ('grade', Bench.grade),
+    ('groups', Bench.groups),
+    ('sections', Bench.sections),
+]  # type: List[Any]
+
+
+def measure(
+        bench: Bench, workflow: Callable[[Bench], Callable[[], None]],
+        repeat: int) -> Dict[str, Any]:
+    seconds = []  # type: List[float]
+    requests = 0
+    for i in range(repeat):
+        bench.reset()
+        step = workflow(bench)
+        before = bench.sim.requests
+        start = time.monotonic()
+        step()
+        seconds.append(time.monotonic() - start)
+        requests = bench.sim.requests - before
+
+    bench.reset()
+    step = workflow(bench)
+    tracemalloc.start()
+    try:
+        step()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    bench.reset()
+
+    return {
+        'seconds': min(seconds),
+        'requests': requests,
+        'peak_mib': peak / (1024 * 1024)
+    }
+
+
+def compare(
+        results: Dict[str, Dict[str, Any]],
+        baseline: Dict[str, Dict[str, Any]],
+        tolerance: float) -> List[str]:
+    """Describe the regressions of results w.r.t. the baseline."""
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        if result['requests'] > base['requests']:
+            regressions.append("{}: {} requests, up from {}".format(
+                name, result['requests'], base['requests']))
+        for key, unit in [('seconds', 's'), ('peak_mib', ' MiB')]:
+            if result[key] > base[key] * (1 + tolerance):
+                regressions.append("{}: {:.2f}{}, up from {:.2f}{}".format(
+                    name, result[key], unit, base[key], unit))
+    return regressions
+
+
+def table(results: Dict[str, Dict[str, Any]]) -> str:
+    lines = ['{:<16}{:>10}{:>10}{:>10}'.format(
+        'Workflow', 'Seconds', 'Requests', 'Peak MiB')]
+    for name, result in results.items():
+        lines.append('{:<16}{:>10.2f}{:>10}{:>10.1f}'.format(
+            name, result['seconds'], result['requests'], result['peak_mib']))
+    return '\n'.join(lines)
+
+
+def args_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description='Benchmark staffeli against a simulated course.')
+    parser.add_argument('workflows', nargs='*', metavar='WORKFLOW',
+                        help='the workflows to run (default: all of {})'
+                        .format(', '.join(name for name, _ in WORKFLOWS)))
+    parser.add_argument('--students', type=int, default=2000)
+    parser.add_argument('--assignments', type=int, default=50)
+    parser.add_argument('--groups', type=int, default=400)
+    parser.add_argument('--sections', type=int, default=4)
+    parser.add_argument('--attachment-size', type=int, default=16 * 1024,
+                        help='bytes per attachment (default: 16 KiB)')
+    parser.add_argument('--latency', type=float, default=5.0,
+                        help='milliseconds added to every response')
+    parser.add_argument('--grades', type=int, default=20,
+                        help='submissions to grade in the grade workflow')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', metavar='PATH',
+                        help='write the results to PATH')
+    parser.add_argument('--baseline', metavar='PATH',
+                        help='compare with the results in PATH')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed slowdown w.r.t. the baseline')
+    return parser
+
+
+def main() -> int:
+    args = args_parser().parse_args()
+    known = dict(WORKFLOWS)
+    names = args.workflows or [name for name, _ in WORKFLOWS]
+    for name in names:
+        if name not in known:
+            print("Unknown workflow {}.".format(name), file=sys.stderr)
+            return 2
+
+    sim = Simulator(
+        students=args.students, assignments=args.assignments,
+        groups=args.groups, sections=args.sections,
+        attachment_size=args.attachment_size, latency=args.latency / 1000)
+    cwd = os.getcwd()
+    root = tempfile.mkdtemp(prefix='staffeli-bench-')
+    saved_env = dict(os.environ)
+    results = {}  # type: Dict[str, Dict[str, Any]]
+    try:
+        with sim:
+            os.environ['STAFFELI_API_BASE'] = sim.api_base
+            os.environ['XDG_CACHE_HOME'] = os.path.join(root, 'cache')
+            with open(os.path.join(root, 'token'), 'w') as f:
+                f.write('simulated')
+            bench = Bench(root, sim, args.grades)
+            for name in names:
+                results[name] = measure(bench, known[name], args.repeat)
+                print(table({name: results[name]}).splitlines()[-1])
+    finally:
+        os.chdir(cwd)
+        os.environ.clear()
+        os.environ.update(saved_env)
+        shutil.rmtree(root, True)
+
+    print()
+    print(table(results))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print("Regression: " + regression)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,92 @@
+import asyncio
+import concurrent.futures
+import functools
+
+from typing import Any, Callable, Iterator, Optional
+
+from staffeli import transport
+from staffeli.typed_canvas import (
+    Canvas, QueryArg, _api, _iter_list_api, _list_api)
+
+DEFAULT_CONCURRENCY = 16
+
+_DONE = object()
+
+
+class AsyncEntries:
+    """An asynchronous iterator over the entries of a listing, fetching
+    the pages, one at a time, off the event loop::
+
+        async for group in canvas.iter_list(url):
+            ...
+    """
+
+    def __init__(self, canvas: 'AsyncCanvas', entries: Iterator[Any]) -> None:
+        self.canvas = canvas
+        self.entries = entries
+
+    def __aiter__(self) -> 'AsyncEntries':
+        return self
+
+    async def __anext__(self) -> Any:
+        entry = await self.canvas._run(
+            functools.partial(next, self.entries, _DONE))
+        if entry is _DONE:
+            raise StopAsyncIteration
+        return entry
+
+
+class AsyncCanvas(Canvas):
+    """An asyncio flavour of the low-level API with canvas.
+
+    It has the same methods as ``typed_canvas.Canvas``, but every method
+    returns an awaitable, so that many requests can be in flight at once
+    (and ``iter_list`` an asynchronous iterator, see ``AsyncEntries``)::
+
+        canvas = AsyncCanvas()
+        loop = asyncio.get_event_loop()
+        groups = loop.run_until_complete(asyncio.gather(
+            *[canvas.create_group(gcat_id, name) for name in names]))
+
+    At most ``concurrency`` requests are in flight at any one time. The
+    requests themselves go through the shared transport, on a pool of
+    threads of its own."""
+
+    def __init__(
+        self,
+        token: Optional[str] = None,
+        account_id: Optional[int] = None,
+        base_url: str = 'https://absalon.ku.dk/',
+        api_base: str = 'api/v1/',
+        concurrency: int = DEFAULT_CONCURRENCY
+            ) -> None:
+        Canvas.__init__(self, token, account_id, base_url, api_base)
+        self.concurrency = concurrency
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=concurrency)
+        if transport.pool_size() < concurrency:
+            transport.configure(pool_size=concurrency)
+
+    def _run(self, call: Callable[[], Any]) -> Any:
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(self._executor, call)
+
+    def get_list(self, rel_url: str, **args: QueryArg) -> Any:
+        return self._run(functools.partial(
+            _list_api, self.token, 'GET', self.api_url(rel_url), **args))
+
+    def iter_list(self, rel_url: str, **args: QueryArg) -> Any:
+        return AsyncEntries(self, _iter_list_api(
+            self.token, 'GET', self.api_url(rel_url), **args))
+
+    def post(self, rel_url: str, **args: QueryArg) -> Any:
+        return self._run(functools.partial(
+            _api, self.token, 'POST', self.api_url(rel_url), **args))
+
+    def delete(self, rel_url: str, **args: QueryArg) -> Any:
+        return self._run(functools.partial(
+            _api, self.token, 'DELETE', self.api_url(rel_url), **args))
+
+    def close(self) -> None:
+        """Wait for outstanding requests, and let go of the threads."""
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,134 @@
+"""Keep one copy of each attachment, however many places it is in.
+
+The same file turns up in many places in a working area: in the directory of
+each member of a group, in ``splits/``, in ``resubs/``, and again each time a
+new version of a submission is fetched. The blob store, ``.staffeli-blobs``
+at the root of the course, keeps the content of each attachment we download,
+named by its SHA-256, and remembers which Canvas file has which content. A
+file that is needed somewhere is then a hard link to its blob, or, where the
+file system cannot link (e.g., across devices), a copy.
+
+So, an attachment is downloaded only once, and takes up space only once. But
+a hard link shares its content with the blob, so a file that is edited in
+place is changed everywhere. Therefore, a blob is checked against its hash
+before it is used again, and downloaded anew if it does not match.
+
+To free the space, delete the blob store; the files linked to it stay."""
+
+import os
+import os.path
+import shutil
+import threading
+
+from staffeli import uploadcache
+
+from typing import Callable, Dict, Optional, Tuple  # noqa: F401
+
+DIRNAME = '.staffeli-blobs'
+
+
+def _replace(write: Callable[[str], None], path: str) -> None:
+    """Have ``write`` create a file at a temporary path, and move it to
+    ``path``, so that ``path`` is never only partly there."""
+    tmppath = path + '.tmp'
+    if os.path.lexists(tmppath):
+        os.remove(tmppath)
+    write(tmppath)
+    os.replace(tmppath, path)
+
+
+def link(src: str, dst: str) -> None:
+    """Make ``dst`` a hard link to ``src``, or a copy of it if need be."""
+    def write(tmppath: str) -> None:
+        try:
+            os.link(src, tmppath)
+        except OSError:
+            shutil.copyfile(src, tmppath)
+    _replace(write, dst)
+
+
+def copy(src: str, dst: str) -> None:
+    """Like ``shutil.copy2``, but link files that are linked to a blob.
+
+    Suitable as the ``copy_function`` of ``shutil.copytree``. Staffeli does
+    not otherwise make hard links, so a file with more than one is taken to
+    be linked to a blob."""
+    if os.stat(src).st_nlink > 1:
+        link(src, dst)
+    else:
+        shutil.copy2(src, dst)
+
+
+class BlobStore:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._key_locks = {}  # type: Dict[int, threading.Lock]
+        self.hits = 0
+        self.downloads = 0
+
+    def _blob(self, sha256: str) -> str:
+        return os.path.join(self.path, 'objects', sha256[:2], sha256[2:])
+
+    def _id_path(self, file_id: int) -> str:
+        return os.path.join(self.path, 'ids', str(file_id))
+
+    def lookup(self, file_id: int) -> Optional[str]:
+        """The SHA-256 of the Canvas file, if its blob is here, intact."""
+        try:
+            with open(self._id_path(file_id)) as f:
+                sha256 = f.read().strip()
+        except FileNotFoundError:
+            return None
+        blob = self._blob(sha256)
+        if os.path.isfile(blob) and uploadcache.sha256(blob) == sha256:
+            return sha256
+        return None
+
+    def add(self, file_id: int, path: str) -> str:
+        """Move the file at ``path``, the content of the Canvas file, into
+        the store, and return its SHA-256."""
+        sha256 = uploadcache.sha256(path)
+        blob = self._blob(sha256)
+        # Unless another Canvas file with the same content is here.
+        if not os.path.isfile(blob) or uploadcache.sha256(blob) != sha256:
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            os.replace(path, blob)
+        else:
+            os.remove(path)
+
+        def write(tmppath: str) -> None:
+            with open(tmppath, 'w') as f:
+                f.write(sha256 + '\n')
+        os.makedirs(os.path.dirname(self._id_path(file_id)), exist_ok=True)
+        _replace(write, self._id_path(file_id))
+        return sha256
+
+    def fetch(
+            self, file_id: int, path: str,
+            download: Callable[[str], None]) -> Tuple[int, str, bool]:
+        """Put the Canvas file at ``path``, calling ``download`` to write its
+        content to a path in the store if it is not here already. Returns the
+        size and SHA-256 of the file, and whether it was downloaded."""
+        os.makedirs(self.path, exist_ok=True)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(file_id, threading.Lock())
+
+        # Download the same file only once, even if asked to concurrently.
+        with key_lock:
+            sha256 = self.lookup(file_id)
+            fresh = sha256 is None
+            if sha256 is None:
+                # Under a name of its own, so a failed download can resume.
+                target = os.path.join(self.path, 'downloads', str(file_id))
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                download(target)
+                sha256 = self.add(file_id, target)
+            with self._lock:
+                if fresh:
+                    self.downloads += 1
+                else:
+                    self.hits += 1
+        blob = self._blob(sha256)
+        link(blob, path)
+        return (os.path.getsize(blob), sha256, fresh)
@@ -0,0 +1,172 @@
+"""Grade many students with a single request.
+
+Rather than one ``PUT`` per student, Canvas takes the grades and comments for
+any number of students in a single ``POST`` to
+``courses/:id/assignments/:id/submissions/update_grades``, and applies them in
+the background. It answers with a ``Progress`` object, which we poll until
+the job is done. The job does not say how each student fared, so we fetch the
+submissions afterwards, and check that each got the grade we gave. See
+<https://canvas.instructure.com/doc/api/submissions.html#method.submissions_api.bulk_update>.
+"""
+
+import hashlib
+import json
+import time
+
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from staffeli.journal import Journal, BEGUN, DONE
+
+# Students per request; large jobs are split, so that no one job runs for ages.
+MAX_STUDENTS = 100
+
+DEFAULT_POLL_INTERVAL = 0.5
+DEFAULT_MAX_POLL_INTERVAL = 5.0
+DEFAULT_TIMEOUT = 600.0
+
+# Canvas reports the grades of pass/fail assignments as complete/incomplete.
+_SYNONYMS = {
+    'pass': 'complete',
+    'fail': 'incomplete'
+}
+
+
+class Feedback:
+    def __init__(
+            self, grade: Optional[str], comment: Optional[str] = None,
+            file_ids: Iterable[int] = (), group_comment: bool = True) -> None:
+        self.grade = grade
+        self.comment = comment
+        self.file_ids = list(file_ids)
+        self.group_comment = group_comment
+
+
+def grade_data(feedback: Dict[int, Feedback]) -> List[Tuple[str, Any]]:
+    """Encode the feedback for each user id as ``grade_data`` parameters."""
+    args = []  # type: List[Tuple[str, Any]]
+    for user_id, f in sorted(feedback.items()):
+        key = 'grade_data[{}]'.format(user_id)
+        if f.grade is not None:
+            args.append((key + '[posted_grade]', f.grade))
+        if f.comment:
+            args.append((key + '[text_comment]', f.comment))
+        for file_id in f.file_ids:
+            args.append((key + '[file_ids][]', file_id))
+        if f.group_comment and (f.comment or f.file_ids):
+            args.append((key + '[group_comment]', 1))
+    return args
+
+
+def wait(
+        poll: Callable[[], Dict[str, Any]],
+        interval: float = DEFAULT_POLL_INTERVAL,
+        max_interval: float = DEFAULT_MAX_POLL_INTERVAL,
+        timeout: float = DEFAULT_TIMEOUT) -> Dict[str, Any]:
+    """Poll a progress object until the job has completed.
+
+    The interval between polls doubles, up to ``max_interval``, since a job
+    that is not done quickly is likely to take a while. Raise an exception if
+    the job failed, or did not complete within ``timeout`` seconds."""
+    deadline = time.monotonic() + timeout
+    while True:
+        progress = poll()
+        state = progress.get('workflow_state')
+        if state == 'completed':
+            return progress
+        if state == 'failed':
+            raise Exception("Canvas failed to update the grades: {}".format(
+                progress.get('message')))
+        if time.monotonic() + interval > deadline:
+            raise Exception(
+                "Canvas did not update the grades within {:.0f} seconds; "
+                "the job is still {}.".format(timeout, state))
+        time.sleep(interval)
+        interval = min(interval * 2, max_interval)
+
+
+def same_grade(given: str, actual: Optional[str]) -> bool:
+    if actual is None:
+        return False
+    given = given.strip().lower()
+    actual = actual.strip().lower()
+    return given == actual or _SYNONYMS.get(given) == actual
+
+
+def outcomes(
+        feedback: Dict[int, Feedback],
+        submissions: Iterable[Dict[str, Any]]) -> Dict[int, Optional[str]]:
+    """Map each user id to a description of what went wrong, or None if the
+    user got the grade we gave."""
+    by_user = {sub['user_id']: sub for sub in submissions}
+    result = {}  # type: Dict[int, Optional[str]]
+    for user_id, f in feedback.items():
+        sub = by_user.get(user_id)
+        if sub is None:
+            result[user_id] = "no submission"
+        elif f.grade is None:
+            result[user_id] = None
+        else:
+            actual = sub.get('entered_grade', sub.get('grade'))
+            if same_grade(f.grade, actual):
+                result[user_id] = None
+            else:
+                result[user_id] = "grade is {}, not {}".format(
+                    actual, f.grade)
+    return result
+
+
+def key(assignment_id: int, user_id: int, f: Feedback) -> str:
+    """Identify the feedback for a user in the journal, see journal.py."""
+    content = json.dumps(
+        [f.grade, f.comment, sorted(f.file_ids)]).encode('utf-8')
+    return 'feedback/{}/{}/{}'.format(
+        assignment_id, user_id, hashlib.sha256(content).hexdigest()[:16])
+
+
+def landed(f: Feedback, sub: Dict[str, Any]) -> bool:
+    """Whether the submission shows the grade and comment of the feedback."""
+    if f.grade is not None and not same_grade(
+            f.grade, sub.get('entered_grade', sub.get('grade'))):
+        return False
+    if f.comment:
+        comments = sub.get('submission_comments') or []
+        return any(c.get('comment') == f.comment for c in comments)
+    return True
+
+
+Send = Callable[[Dict[int, Feedback]], Dict[int, Optional[str]]]
+Fetch = Callable[[List[int]], Iterable[Dict[str, Any]]]
+
+
+def resume(
+        journal: Journal, assignment_id: int,
+        feedback: Dict[int, Feedback], send: Send, fetch: Fetch
+        ) -> Tuple[Dict[int, Optional[str]], int]:
+    """Give the feedback with ``send``, except what the journal says we have
+    already given. Ask Canvas (``fetch`` the submissions) about feedback that
+    we may or may not have given before. Return the outcome for each user
+    (see outcomes()), and how many were skipped."""
+    keys = {user_id: key(assignment_id, user_id, f)
+            for user_id, f in feedback.items()}
+    done = [user_id for user_id in feedback
+            if journal.state(keys[user_id]) == DONE]
+    doubt = [user_id for user_id in feedback
+             if journal.state(keys[user_id]) == BEGUN]
+    if doubt:
+        landed_ids = [sub['user_id'] for sub in fetch(doubt)
+                      if sub.get('user_id') in feedback and
+                      landed(feedback[sub['user_id']], sub)]
+        journal.commit(keys[user_id] for user_id in landed_ids)
+        done += landed_ids
+
+    result = {user_id: None for user_id in done
+              }  # type: Dict[int, Optional[str]]
+    todo = {user_id: f for user_id, f in feedback.items()
+            if user_id not in result}
+    if todo:
+        journal.begin(keys[user_id] for user_id in todo)
+        sent = send(todo)
+        journal.commit(keys[user_id] for user_id, problem in sent.items()
+                       if problem is None)
+        result.update(sent)
+    return (result, len(done))
@@ -5,7 +5,6 @@ import json
 import os
 import requests
 import sys
-import time
 import urllib.parse
 import urllib.request
 import yaml
@@ -13,7 +12,9 @@ import pdb
 
 from os.path import basename
 
-from staffeli import cachable, files, listed, names, upload
+from staffeli import bulkgrade, cachable, download, files, listed, names, pagination, subzip, sync, transport, upload
+
+DEFAULT_API_BASE = 'https://absalon.ku.dk/api/v1/'
 
 def format_json(d):
     return json.dumps(d, sort_keys=True, indent=2, ensure_ascii=False)
@@ -26,7 +27,7 @@ def _api_bool(value: bool) -> int:
 
 def _req(token, method, api_base, url_relative, url_absolute=None, **args):
     try:
-        args = args['_arg_list']
+        args = list(args['_arg_list'])
     except KeyError:
         pass
     if type(args) == type({}):
@@ -49,45 +50,42 @@ def _req(token, method, api_base, url_relative, url_absolute=None, **args):
     return urllib.request.Request(url, data=query_string, method=method,
                                  headers=headers)
 
-def _parse_pagination_link(s):
-    link, rel = s.split('; rel="')
-    link = link[1:-1]
-    rel = rel[:-1]
-    return (rel, link)
+def _read_json(f):
+    return json.loads(f.read().decode('utf-8'))
+
+def _iter_call_api(token, method, api_base, url_relative, **args):
+    """Yield the entries of a list-returning API call, as the pages arrive."""
+    req = _req(token, method, api_base, url_relative, None, **args)
+
+    def fetch(url_absolute):
+        req = _req(token, method, api_base, None, url_absolute, **args)
+        with transport.urlopen(req) as f:
+            links = pagination.parse_link_header(f.getheader('Link'))
+            return (_read_json(f), links)
+
+    # In some cases we want to extract many entries, e.g. the students
+    # in a course.  However, some Absalon instances set a per_page limit
+    # to 100, so we cannot just set per_page to 9000 and hope for the
+    # best.  Instead we utilize the API's pagination facilities, see
+    # staffeli/pagination.py.
+    # This works, although it is not foolproof in the extreme case that
+    # entries are added or removed from Absalon between our requests.
+    # This is probably not something to worry about.
+    for data in pagination.iter_pages(fetch, req.full_url):
+        if type(data) is list:
+            yield from data
+        else:
+            yield data
 
 def _call_api(token, method, api_base, url_relative, all_pages=False, **args):
+    if all_pages:
+        return list(_iter_call_api(
+            token, method, api_base, url_relative, **args))
+
     req = _req(token, method, api_base, url_relative, None, **args)
-    entries = []
-    while True:
-        with urllib.request.urlopen(req) as f:
-            data = json.loads(f.read().decode('utf-8'))
-            if type(data) is list:
-                entries.extend(data)
-            else:
-                entries.append(data)
-
-            # In some cases we want to extract many entries, e.g. the students
-            # in a course.  However, some Absalon instances set a per_page limit
-            # to 100, so we cannot just set per_page to 9000 and hope for the
-            # best.  Instead we utilize the API's pagination facilities
-            # documented at
-            # <https://canvas.instructure.com/doc/api/file.pagination.html>.
-            # This works, although it is not foolproof in the extreme case that
-            # entries are added or removed from Absalon between our requests.
-            # This is probably not something to worry about.
-            if all_pages:
-                pagination_links = {rel: link
-                                    for rel, link in
-                                    (_parse_pagination_link(s)
-                                     for s in f.info()['Link'].split(','))}
-                if pagination_links['current'] == pagination_links['last']:
-                    break
-                else:
-                    url_absolute = pagination_links['next']
-                    req = _req(token, method, api_base, None, url_absolute, **args)
-            else:
-                break
-    return entries
+    with transport.urlopen(req) as f:
+        data = _read_json(f)
+    return data if type(data) is list else [data]
 
 def _upload_transit(course, filepath):
     form_url = "https://file-transit.appspot.com/upload"
@@ -107,41 +105,11 @@ def _upload_transit(course, filepath):
     return resp.url
 
 def _upload_via_url(token, api_base, url_relative, filepath, viaurl):
-
-    url = api_base + url_relative
-    headers = {
-        'Authorization': 'Bearer ' + token
-    }
-
-    name = basename(filepath)
-    size = os.stat(filepath).st_size
-
-    params = {
-        'url'     : viaurl,
-        'name'    : name,
-        'size'    : size
-    }
-
-    resp = requests.post(url, headers=headers, params=params)
-
-    json = resp.json()
-
-    id = json['id']
-    status_url = json['status_url']
-
-    while json['upload_status'] == 'pending':
-      print("Waiting for Canvas to download it..")
-      time.sleep(3)
-      json = requests.get(status_url, headers=headers).json()
-
-    if json['upload_status'] != 'ready':
-        raise Exception("Canvas refused to upload the file(s):\n{}". format(json))
-
+    print("Waiting for Canvas to download {}..".format(basename(filepath)))
+    file_id = upload.via_url(token = token, api_base = api_base,
+        url_relative = url_relative, filepath = filepath, viaurl = viaurl)
     print("Canvas got it!")
-
-    attachment = json['attachment']
-
-    return attachment['id']
+    return file_id
 
 def _upload_submission_comment_file(
         token, api_base, url_relative, course, filepath, use_post = False):
@@ -280,8 +248,15 @@ class Submission(cachable.CachableEntity):
         else:
             self.student_ids = [self.json['user_id']]
 
+        # What we downloaded of the attachments, see sync.py. Kept in the
+        # submission, as .staffeli.yml must hold just the one key.
+        self.downloads = self.json.pop(sync.DOWNLOADS, None) or {}
+
     def publicjson(self):
-        return { self.cachename : self.json }
+        json = dict(self.json)
+        if self.downloads:
+            json[sync.DOWNLOADS] = self.downloads
+        return { self.cachename : json }
 
 class Assignment(listed.ListedEntity, cachable.CachableEntity):
     def __init__(self, course, name = None, id = None, path = None):
@@ -301,7 +276,15 @@ class Assignment(listed.ListedEntity, cachable.CachableEntity):
             entities = self.canvas.list_assignments(self.course.id)
             listed.ListedEntity.__init__(self, entities, name, id)
 
-        self.subs = list(map(Submission, self.submissions()))
+    @property
+    def subs(self):
+        return list(self.iter_subs())
+
+    def iter_subs(self):
+        return map(Submission, self.iter_submissions())
+
+    def iter_subs_since(self, since):
+        return map(Submission, self.iter_submissions_since(since))
 
     def publicjson(self):
         return { self.cachename : self.json }
@@ -312,14 +295,39 @@ class Assignment(listed.ListedEntity, cachable.CachableEntity):
     def submissions(self):
         return self.canvas.list_submissions(self.course.id, self.id)
 
+    def iter_submissions(self):
+        return self.canvas.iter_submissions(self.course.id, self.id)
+
+    def iter_submissions_since(self, since):
+        return self.canvas.iter_submissions_since(
+            self.course.id, self.id, since)
+
     def submissions_download_url(self):
         return self.canvas.submissions_download_url(self.course.id, self.id)
 
+    def download_submissions_zip(self, path):
+        return self.canvas.download_submissions_zip(
+            self.course.id, self.id, path)
+
     def give_feedback(self, submission_id, grade, filepaths, message,
-        use_post = False):
+        use_post = False, file_ids = ()):
         self.canvas.give_feedback(
           self.course.id, self.course.displayname,
-          self.id, submission_id, grade, filepaths, message, use_post)
+          self.id, submission_id, grade, filepaths, message, use_post,
+          file_ids)
+
+    def upload_comment_file(self, user_id, filepath, use_post = False):
+        return self.canvas.upload_comment_file(
+          self.course.id, self.course.displayname,
+          self.id, user_id, filepath, use_post)
+
+    def bulk_give_feedback(self, feedback):
+        return self.canvas.bulk_give_feedback(
+          self.course.id, self.id, feedback)
+
+    def student_submissions(self, user_ids):
+        return self.canvas.student_submissions(
+          self.course.id, self.id, user_ids)
 
 def _raise_lookup_file(namestr, lastparent):
     raise LookupError((
@@ -334,7 +342,10 @@ class Canvas:
     def __init__(self,
                  token=None,
                  account_id=None,
-                 api_base='https://absalon.ku.dk/api/v1/'):
+                 api_base=None):
+        if api_base is None:
+            # E.g., to point staffeli at staffeli/simulator.py.
+            api_base = os.environ.get('STAFFELI_API_BASE', DEFAULT_API_BASE)
         self.api_base = api_base
 
         if token is None:
@@ -346,8 +357,25 @@ class Canvas:
     def get(self, url_relative, **args):
         return _call_api(self.token, 'GET', self.api_base, url_relative, **args)
 
-    def get_verified_file(self, path, url):
-        return urllib.request.urlretrieve(url, filename=path)
+    def iter_list(self, url_relative, **args):
+        """Like get(url_relative, all_pages=True), but yield the entries as
+           the pages arrive, rather than wait for all of them.
+        """
+        return _iter_call_api(
+            self.token, 'GET', self.api_base, url_relative, **args)
+
+    def get_verified_file(self, path, url, size = None):
+        """Downloads url to path, resuming if the connection drops, and
+           checks that the whole file arrived, see download.py.
+        """
+        return download.fetch(url, path, size)
+
+    def get_verified_files(self, paths_urls, store = None):
+        """Like get_verified_file(), for each (path, url), several at a
+           time, and only once per file with a blob store, see blobstore.py.
+        """
+        download.download_all(
+            ((url, path) for path, url in paths_urls), store=store)
 
     def post(self, url_relative, **args):
         return _call_api(self.token, 'POST', self.api_base, url_relative, **args)
@@ -519,25 +547,54 @@ class Canvas:
 
     def list_submissions(self, course_id, assignment_id):
         """Returns the submissions of a single assignment for a course."""
-        return self.get(
+        return list(self.iter_submissions(course_id, assignment_id))
+
+    def iter_submissions(self, course_id, assignment_id):
+        """Yields the submissions of a single assignment for a course, as
+           they arrive.
+        """
+        return self.iter_list(
             'courses/{}/assignments/{}/submissions'.format(
-                course_id, assignment_id), all_pages=True)
+                course_id, assignment_id))
+
+    def iter_submissions_since(self, course_id, assignment_id, since):
+        """Yields the submissions of a single assignment that were submitted
+           or graded since the given time, as they arrive. A submission that
+           was both may be yielded twice.
+        """
+        for field in ['submitted_since', 'graded_since']:
+            yield from self.iter_list(
+                'courses/{}/students/submissions'.format(course_id),
+                _arg_list=[('student_ids[]', 'all'),
+                           ('assignment_ids[]', assignment_id),
+                           (field, since)])
 
     def submissions_download_url(self, course_id, assignment_id):
         return self.assignment(
-            course_id, assignment_id)['submissions_download_url']
+            course_id, assignment_id)[0]['submissions_download_url']
+
+    def download_submissions_zip(self, course_id, assignment_id, path):
+        """Downloads all the submissions of an assignment as a zip file to
+           path, see subzip.py. Returns its size.
+        """
+        url = urllib.parse.urljoin(self.api_base,
+            self.submissions_download_url(course_id, assignment_id))
+        return subzip.download(url, self.token, path)
 
     def give_feedback(self,
             course_id, course_name, assignment_id, user_id, grade, message, filepaths,
-            use_post = False):
+            use_post = False, file_ids = ()):
+        """Grade a submission, and comment on it, attaching the given files,
+           and any files already uploaded (see upload_comment_file()).
+        """
 
         url_relative = \
             'courses/{}/assignments/{}/submissions/{}'.format(
                 course_id, assignment_id, user_id)
 
-        upload = lambda filepath : _upload_submission_comment_file(
-            self.token, self.api_base, url_relative, course_name, filepath, use_post)
-        ids = list(map(upload, filepaths))
+        upload_one = lambda filepath : self.upload_comment_file(
+            course_id, course_name, assignment_id, user_id, filepath, use_post)
+        ids = list(file_ids) + upload.concurrently(upload_one, filepaths)
 
         _arg_list = list(map(lambda x: ("comment[file_ids][]", x), ids))
         _arg_list.append(("submission[posted_grade]", grade))
@@ -555,6 +612,61 @@ class Canvas:
         self.show_verification_urls(course_id, assignment_id, user_id)
         return resp
 
+    def upload_comment_file(self,
+            course_id, course_name, assignment_id, user_id, filepath,
+            use_post = False):
+        """Upload a file to attach to a submission comment. Returns the file
+           id.
+        """
+        url_relative = \
+            'courses/{}/assignments/{}/submissions/{}'.format(
+                course_id, assignment_id, user_id)
+        return _upload_submission_comment_file(
+            self.token, self.api_base, url_relative, course_name, filepath,
+            use_post)
+
+    def update_grades(self, course_id, assignment_id, feedback):
+        """Grade and comment on many submissions in one request. 'feedback'
+           maps user ids to bulkgrade.Feedback. Returns a progress object,
+           see progress().
+        """
+        url_relative = \
+            'courses/{}/assignments/{}/submissions/update_grades'.format(
+                course_id, assignment_id)
+        return self.post(
+            url_relative, _arg_list=bulkgrade.grade_data(feedback))[0]
+
+    def progress(self, progress_id):
+        return self.get('progress/{}'.format(progress_id))[0]
+
+    def student_submissions(self, course_id, assignment_id, user_ids):
+        """Returns the submissions of the given students only, with their
+           comments.
+        """
+        args = [('assignment_ids[]', assignment_id),
+                ('include[]', 'submission_comments')]
+        args += [('student_ids[]', user_id) for user_id in user_ids]
+        return self.get(
+            'courses/{}/students/submissions'.format(course_id),
+            all_pages=True, _arg_list=args)
+
+    def bulk_give_feedback(self, course_id, assignment_id, feedback):
+        """Like give_feedback(), but for many students at once, see
+           bulkgrade.py. Any files must be uploaded beforehand, see
+           upload_comment_file(). Returns a map from user id to what went
+           wrong for that user, or None if all went well.
+        """
+        progress = self.update_grades(course_id, assignment_id, feedback)
+
+        def poll():
+            # The job changes Canvas behind our back; forget what we knew.
+            transport.invalidate()
+            return self.progress(progress['id'])
+        bulkgrade.wait(poll)
+        subs = self.student_submissions(
+            course_id, assignment_id, list(feedback.keys()))
+        return bulkgrade.outcomes(feedback, subs)
+
     def show_verification_urls(self, course_id, assignment_id, user_id):
         speedgrader_url = "https://absalon.ku.dk/courses/{}/gradebook/speed_grader?assignment_id={}#%7B%22student_id%22%3A%22{}%22%7D".format(course_id, assignment_id, user_id)
         gradebook_url = "https://absalon.ku.dk/courses/{}/assignments/{}/submissions/{}/".format(course_id, assignment_id, user_id)
@@ -0,0 +1,182 @@
+"""Record Canvas traffic to a file, and play it back later.
+
+When a command is slow against the real Canvas, record its traffic:
+
+    $ staffeli --record slow.cassette fetch subs A3
+
+and then replay it as often as needed, without a network, e.g., to profile it:
+
+    $ staffeli --replay slow.cassette --profile fetch subs A3
+
+A cassette is a gzip-compressed file with one JSON object per line: a header,
+followed by one request/response pair per exchange with the server, in the
+order they happened, along with how long each took. Playback can optionally
+take just as long (``--replay-timing``).
+
+The ``Authorization`` header is never recorded, and the token is scrubbed from
+any URL or body it may appear in. Responses are matched to requests by their
+method, URL, and body (with the boundary of a multipart body, which is new
+every time, left out). If the same request was made several times, the
+recorded responses are played back in order, and the last one is repeated if
+the request is made more times than it was recorded."""
+
+import base64
+import collections
+import gzip
+import json
+import re
+import threading
+import time
+
+from email.message import Message
+from typing import Any, Callable, Dict, Optional, Tuple
+from typing import Deque  # noqa: F401
+
+from staffeli.transport import Response
+
+VERSION = 1
+REDACTED = 'REDACTED'
+
+# Response headers that may identify the user, and are of no use on replay.
+_SECRET_HEADERS = frozenset(['set-cookie', 'x-canvas-user-id'])
+
+
+class MissingResponse(LookupError):
+    """The request was not recorded on the cassette."""
+
+
+Send = Callable[[str, str, Dict[str, str], Optional[bytes]], Response]
+Key = Tuple[str, str, bytes]
+
+
+def _token(headers: Dict[str, str]) -> Optional[str]:
+    for name, value in headers.items():
+        if name.lower() == 'authorization':
+            scheme, _, token = value.partition(' ')
+            return token or scheme
+    return None
+
+
+def _scrub(data: bytes, token: Optional[str]) -> bytes:
+    if not token:
+        return data
+    return data.replace(token.encode('utf-8'), REDACTED.encode('ascii'))
+
+
+def _scrub_str(text: str, token: Optional[str]) -> str:
+    if not token:
+        return text
+    return text.replace(token, REDACTED)
+
+
+def _boundary(headers: Dict[str, str]) -> Optional[str]:
+    for name, value in headers.items():
+        if name.lower() == 'content-type':
+            match = re.search(r'boundary="?([^";]+)"?', value)
+            return match.group(1) if match else None
+    return None
+
+
+def _key(
+        method: str, url: str, headers: Dict[str, str], body: Any,
+        token: Optional[str]) -> Key:
+    if body is not None and not isinstance(body, bytes):
+        # A body sent in chunks, e.g., upload.MultipartBody.
+        body = b''.join(body)
+    body = _scrub(body or b'', token)
+    boundary = _boundary(headers)
+    if boundary is not None:
+        body = body.replace(boundary.encode('utf-8'), b'BOUNDARY')
+    return (method.upper(), _scrub_str(url, token), body)
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode('ascii')
+
+
+class Recording:
+    """Send requests as usual, and write each exchange to the cassette."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = gzip.open(path, 'wt', encoding='utf-8')
+        self._write({'version': VERSION, 'created': time.time()})
+
+    def _write(self, entry: Dict[str, Any]) -> None:
+        """Assumes the lock is held (or that nobody else has the file)."""
+        self._file.write(json.dumps(entry, sort_keys=True) + '\n')
+
+    def send(self, method: str, url: str, headers: Dict[str, str],
+             body: Optional[bytes], send: Send) -> Response:
+        start = time.monotonic()
+        resp = send(method, url, headers, body)
+        elapsed = time.monotonic() - start
+
+        token = _token(headers)
+        method, url, request_body = _key(method, url, headers, body, token)
+        entry = {
+            'method': method,
+            'url': url,
+            'request_body': _b64(request_body),
+            'status': resp.status,
+            'reason': resp.reason,
+            'headers': [
+                (name, _scrub_str(value, token))
+                for name, value in resp.headers.items()
+                if name.lower() not in _SECRET_HEADERS],
+            'body': _b64(_scrub(resp.body, token)),
+            'wire_size': resp.wire_size,
+            'elapsed': elapsed
+        }
+        with self._lock:
+            self._write(entry)
+        return resp
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+class Replay:
+    """Answer requests from the cassette, without a network."""
+
+    def __init__(self, path: str, timing: bool = False) -> None:
+        self.path = path
+        self.timing = timing
+        self._lock = threading.Lock()
+        self._responses = collections.defaultdict(
+            collections.deque)  # type: Dict[Key, Deque[Dict[str, Any]]]
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            header = json.loads(f.readline())
+            if header.get('version') != VERSION:
+                raise ValueError(
+                    "{} is not a cassette I know how to play.".format(path))
+            for line in f:
+                entry = json.loads(line)
+                key = (entry['method'], entry['url'],
+                       base64.b64decode(entry['request_body']))
+                self._responses[key].append(entry)
+
+    def send(self, method: str, url: str, headers: Dict[str, str],
+             body: Optional[bytes], send: Send) -> Response:
+        key = _key(method, url, headers, body, _token(headers))
+        with self._lock:
+            recorded = self._responses.get(key)
+            if not recorded:
+                raise MissingResponse(
+                    "{} {} is not on the cassette {}.".format(
+                        key[0], key[1], self.path))
+            entry = recorded.popleft() if len(recorded) > 1 else recorded[0]
+
+        if self.timing:
+            time.sleep(entry['elapsed'])
+        response_headers = Message()
+        for name, value in entry['headers']:
+            response_headers[name] = value
+        return Response(
+            url, entry['status'], entry['reason'], response_headers,
+            base64.b64decode(entry['body']), entry['wire_size'])
+
+    def close(self) -> None:
+        pass
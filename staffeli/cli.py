@@ -1,8 +1,7 @@
-import argparse, os, os.path, shutil, yaml, sys, re, random
+import argparse, concurrent.futures, functools, json, os, os.path, shutil, yaml, sys, re, random, threading, time
 
-from staffeli import canvas
+from staffeli import blobstore, bulkgrade, canvas, download, files, journal, manifest, subzip, sync, transport, upload, uploadcache
 
-from urllib.request import urlretrieve
 
 from slugify import slugify
 
@@ -87,34 +86,76 @@ def fetch_all_subs(course):
         mkdir(path)
         assign.cache(path)
 
-def fetch_attachments(path, attachments):
+def _new_path(path, filename, say = print):
+    """Where to put a file in the submission directory path, without
+       overwriting what is there.
+    """
+    targetpath = os.path.join(path, filename)
+    if os.path.isfile(targetpath):
+        # A new version, or a file of ours; keep it.
+        new_dir = 'new-download'
+        i = 1
+        while True:
+            targetdir = os.path.join(path, new_dir)
+            targetpath = os.path.join(targetdir, filename)
+            if os.path.exists(targetpath):
+                new_dir = 'new-download-{}'.format(i)
+                i += 1
+            else:
+                os.makedirs(targetdir, exist_ok=True)
+                break
+        say("Looks like it is already here. Putting it in a new directory '{}'.".format(new_dir))
+    return targetpath
+
+def fetch_attachments(path, attachments, downloader = None, sub = None,
+        verify = False):
+    """Downloads the attachments into the submission directory path, except
+       those that are already here, as they are on Canvas. What is here is
+       recorded in the .staffeli.yml of the submission, if given, see sync.py.
+    """
+    if downloader is None:
+        with download.Downloader() as downloader:
+            return fetch_attachments(path, attachments, downloader, sub, verify)
+
+    downloaded = sub.downloads if sub is not None else {}
+    here = {}
+    lock = threading.Lock()
+
+    def remember(att, targetpath, size, sha256):
+        with lock:
+            here[att['id']] = sync.record(path, targetpath, att, sha256)
+            if sub is not None:
+                sub.downloads = dict(here)
+                sub.cache(path)
+
     for att in attachments:
-        targetpath = os.path.join(path, att['filename'])
-        print("Downloading {}..".format(targetpath))
-        if os.path.isfile(targetpath):
-            # TODO: Do this smarter.  Check if the file is the same, or if it is
-            # a new file!
-            new_dir = 'new-download'
-            i = 1
-            while True:
-                targetdir = os.path.join(path, new_dir)
-                targetpath = os.path.join(targetdir, att['filename'])
-                if os.path.exists(targetpath):
-                    new_dir = 'new-download-{}'.format(i)
-                    i += 1
-                else:
-                    os.makedirs(targetdir, exist_ok=True)
-                    break
-            print("Looks like it is already here. Putting it in a new directory '{}'.".format(new_dir))
-
-        urlretrieve(att['url'], targetpath)
+        entry = downloaded.get(att['id'])
+        if sync.unchanged(path, att, entry, verify):
+            with lock:
+                here[att['id']] = entry
+            downloader.say("Skipping {}; it has not changed.".format(
+                os.path.join(path, entry['path'])))
+            continue
+
+        downloader.say("Downloading {}..".format(
+            os.path.join(path, att['filename'])))
+        targetpath = _new_path(path, att['filename'], downloader.say)
+        downloader.add(att['url'], targetpath,
+            functools.partial(remember, att, targetpath), att['id'],
+            att.get('size'))
+
+    with lock:
+        if sub is not None:
+            sub.downloads = dict(here)
+            sub.cache(path)
 
 def write_body(path: str, body: str) -> None:
     with open(os.path.join(path, 'body.txt'), 'w') as f:
         soup = BeautifulSoup(body, 'html.parser')
         f.write(soup.text.strip() + "\n")
 
-def fetch_sub(students, path, sub, metadata = False):
+def fetch_sub(students, path, sub, metadata = False, only_new = False,
+        downloader = None, verify = False):
     json = sub.json
     if json['workflow_state'] == 'unsubmitted' or json['submission_type'] is None:
         return
@@ -134,6 +175,10 @@ def fetch_sub(students, path, sub, metadata = False):
 
     subpath = os.path.join(path, "{}_{}".format(kuid, user_id))
     mkdir(subpath)
+    if only_new and not sync.resubmitted(subpath, json):
+        # Only graded or commented on; what was handed in is already here.
+        metadata = True
+    sub.downloads = sync.downloads(subpath)
     sub.cache(subpath)
     if metadata:
         return
@@ -147,9 +192,56 @@ def fetch_sub(students, path, sub, metadata = False):
             print("Try and have a look in SpeedGrader(tm):\n{}".format(json['preview_url']))
             print(sub)
             return
-        fetch_attachments(subpath, json['attachments'])
-
-def fetch_subs(course, name, deep = False, metadata = False):
+        fetch_attachments(subpath, json['attachments'], downloader, sub, verify)
+
+def fetch_zip(assign, path, students, subs, verify = False):
+    """Like fetching each submission with fetch_sub(), but get all the
+       attachments in a single zip file from Canvas, see subzip.py.
+    """
+    by_user = {}
+    for sub in subs:
+        fetch_sub(students, path, sub, metadata = True)
+        try:
+            kuid = students[sub.json['user_id']]['kuid']
+        except KeyError:
+            continue
+        subpath = os.path.join(path, "{}_{}".format(kuid, sub.json['user_id']))
+        if os.path.isdir(subpath):
+            by_user[sub.json['user_id']] = (sub, subpath)
+
+    zippath = os.path.join(path, 'submissions.zip')
+    print("Downloading all submissions to {}..".format(zippath))
+    size = assign.download_submissions_zip(zippath)
+    print("Downloaded {:.1f} MiB.".format(size / (1024 * 1024)))
+
+    targets = []
+    for name in subzip.names(zippath):
+        member = subzip.parse(name)
+        if member is None or member.user_id not in by_user:
+            print("Skipping {} in the zip file.".format(name))
+            continue
+        sub, subpath = by_user[member.user_id]
+        if member.filename == subzip.TEXT:
+            write_body(subpath, subzip.read(zippath, name).decode('utf-8'))
+            continue
+        atts = {att['id']: att for att in sub.json.get('attachments', [])}
+        att = atts.get(member.attachment_id,
+            {'id': member.attachment_id, 'filename': member.filename})
+        if sync.unchanged(subpath, att, sub.downloads.get(att['id']), verify):
+            continue
+        targets.append((name, _new_path(subpath, member.filename), sub, subpath, att))
+
+    print("Unpacking {} files..".format(len(targets)))
+    extracted = subzip.unpack(
+        zippath, [(name, targetpath) for name, targetpath, _, _, _ in targets])
+    for (_, targetpath, sub, subpath, att), (_, sha256) in zip(targets, extracted):
+        sub.downloads[att['id']] = sync.record(subpath, targetpath, att, sha256)
+    for sub, subpath in by_user.values():
+        sub.cache(subpath)
+    os.remove(zippath)
+
+def fetch_subs(course, name, deep = False, metadata = False, incremental = False,
+        downloads = download.DEFAULT_WORKERS, verify = False, as_zip = False):
     name = slugify(name)
     path = os.path.join("subs", name)
     if os.path.isdir(path):
@@ -164,10 +256,30 @@ def fetch_subs(course, name, deep = False, metadata = False):
         return
 
     students = canvas.StudentList(searchdir = "students")
-    for sub in assign.subs:
-        fetch_sub(students, path, sub, metadata)
-
-def fetch(args, metadata):
+    since = sync.load(path) if incremental else None
+    start = sync.now()
+    if since is None:
+        subs = assign.iter_subs()
+    else:
+        print("Fetching submissions changed since {}..".format(since))
+        subs = sync.latest(assign.iter_subs_since(since))
+        print("{} submission{} changed.".format(
+            len(subs), "" if len(subs) == 1 else "s"))
+    if as_zip and since is None and not metadata:
+        fetch_zip(assign, path, students, subs, verify)
+        sync.save(path, start)
+        return
+    with download.Downloader(workers = downloads,
+            store = _blob_store(course)) as downloader:
+        for sub in subs:
+            fetch_sub(students, path, sub, metadata,
+                only_new = since is not None, downloader = downloader,
+                verify = verify)
+    if not metadata:
+        sync.save(path, start)
+
+def fetch(args, metadata, incremental = False,
+        downloads = download.DEFAULT_WORKERS, verify = False, as_zip = False):
     course = canvas.Course()
     what = args[0].rstrip(os.sep)
     args = args[1:]
@@ -187,7 +299,8 @@ def fetch(args, metadata):
             fetch_all_subs(course)
         else:
             fetch_subs(course, " ".join(args), deep = True,
-                metadata = metadata == True)
+                metadata = metadata == True, incremental = incremental,
+                downloads = downloads, verify = verify, as_zip = as_zip)
     else:
         raise Exception("Don't yet know how to fetch {}.".format(str(args)))
 
@@ -235,7 +348,8 @@ def split_according_to_groups(course, subspath, path):
             if os.path.isdir(subpath):
                 src = subpath
                 tgt = os.path.join(namepath, dirname)
-                shutil.copytree(src, tgt, symlinks=True)
+                shutil.copytree(src, tgt, symlinks=True,
+                    copy_function=blobstore.copy)
 
 def main_args_parser():
     parser = argparse.ArgumentParser(
@@ -297,6 +411,37 @@ Work with users:
     parser.add_argument(
         "--metadata", action='store_true',
         help="fetch metadata only")
+    parser.add_argument(
+        "--sync", action='store_true',
+        help="fetch only the submissions changed since the last fetch")
+    parser.add_argument(
+        "--downloads", metavar="N", type=int,
+        default=download.DEFAULT_WORKERS,
+        help="download up to N files at a time (default: %(default)s)")
+    parser.add_argument(
+        "--zip", action='store_true',
+        help="fetch all submissions as a single zip file")
+    parser.add_argument(
+        "--verify", action='store_true',
+        help="download files again if their content changed since the last fetch")
+    parser.add_argument(
+        "--no-cache", action='store_true',
+        help="do not revalidate against the on-disk cache of Canvas responses")
+    parser.add_argument(
+        "--profile", action='store_true',
+        help="print the time spent per Canvas endpoint to stderr")
+    parser.add_argument(
+        "--profile-json", metavar="PATH",
+        help="write the time spent per Canvas endpoint to PATH as JSON")
+    parser.add_argument(
+        "--record", metavar="PATH",
+        help="record all Canvas traffic to a cassette at PATH")
+    parser.add_argument(
+        "--replay", metavar="PATH",
+        help="answer all Canvas requests from the cassette at PATH")
+    parser.add_argument(
+        "--replay-timing", action='store_true',
+        help="take as long to answer as the recorded requests did")
     return parser
 
 def parse_action_arg(parser, args):
@@ -513,6 +658,10 @@ def grade_args_parser():
     return parser
 
 def grade(args):
+    if any(arg == '--batch' or arg.startswith('--batch=') for arg in args):
+        batch_grade(args)
+        return
+
     args, more_attachments = grade_args_parser().parse_known_args(args)
     args.attachments += more_attachments
 
@@ -525,11 +674,8 @@ def grade(args):
         _check_filepaths([args.comment_file])
         with open(args.comment_file) as f:
             comment = f.read()
-    elif args.attachments:
-        comment = "See attached file{}.".format(
-            "" if len(args.attachments) == 1 else "s")
     else:
-        comment = None
+        comment = _default_comment(args.attachments)
 
     course = canvas.Course()
     assignment = canvas.Assignment(course)
@@ -552,26 +698,211 @@ def grade(args):
             print("Found no users with the kuid {}!".format(args.kuid))
             sys.exit(1)
 
-    for sub in assignment.submissions():
-        if sub['user_id'] in student_ids:
+    for student_id in student_ids:
+        for sub in assignment.submission(student_id):
             current_grade = sub['grade']
             if current_grade == grade:
                 print('Already graded.')
                 course.canvas.show_verification_urls(
                     course.id, assignment.id, sub['user_id'])
                 return
-    for student_id in student_ids:
-        assignment.give_feedback(student_id, args.grade, comment, args.attachments, use_post=True)
+    uploads = _upload_cache(course)
+    file_ids = upload.concurrently(
+        lambda path: _upload(uploads, assignment, student_ids[0], path),
+        args.attachments)
+    if len(student_ids) == 1:
+        feedback = {student_ids[0]: bulkgrade.Feedback(
+            args.grade, comment, file_ids)}
+
+        def send(feedback):
+            assignment.give_feedback(student_ids[0], args.grade, comment, [],
+                use_post=True, file_ids=file_ids)
+            return {student_ids[0]: None}
+    else:
+        # Grade the whole group in one go, see bulkgrade.py.
+        feedback = _group_feedback(student_ids, args.grade, comment, file_ids)
+        send = assignment.bulk_give_feedback
+
+    outcomes, skipped = bulkgrade.resume(
+        _journal(course), assignment.id, feedback, send,
+        assignment.student_submissions)
+    if skipped == len(feedback):
+        print("Already done; see {}.".format(journal.FILENAME))
+    elif len(student_ids) == 1:
+        return
+    else:
+        report_outcomes({"user {}".format(i): problem
+                         for i, problem in outcomes.items()})
+    course.canvas.show_verification_urls(
+        course.id, assignment.id, student_ids[0])
+    if any(outcomes.values()):
+        sys.exit(1)
 
-def main():
-    parser = main_args_parser()
-    args, remargs = parse_action_arg(parser, sys.argv[1:])
-    action = args.action
+def _upload_cache(course):
+    return uploadcache.UploadCache(
+        os.path.join(course.parentdir, uploadcache.FILENAME))
+
+def _blob_store(course):
+    return blobstore.BlobStore(
+        os.path.join(course.parentdir, blobstore.DIRNAME))
+
+def _journal(course):
+    return journal.Journal(os.path.join(course.parentdir, journal.FILENAME))
+
+def _upload(uploads, assignment, student_id, path):
+    """Upload a file to comment on the submission of the given student with,
+       unless it has been uploaded for the assignment before.
+    """
+    return uploads.upload(assignment.id, path,
+        lambda: assignment.upload_comment_file(student_id, path, use_post=True))
+
+def _group_feedback(student_ids, grade, comment, file_ids):
+    """Give everyone the grade, but comment (and attach the files) only once,
+       as a group comment, which Canvas shows to the whole group.
+    """
+    feedback = {student_id: bulkgrade.Feedback(grade)
+                for student_id in student_ids}
+    feedback[student_ids[0]] = bulkgrade.Feedback(grade, comment, file_ids)
+    return feedback
+
+def _default_comment(attachments):
+    if not attachments:
+        return None
+    return "See attached file{}.".format("" if len(attachments) == 1 else "s")
+
+def batch_grade_args_parser():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawTextHelpFormatter,
+        description='Grade the students listed in a manifest, see manifest.py.')
+
+    parser.add_argument('--batch', metavar='MANIFEST', required=True,
+        help='a CSV or YAML file of kuid, grade, comment, attachments')
+    parser.add_argument('-j', '--jobs', type=int,
+        default=transport.DEFAULT_POOL_SIZE,
+        help='the number of requests to have in flight (default: {})'.format(
+            transport.DEFAULT_POOL_SIZE))
+
+    return parser
+
+def _batch_students(course):
+    """The students of the course, from disk if fetched, else from Canvas."""
+    path = os.path.join(course.parentdir, "students")
+    if os.path.isdir(path):
+        return canvas.StudentList(searchdir = path)
+    return course.list_students()
+
+def _group_members(assignment, student):
+    """The students who share the submission of the given student."""
+    path = os.path.join(assignment.parentdir,
+        "{}_{}".format(student['kuid'], student['id']), ".staffeli.yml")
+    if os.path.isfile(path):
+        sub = files.load_staffeli_file(path).get('submission', {})
+        if 'student_ids' in sub:
+            return sub['student_ids']
+    return [student['id']]
+
+def batch_grade(args):
+    args = batch_grade_args_parser().parse_args(args)
+    try:
+        entries = manifest.load(args.batch)
+    except (OSError, ValueError) as e:
+        print(e)
+        sys.exit(1)
+    for entry in entries:
+        _check_grade(entry.grade)
+        _check_filepaths(entry.attachments)
 
+    # Look everything up once, up front.
+    course = canvas.Course()
+    assignment = canvas.Assignment(course)
+    students = _batch_students(course)
+    unknown = [entry.kuid for entry in entries if entry.kuid not in students]
+    if unknown:
+        print("Found no students with the kuid{} {}!".format(
+            "" if len(unknown) == 1 else "s", ", ".join(unknown)))
+        sys.exit(1)
+    groups = {}
+    graded = {}
+    for entry in entries:
+        groups[entry.kuid] = _group_members(assignment, students[entry.kuid])
+        for student_id in groups[entry.kuid]:
+            if student_id in graded:
+                print("{} and {} share a submission; grade it only once.".format(
+                    graded[student_id], entry.kuid))
+                sys.exit(1)
+            graded[student_id] = entry.kuid
+
+    if transport.pool_size() < args.jobs:
+        transport.configure(pool_size=args.jobs)
+    start = time.monotonic()
+    outcomes = {}
+    cache = _upload_cache(course)
+    log = _journal(course)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        # Each group's files are uploaded once, and shared by the group.
+        uploads = {
+            entry.kuid: [
+                pool.submit(_upload, cache, assignment,
+                    groups[entry.kuid][0], path)
+                for path in entry.attachments]
+            for entry in entries}
+
+        feedback = {}
+        for entry in entries:
+            try:
+                file_ids = [f.result() for f in uploads[entry.kuid]]
+            except Exception as e:
+                for student_id in groups[entry.kuid]:
+                    outcomes[student_id] = "upload failed: {}".format(e)
+                continue
+            comment = entry.comment or _default_comment(entry.attachments)
+            feedback.update(_group_feedback(
+                groups[entry.kuid], entry.grade, comment, file_ids))
+
+        # Canvas grades each chunk in the background; push them all at once.
+        user_ids = sorted(feedback)
+        chunks = [{i: feedback[i] for i in user_ids[n:n + bulkgrade.MAX_STUDENTS]}
+                  for n in range(0, len(user_ids), bulkgrade.MAX_STUDENTS)]
+        skipped = 0
+        for result, n in pool.map(
+                lambda chunk: _try_bulk_give_feedback(log, assignment, chunk),
+                chunks):
+            outcomes.update(result)
+            skipped += n
+
+    report_outcomes({
+        students[i]['kuid'] if i in students else "user {}".format(i): problem
+        for i, problem in outcomes.items()})
+    uploaded = cache.uploads
+    print("Took {:.1f} seconds, uploading {} file{}.".format(
+        time.monotonic() - start, uploaded, "" if uploaded == 1 else "s"))
+    if skipped:
+        print("{} student{} had already been graded; see {}.".format(
+            skipped, "" if skipped == 1 else "s", journal.FILENAME))
+    if any(outcomes.values()):
+        sys.exit(1)
+
+def _try_bulk_give_feedback(log, assignment, feedback):
+    try:
+        return bulkgrade.resume(log, assignment.id, feedback,
+            assignment.bulk_give_feedback, assignment.student_submissions)
+    except Exception as e:
+        return ({user_id: str(e) for user_id in feedback}, 0)
+
+def report_outcomes(outcomes):
+    failed = {k: v for k, v in outcomes.items() if v is not None}
+    print("Graded {} of {} student{}.".format(
+        len(outcomes) - len(failed), len(outcomes),
+        "" if len(outcomes) == 1 else "s"))
+    for who, problem in sorted(failed.items()):
+        print("- {}: {}".format(who, problem))
+
+def run_action(parser, action, args, remargs):
     if action == "clone":
         clone(remargs)
     elif action == "fetch":
-        fetch(remargs, args.metadata)
+        fetch(remargs, args.metadata, args.sync, args.downloads, args.verify,
+            args.zip)
     elif action == "grade":
         grade(remargs)
     elif action == "group":
@@ -586,5 +917,54 @@ def main():
         print("Unknown action {}.".format(action))
         parser.print_usage()
 
+def report_retries():
+    retries = transport.stats()['retries']
+    if retries > 0:
+        print("Canvas had a few hiccups; {} request{} had to be retried.".format(
+            retries, "" if retries == 1 else "s"))
+
+def report_profile(args):
+    recorder = transport.recorder()
+    if recorder is None:
+        return
+    if args.profile:
+        print(recorder.table(), file=sys.stderr)
+        if recorder.uploads:
+            print("\n" + recorder.upload_table(), file=sys.stderr)
+        stats = transport.stats()
+        print("\n" + ", ".join(
+            "{}: {}".format(k, v) for k, v in sorted(stats.items())),
+            file=sys.stderr)
+    if args.profile_json:
+        with open(args.profile_json, 'w') as f:
+            json.dump({
+                'endpoints': recorder.publicjson(),
+                'uploads': recorder.uploads_publicjson(),
+                'totals': transport.stats()
+            }, f, indent=2, sort_keys=True)
+
+def main():
+    parser = main_args_parser()
+    args, remargs = parse_action_arg(parser, sys.argv[1:])
+    action = args.action
+
+    transport.enable_memo()
+    # A cassette must not depend on what happens to be in the cache.
+    if args.record:
+        transport.record(args.record)
+    elif args.replay:
+        transport.replay(args.replay, args.replay_timing)
+    elif not args.no_cache:
+        transport.enable_cache()
+    if args.profile or args.profile_json:
+        transport.enable_metrics()
+
+    try:
+        run_action(parser, action, args, remargs)
+    finally:
+        transport.stop_cassette()
+        report_retries()
+        report_profile(args)
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,280 @@
+"""Download many files at a time.
+
+Fetching the attachments of an assignment one file after the other spends
+most of the time waiting on the network. A ``Downloader`` instead hands the
+files to a pool of workers as they are added, with at most a few downloads
+from any one host at a time, so as not to take up all of its connections.
+While it works, a line on stderr shows how many files have arrived, and how
+fast.
+
+Files are not kept in the memo or the on-disk cache of Canvas responses (see
+transport.py): they are large, and only fetched once. A file is written to
+disk as it arrives, to ``<path>.part``, and renamed when complete and of the
+size the server said it would be, so that a failed download does not leave
+a partial file behind. If the connection drops, the download picks up where
+it stopped with an HTTP Range request, rather than start over; so does the
+next attempt to download the file to the same path. Given a blob store (see
+blobstore.py), and the id of a file on Canvas, the file is only downloaded if
+it is not in the store already."""
+
+import concurrent.futures
+import os
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+
+from typing import (  # noqa: F401
+    Callable, Dict, IO, Iterable, List, Optional, Tuple)
+from urllib.request import Request
+
+from staffeli import blobstore, transport, uploadcache
+
+# Download this many files at a time,
+DEFAULT_WORKERS = 8
+# but at most this many from the same host.
+DEFAULT_PER_HOST = 4
+# Pick up a download where it stopped this many times, as long as it gets on.
+RESUME_ATTEMPTS = 5
+
+
+def canvas_file_id(url: str) -> Optional[int]:
+    """The id of the file on Canvas that ``url`` downloads, if it is one."""
+    match = re.search(
+        r'/files/(\d+)/download$', urllib.parse.urlsplit(url).path)
+    return int(match.group(1)) if match else None
+
+
+def _expected_size(resp: transport.Response) -> Optional[int]:
+    """The size of the whole file, as the server tells it."""
+    if resp.status == 206:
+        total = (resp.getheader('Content-Range') or '').rpartition('/')[2]
+        return int(total) if total.isdigit() else None
+    length = resp.getheader('Content-Length')
+    return int(length) if length is not None and length.isdigit() else None
+
+
+def _getsize(path: str) -> int:
+    return os.path.getsize(path) if os.path.isfile(path) else 0
+
+
+def _remove_empty(path: str) -> None:
+    if os.path.isfile(path) and not os.path.getsize(path):
+        os.remove(path)
+
+
+def fetch(
+        url: str, path: str, size: Optional[int] = None) -> Tuple[int, str]:
+    """Download the file at ``url`` to ``path``, and return its size and
+    SHA-256. Raises OSError if the file is not of the expected ``size``, or
+    of the size the server said."""
+    partpath = path + '.part'
+    attempt = 0
+    while True:
+        offset = _getsize(partpath)
+        headers = {'Range': 'bytes={}-'.format(offset)} if offset else {}
+        try:
+            with open(partpath, 'ab') as f:
+                resp = transport.stream(Request(url, headers=headers), f)
+            break
+        except urllib.error.HTTPError as e:
+            if e.code != 416 or not offset:
+                _remove_empty(partpath)
+                raise
+            # The part we have is no part of the file; start over.
+            os.remove(partpath)
+        except urllib.error.URLError:
+            attempt += 1
+            if attempt > RESUME_ATTEMPTS or _getsize(partpath) <= offset:
+                # Keep what did arrive, for the next attempt.
+                _remove_empty(partpath)
+                raise
+
+    actual = _getsize(partpath)
+    for expected in (_expected_size(resp), size):
+        if expected is not None and actual != expected:
+            os.remove(partpath)
+            raise OSError("Expected {} bytes from {}, but got {}.".format(
+                expected, url, actual))
+    sha256 = uploadcache.sha256(partpath)
+    os.replace(partpath, path)
+    return (actual, sha256)
+
+
+def _mib(size: float) -> str:
+    return '{:.1f} MiB'.format(size / (1024 * 1024))
+
+
+class Progress:
+    """Counts the files and bytes that have arrived, and shows them on a line
+    of its own, if the stream is a terminal."""
+
+    def __init__(self, stream: IO[str]) -> None:
+        self.stream = stream
+        self.live = stream.isatty()
+        self.start = time.monotonic()
+        self.added = 0
+        self.done = 0
+        self.stored = 0
+        self.size = 0
+        self._lock = threading.Lock()
+        self._shown = 0
+
+    def line(self) -> str:
+        seconds = max(time.monotonic() - self.start, 1e-3)
+        stored = ' ({} from the blob store)'.format(self.stored) \
+            if self.stored else ''
+        return '{}/{} files{}, {}, {}/s'.format(
+            self.done, self.added, stored, _mib(self.size),
+            _mib(self.size / seconds))
+
+    def _show(self) -> None:
+        """Assumes the lock is held."""
+        if self.live:
+            line = self.line()
+            self.stream.write('\r' + line.ljust(self._shown))
+            self.stream.flush()
+            self._shown = len(line)
+
+    def _clear(self) -> None:
+        """Assumes the lock is held."""
+        if self.live and self._shown:
+            self.stream.write('\r' + ' ' * self._shown + '\r')
+            self.stream.flush()
+            self._shown = 0
+
+    def add(self) -> None:
+        with self._lock:
+            self.added += 1
+            self._show()
+
+    def arrived(self, size: int, stored: bool = False) -> None:
+        """Count a file as done, downloaded or taken from the blob store."""
+        with self._lock:
+            self.done += 1
+            if stored:
+                self.stored += 1
+            else:
+                self.size += size
+            self._show()
+
+    def say(self, message: str) -> None:
+        """Print a message to stdout, without mixing it up with the line."""
+        with self._lock:
+            self._clear()
+            print(message)
+            sys.stdout.flush()
+            self._show()
+
+    def finish(self) -> None:
+        with self._lock:
+            self._clear()
+            if self.added:
+                seconds = time.monotonic() - self.start
+                self.stream.write(
+                    'Downloaded {} in {:.1f} s.\n'.format(
+                        self.line(), seconds))
+                self.stream.flush()
+
+
+class Downloader:
+    """A pool of workers that download files as they are added.
+
+    Use it as a context manager: on leaving the block, it waits for all the
+    files to arrive. If some downloads failed, the others are still
+    completed, and then the first error is raised."""
+
+    def __init__(
+            self, workers: int = DEFAULT_WORKERS,
+            per_host: int = DEFAULT_PER_HOST,
+            stream: Optional[IO[str]] = None,
+            store: Optional[blobstore.BlobStore] = None) -> None:
+        self.per_host = per_host
+        self.store = store
+        self.progress = Progress(stream or sys.stderr)
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers)
+        self._lock = threading.Lock()
+        self._hosts = {}  # type: Dict[str, threading.BoundedSemaphore]
+        self._futures = []  # type: List[concurrent.futures.Future]
+
+    def _host(self, url: str) -> threading.BoundedSemaphore:
+        netloc = urllib.parse.urlsplit(url).netloc
+        with self._lock:
+            if netloc not in self._hosts:
+                self._hosts[netloc] = threading.BoundedSemaphore(
+                    self.per_host)
+            return self._hosts[netloc]
+
+    def _fetch(self, url: str, path: str, size: Optional[int]) -> None:
+        with self._host(url):
+            fetch(url, path, size)
+
+    def _download(
+            self, url: str, path: str,
+            done: Optional[Callable[[int, str], None]],
+            file_id: Optional[int], size: Optional[int]) -> None:
+        if self.store is not None and file_id is not None:
+            size, sha256, fresh = self.store.fetch(
+                file_id, path, lambda target: self._fetch(url, target, size))
+        else:
+            with self._host(url):
+                size, sha256 = fetch(url, path, size)
+            fresh = True
+        self.progress.arrived(size, stored=not fresh)
+        if done is not None:
+            done(size, sha256)
+
+    def add(
+            self, url: str, path: str,
+            done: Optional[Callable[[int, str], None]] = None,
+            file_id: Optional[int] = None,
+            size: Optional[int] = None) -> None:
+        """Download ``url`` to ``path``, and then call ``done`` with its size
+        and SHA-256, from another thread. The file is looked for in the blob
+        store, if any, by its ``file_id`` on Canvas, which is taken from the
+        url if not given. If the ``size`` of the file is known, the download
+        is checked against it."""
+        if file_id is None:
+            file_id = canvas_file_id(url)
+        self.progress.add()
+        self._futures.append(self._pool.submit(
+            self._download, url, path, done, file_id, size))
+
+    def say(self, message: str) -> None:
+        self.progress.say(message)
+
+    def wait(self) -> None:
+        try:
+            concurrent.futures.wait(self._futures)
+        finally:
+            self._pool.shutdown()
+            self.progress.finish()
+        for future in self._futures:
+            future.result()
+
+    def __enter__(self) -> 'Downloader':
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        if exc[0] is not None:
+            # Do not start on downloads nobody will wait for.
+            for future in self._futures:
+                future.cancel()
+            self._pool.shutdown()
+            self.progress.finish()
+            return
+        self.wait()
+
+
+def download_all(
+        downloads: Iterable[Tuple[str, str]],
+        workers: int = DEFAULT_WORKERS,
+        per_host: int = DEFAULT_PER_HOST,
+        store: Optional[blobstore.BlobStore] = None) -> None:
+    """Download each (url, path) pair, several at a time."""
+    with Downloader(workers, per_host, store=store) as downloader:
+        for url, path in downloads:
+            downloader.add(url, path)
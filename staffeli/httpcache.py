@@ -0,0 +1,206 @@
+"""An on-disk cache of Canvas API responses.
+
+Canvas tags its responses with an ``ETag`` (and sometimes a ``Last-Modified``
+date). When we have seen a response before, we ask Canvas whether it has
+changed since (``If-None-Match``, ``If-Modified-Since``), and if it has not,
+Canvas answers with an empty ``304 Not Modified``, and we serve the response
+from disk instead. This way, the cache is never stale, but we do not download
+the same large listings over and over.
+
+The cache is capped in size. When it grows too large, the least recently used
+responses are evicted."""
+
+import json
+import os
+import os.path
+import sys
+import threading
+
+from email.message import Message
+from typing import Any, Callable, Dict, List, Optional, Tuple  # noqa: F401
+from urllib.request import Request
+
+from staffeli.transport import Response, request_key
+
+DEFAULT_MAX_SIZE = 100 * 1024 * 1024
+
+Send = Callable[[Request], Response]
+
+
+def default_path() -> str:
+    """A per-user cache directory, following platform conventions."""
+    if os.name == 'nt':
+        base = os.environ.get(
+            'LOCALAPPDATA', os.path.expanduser('~'))
+    elif sys.platform == 'darwin':
+        base = os.path.join(os.path.expanduser('~'), 'Library', 'Caches')
+    else:
+        base = os.environ.get(
+            'XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'staffeli', 'http')
+
+
+def _cachable(resp: Response) -> bool:
+    if resp.status != 200:
+        return False
+    if 'no-store' in (resp.getheader('Cache-Control') or ''):
+        return False
+    return resp.getheader('ETag') is not None or \
+        resp.getheader('Last-Modified') is not None
+
+
+class ResponseCache:
+    def __init__(self, path: str, max_size: int = DEFAULT_MAX_SIZE) -> None:
+        self.path = path
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._index = None  # type: Optional[Dict[str, Tuple[int, float]]]
+        self._size = 0
+        self._stats = {
+            'cache_hits': 0,
+            'cache_misses': 0,
+            'cache_evictions': 0
+        }
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self._stats[key] += 1
+
+    def _paths(self, key: str) -> Tuple[str, str]:
+        base = os.path.join(self.path, key[:2], key)
+        return (base + '.json', base + '.body')
+
+    def _load_index(self) -> Dict[str, Tuple[int, float]]:
+        """Map each cache entry to its size and when it was last used.
+
+        Assumes the lock is held."""
+        if self._index is None:
+            self._index = {}
+            self._size = 0
+            if os.path.isdir(self.path):
+                for parent, _, names in os.walk(self.path):
+                    for name in names:
+                        if not name.endswith('.body'):
+                            continue
+                        st = os.stat(os.path.join(parent, name))
+                        self._index[name[:-5]] = (st.st_size, st.st_mtime)
+                        self._size += st.st_size
+        return self._index
+
+    def _remove(self, key: str) -> None:
+        """Assumes the lock is held."""
+        index = self._load_index()
+        if key in index:
+            self._size -= index.pop(key)[0]
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _evict(self) -> None:
+        """Assumes the lock is held."""
+        index = self._load_index()
+        by_age = sorted(index.items(), key=lambda kv: kv[1][1])
+        for key, _ in by_age:
+            if self._size <= self.max_size:
+                break
+            self._remove(key)
+            self._stats['cache_evictions'] += 1
+
+    def lookup(self, key: str) -> Optional[Tuple[Dict[str, Any], str]]:
+        metapath, bodypath = self._paths(key)
+        try:
+            with open(metapath, 'r') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not os.path.isfile(bodypath):
+            return None
+        return (meta, bodypath)
+
+    def store(self, key: str, resp: Response) -> None:
+        if len(resp.body) > self.max_size:
+            return
+        metapath, bodypath = self._paths(key)
+        meta = {
+            'url': resp.url,
+            'reason': resp.reason,
+            'headers': list(resp.headers.items())
+        }
+        with self._lock:
+            self._remove(key)
+            os.makedirs(os.path.dirname(metapath), exist_ok=True)
+            for path, data in [
+                    (bodypath, resp.body),
+                    (metapath, json.dumps(meta).encode('utf-8'))]:
+                tmppath = path + '.tmp'
+                with open(tmppath, 'wb') as f:
+                    f.write(data)
+                os.replace(tmppath, path)
+            st = os.stat(bodypath)
+            self._load_index()[key] = (st.st_size, st.st_mtime)
+            self._size += st.st_size
+            self._evict()
+
+    def _touch(self, key: str, bodypath: str) -> None:
+        with self._lock:
+            index = self._load_index()
+            try:
+                os.utime(bodypath)
+            except OSError:
+                return
+            if key in index:
+                index[key] = (index[key][0], os.stat(bodypath).st_mtime)
+
+    def urlopen(self, req: Request, send: Send) -> Response:
+        """Perform a GET request with ``send``, revalidating the cached
+        response, if there is one."""
+        key = request_key(req)
+        cached = self.lookup(key)
+        if cached is None:
+            self._count('cache_misses')
+            resp = send(req)
+            if _cachable(resp):
+                self.store(key, resp)
+            return resp
+
+        meta, bodypath = cached
+        headers = Message()
+        for name, value in meta['headers']:
+            headers[name] = value
+
+        conditional = Request(
+            req.full_url, data=req.data, method=req.get_method(),
+            headers=dict(req.header_items()))
+        etag = headers.get('ETag')
+        if etag is not None:
+            conditional.add_header('If-None-Match', etag)
+        last_modified = headers.get('Last-Modified')
+        if last_modified is not None:
+            conditional.add_header('If-Modified-Since', last_modified)
+
+        resp = send(conditional)
+        if resp.status != 304:
+            self._count('cache_misses')
+            if _cachable(resp):
+                self.store(key, resp)
+            else:
+                with self._lock:
+                    self._remove(key)
+            return resp
+
+        try:
+            with open(bodypath, 'rb') as f:
+                body = f.read()
+        except OSError:
+            # Evicted under our feet; ask again, unconditionally.
+            self._count('cache_misses')
+            return send(req)
+        self._touch(key, bodypath)
+        self._count('cache_hits')
+        return Response(meta['url'], 200, meta['reason'], headers, body)
@@ -0,0 +1,77 @@
+"""Remember what we have done on Canvas, so that we can pick up from there.
+
+Before we do something on Canvas that we would rather not do twice (e.g.,
+post a grade and a comment), we write to the journal that we are about to do
+it, and when Canvas has confirmed it, we write that it is done. Each write is
+flushed to disk before we go on. So, if a command dies halfway, e.g., because
+the network dropped, a rerun knows which operations are done (and skips
+them), and which are in doubt: these may or may not have reached Canvas, and
+we have to ask Canvas to find out.
+
+The journal is a file with one JSON object per line. It is only ever
+appended to, so a crash can at worst leave a partial last line, which is
+ignored."""
+
+import json
+import os
+import threading
+
+from typing import Dict, Iterable, Optional  # noqa: F401
+
+FILENAME = '.staffeli-journal'
+
+BEGUN = 'begun'
+DONE = 'done'
+
+
+class Journal:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._states = {}  # type: Dict[str, str]
+        # Whether the last line is partial, and must be ended before we write.
+        self._partial = False
+        if os.path.isfile(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    self._partial = not line.endswith('\n')
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if entry.get('op') == 'begin':
+                        self._states.setdefault(entry['key'], BEGUN)
+                    elif entry.get('op') == 'commit':
+                        self._states[entry['key']] = DONE
+
+    def state(self, key: str) -> Optional[str]:
+        """BEGUN, DONE, or None if we never started on it."""
+        with self._lock:
+            return self._states.get(key)
+
+    def _write(self, op: str, keys: Iterable[str]) -> None:
+        lines = [json.dumps({'op': op, 'key': key}) + '\n' for key in keys]
+        if not lines:
+            return
+        with self._lock:
+            if self._partial:
+                lines.insert(0, '\n')
+                self._partial = False
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(''.join(lines))
+                f.flush()
+                os.fsync(f.fileno())
+
+    def begin(self, keys: Iterable[str]) -> None:
+        keys = list(keys)
+        self._write('begin', keys)
+        with self._lock:
+            for key in keys:
+                self._states.setdefault(key, BEGUN)
+
+    def commit(self, keys: Iterable[str]) -> None:
+        keys = list(keys)
+        self._write('commit', keys)
+        with self._lock:
+            for key in keys:
+                self._states[key] = DONE
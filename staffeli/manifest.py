@@ -0,0 +1,93 @@
+"""Read the grades for a whole assignment from a file.
+
+A manifest lists a grade, an optional comment, and optional attachments for
+each student, identified by their KU-id. It is either a CSV file with a header
+row, e.g.,
+
+    kuid,grade,comment,attachments
+    abc123,pass,Well done.,abc123/feedback.pdf
+    def456,fail,See the attached files.,def456/feedback.pdf;def456/tests.txt
+
+where several attachments are separated by ``;``, or a YAML file with a list
+of entries:
+
+    - kuid: abc123
+      grade: pass
+      comment: Well done.
+      attachments: [abc123/feedback.pdf]
+
+Relative attachment paths are relative to the directory of the manifest."""
+
+import csv
+import os.path
+import yaml
+
+from typing import Any, List, Optional, Set  # noqa: F401
+
+FIELDS = ['kuid', 'grade', 'comment', 'attachments']
+
+
+class Entry:
+    def __init__(
+            self, kuid: str, grade: str, comment: Optional[str] = None,
+            attachments: Optional[List[str]] = None) -> None:
+        self.kuid = kuid
+        self.grade = grade
+        self.comment = comment
+        self.attachments = attachments or []
+
+
+def _entry(row: Any, basedir: str, where: str) -> Entry:
+    if not isinstance(row, dict):
+        raise ValueError("{}: expected a mapping.".format(where))
+    if None in row:
+        # csv.DictReader puts extra cells under None.
+        raise ValueError("{}: too many fields.".format(where))
+    unknown = set(row) - set(FIELDS)
+    if unknown:
+        raise ValueError("{}: unknown field{} {}.".format(
+            where, "" if len(unknown) == 1 else "s",
+            ", ".join(sorted(unknown))))
+    kuid = str(row.get('kuid') or '').strip()
+    grade = str(row.get('grade') or '').strip()
+    if not kuid or not grade:
+        raise ValueError("{}: both a kuid and a grade are needed.".format(
+            where))
+
+    attachments = row.get('attachments') or []
+    if isinstance(attachments, str):
+        attachments = attachments.split(';')
+    paths = [os.path.join(basedir, a.strip())
+             for a in attachments if a.strip()]
+
+    comment = row.get('comment')
+    if comment is not None:
+        comment = str(comment).strip() or None
+    return Entry(kuid, grade, comment, paths)
+
+
+def load(path: str) -> List[Entry]:
+    """Read a manifest; YAML if the file name ends in .yml or .yaml, and CSV
+    otherwise."""
+    basedir = os.path.dirname(os.path.abspath(path))
+    with open(path, newline='') as f:
+        if path.endswith(('.yml', '.yaml')):
+            rows = yaml.safe_load(f) or []
+            if not isinstance(rows, list):
+                raise ValueError("{}: expected a list of entries.".format(
+                    path))
+            where = ['{}: entry {}'.format(path, i + 1)
+                     for i in range(len(rows))]
+        else:
+            rows = list(csv.DictReader(f))
+            # Line 1 is the header.
+            where = ['{}:{}'.format(path, i + 2) for i in range(len(rows))]
+
+    entries = [_entry(row, basedir, w) for row, w in zip(rows, where)]
+    seen = set()  # type: Set[str]
+    for entry in entries:
+        if entry.kuid in seen:
+            raise ValueError("{}: {} is graded more than once.".format(
+                path, entry.kuid))
+        seen.add(entry.kuid)
+    return entries
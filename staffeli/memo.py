@@ -0,0 +1,112 @@
+"""Remember GET responses for the rest of the session.
+
+Within a single staffeli command, the same listings are often requested
+several times over (e.g., the sections of a course, once per section to look
+up). A ``Memo`` answers repeated GET requests from memory, and if the same
+request is already in flight on another thread, waits for that response
+rather than sending the request again.
+
+Any request that may change something on Canvas (i.e., anything but a GET)
+clears the memo, so that we never serve a response from before a change.
+
+The memo is capped in size, so that, e.g., the pages of a large listing are
+not all kept in memory when they are only needed once. When it grows too
+large, the least recently used responses are forgotten."""
+
+import collections
+import threading
+
+from typing import Callable, Dict, Optional  # noqa: F401
+from urllib.request import Request
+
+from staffeli.transport import Response, request_key
+
+Send = Callable[[Request], Response]
+
+DEFAULT_MAX_SIZE = 16 * 1024 * 1024
+
+
+class _Pending:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.response = None  # type: Optional[Response]
+        self.error = None  # type: Optional[BaseException]
+
+
+class Memo:
+    def __init__(self, max_size: int = DEFAULT_MAX_SIZE) -> None:
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        # By when they were last used, least recently first.
+        self._responses = collections.OrderedDict(
+        )  # type: collections.OrderedDict[str, Response]
+        self._size = 0
+        self._pending = {}  # type: Dict[str, _Pending]
+        self._generation = 0
+        self._stats = {
+            'memo_hits': 0,
+            'memo_coalesced': 0,
+            'memo_evictions': 0
+        }
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._responses = collections.OrderedDict()
+            self._size = 0
+            self._pending = {}
+            self._generation += 1
+
+    def _remember(self, key: str, response: Response) -> None:
+        """Assumes the lock is held."""
+        if len(response.body) > self.max_size:
+            return
+        if key in self._responses:
+            self._size -= len(self._responses.pop(key).body)
+        self._responses[key] = response
+        self._size += len(response.body)
+        while self._size > self.max_size:
+            _, evicted = self._responses.popitem(last=False)
+            self._size -= len(evicted.body)
+            self._stats['memo_evictions'] += 1
+
+    def urlopen(self, req: Request, send: Send) -> Response:
+        key = request_key(req)
+        with self._lock:
+            if key in self._responses:
+                self._stats['memo_hits'] += 1
+                self._responses.move_to_end(key)
+                return self._responses[key]
+            pending = self._pending.get(key)
+            leader = pending is None
+            if pending is None:
+                pending = self._pending[key] = _Pending()
+            else:
+                self._stats['memo_coalesced'] += 1
+            generation = self._generation
+
+        if not leader:
+            pending.done.wait()
+            if pending.response is None:
+                assert pending.error is not None
+                raise pending.error
+            return pending.response
+
+        try:
+            pending.response = send(req)
+            return pending.response
+        except BaseException as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._pending.get(key) is pending:
+                    del self._pending[key]
+                # Do not remember responses to requests sent before a change.
+                if pending.response is not None and \
+                        generation == self._generation:
+                    self._remember(key, pending.response)
+            pending.done.set()
@@ -0,0 +1,186 @@
+"""Record where the time goes when talking to Canvas.
+
+The transport reports every request to a ``Recorder``, which groups them by
+endpoint template (e.g., ``GET courses/:id/assignments/:id/submissions``),
+and keeps track of the number of calls, pages, bytes, retries, and a latency
+histogram for each. It also keeps track of how long each file upload took.
+See ``staffeli --profile``."""
+
+import bisect
+import re
+import threading
+import urllib.parse
+
+from typing import Any, Dict, List  # noqa: F401
+
+# Upper bounds of the latency histogram buckets, in milliseconds.
+BUCKETS = [25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000]
+
+_API_PREFIX = re.compile(r'^/?api/v1/')
+# Numeric ids, SIS ids, and the opaque keys of, e.g., file uploads.
+_ID = re.compile(r'^(\d+|sis_[a-z_]+_id:.*|self|[0-9a-f]{16,})$')
+
+
+def endpoint_template(method: str, url: str) -> str:
+    """Drop the host and query, and replace ids in the path by ``:id``."""
+    parts = urllib.parse.urlsplit(url)
+    path = _API_PREFIX.sub('', parts.path.lstrip('/'))
+    segments = [
+        ':id' if _ID.match(segment) else segment
+        for segment in path.split('/') if segment]
+    if not parts.path.lstrip('/').startswith('api/'):
+        segments.insert(0, parts.netloc)
+    return '{} {}'.format(method, '/'.join(segments))
+
+
+def _percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(p * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Endpoint:
+    def __init__(self) -> None:
+        self.calls = 0
+        self.pages = 0
+        self.errors = 0
+        self.retries = 0
+        self.bytes_wire = 0
+        self.bytes_decoded = 0
+        self.latencies = []  # type: List[float]
+        self.histogram = [0] * (len(BUCKETS) + 1)
+
+    def add(
+            self, seconds: float, page: bool, error: bool, retries: int,
+            bytes_wire: int, bytes_decoded: int) -> None:
+        self.calls += 1
+        self.pages += int(page)
+        self.errors += int(error)
+        self.retries += retries
+        self.bytes_wire += bytes_wire
+        self.bytes_decoded += bytes_decoded
+        self.latencies.append(seconds)
+        self.histogram[bisect.bisect_left(BUCKETS, seconds * 1000)] += 1
+
+    def total(self) -> float:
+        return sum(self.latencies)
+
+    def publicjson(self) -> Dict[str, Any]:
+        buckets = ['<={}ms'.format(b) for b in BUCKETS] + \
+            ['>{}ms'.format(BUCKETS[-1])]
+        return {
+            'calls': self.calls,
+            'pages': self.pages,
+            'errors': self.errors,
+            'retries': self.retries,
+            'bytes_wire': self.bytes_wire,
+            'bytes_decoded': self.bytes_decoded,
+            'seconds_total': self.total(),
+            'ms_p50': _percentile(self.latencies, 0.5) * 1000,
+            'ms_p95': _percentile(self.latencies, 0.95) * 1000,
+            'ms_max': max(self.latencies) * 1000 if self.latencies else 0.0,
+            'histogram': dict(zip(buckets, self.histogram))
+        }
+
+
+class Upload:
+    def __init__(
+            self, name: str, size: int, seconds: float,
+            polls: int, waited: float) -> None:
+        self.name = name
+        self.size = size
+        self.seconds = seconds
+        self.polls = polls
+        self.waited = waited
+
+    def publicjson(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'size': self.size,
+            'seconds': self.seconds,
+            'polls': self.polls,
+            'seconds_waiting': self.waited
+        }
+
+
+def _table(header: List[str], rows: List[List[str]]) -> str:
+    """Left-align the first column, and right-align the rest."""
+    widths = [max(len(row[i]) for row in [header] + rows)
+              for i in range(len(header))]
+    lines = []
+    for row in [header] + rows:
+        cells = [row[0].ljust(widths[0])] + \
+            [cell.rjust(width) for cell, width in zip(row[1:], widths[1:])]
+        lines.append('  '.join(cells))
+    return '\n'.join(lines)
+
+
+class Recorder:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.endpoints = {}  # type: Dict[str, Endpoint]
+        self.uploads = []  # type: List[Upload]
+
+    def record(
+            self, method: str, url: str, seconds: float,
+            page: bool = False, error: bool = False, retries: int = 0,
+            bytes_wire: int = 0, bytes_decoded: int = 0) -> None:
+        name = endpoint_template(method, url)
+        with self._lock:
+            if name not in self.endpoints:
+                self.endpoints[name] = Endpoint()
+            self.endpoints[name].add(
+                seconds, page, error, retries, bytes_wire, bytes_decoded)
+
+    def record_upload(
+            self, name: str, size: int, seconds: float,
+            polls: int = 0, waited: float = 0.0) -> None:
+        """Record a file upload, start to finish, including any time spent
+        waiting for Canvas to fetch the file (see upload.via_url)."""
+        with self._lock:
+            self.uploads.append(Upload(name, size, seconds, polls, waited))
+
+    def publicjson(self) -> Dict[str, Any]:
+        with self._lock:
+            return {name: endpoint.publicjson()
+                    for name, endpoint in self.endpoints.items()}
+
+    def uploads_publicjson(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [upload.publicjson() for upload in self.uploads]
+
+    def upload_table(self) -> str:
+        """A summary of the uploads, with the slowest first."""
+        header = ['Upload', 'KiB', 'Total s', 'Waiting s', 'Polls']
+        with self._lock:
+            rows = [[
+                u.name,
+                '{:.1f}'.format(u.size / 1024),
+                '{:.2f}'.format(u.seconds),
+                '{:.2f}'.format(u.waited),
+                str(u.polls)
+            ] for u in sorted(self.uploads, key=lambda u: -u.seconds)]
+        return _table(header, rows)
+
+    def table(self) -> str:
+        """A summary, with the endpoints that took the longest first."""
+        header = [
+            'Endpoint', 'Calls', 'Pages', 'Retries', 'Total s',
+            'p50 ms', 'p95 ms', 'Max ms', 'KiB wire', 'KiB data']
+        rows = []  # type: List[List[str]]
+        with self._lock:
+            endpoints = sorted(
+                self.endpoints.items(), key=lambda kv: -kv[1].total())
+            for name, e in endpoints:
+                j = e.publicjson()
+                rows.append([
+                    name, str(e.calls), str(e.pages), str(e.retries),
+                    '{:.2f}'.format(e.total()),
+                    '{:.0f}'.format(j['ms_p50']),
+                    '{:.0f}'.format(j['ms_p95']),
+                    '{:.0f}'.format(j['ms_max']),
+                    '{:.1f}'.format(e.bytes_wire / 1024),
+                    '{:.1f}'.format(e.bytes_decoded / 1024)])
+        return _table(header, rows)
@@ -0,0 +1,136 @@
+"""Walk the pages of a list-returning Canvas API call.
+
+See <https://canvas.instructure.com/doc/api/file.pagination.html>.
+
+Canvas tells us where the next page is in the ``Link`` header. Usually, it
+also tells us where the ``last`` page is, and the pages are simply numbered
+(``page=2``, ``page=3``, etc.). In this case, we need not wait for one page to
+arrive before asking for the next: we fetch the remaining pages concurrently,
+and hand them back in order. Some endpoints use opaque bookmarks instead
+(``page=bookmark:...``), and then there is nothing to do but walk the pages
+one by one."""
+
+import collections
+import concurrent.futures
+import urllib.parse
+
+from typing import Deque  # noqa: F401
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+DEFAULT_WORKERS = 4
+
+Links = Dict[str, str]
+Fetch = Callable[[str], Tuple[Any, Links]]
+
+_workers = DEFAULT_WORKERS
+
+
+def configure(workers: int) -> None:
+    """Set the number of pages to fetch concurrently (1 to disable)."""
+    global _workers
+    _workers = max(1, workers)
+
+
+def _parse_link(s: str) -> Tuple[str, str]:
+    link, rel = s.split('; rel="')
+    link = link.strip()[1:-1]
+    rel = rel[:-1]
+    return (rel, link)
+
+
+def parse_link_header(header: Optional[str]) -> Links:
+    """Map each ``rel`` in a ``Link`` header to its URL."""
+    if not header:
+        return {}
+    return dict(_parse_link(s) for s in header.split(','))
+
+
+def _page_number(url: str) -> Optional[int]:
+    query = urllib.parse.urlsplit(url).query
+    for key, value in urllib.parse.parse_qsl(query, keep_blank_values=True):
+        if key == 'page':
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+
+def _with_page(url: str, page: int) -> str:
+    parts = urllib.parse.urlsplit(url)
+    query = [
+        (key, str(page) if key == 'page' else value)
+        for key, value in urllib.parse.parse_qsl(
+            parts.query, keep_blank_values=True)]
+    return urllib.parse.urlunsplit(parts._replace(
+        query=urllib.parse.urlencode(query, safe='[]@')))
+
+
+def _numbered_pages(links: Links) -> Optional[Tuple[str, int, int]]:
+    """The next page URL, and the range of pages left, if pages are numbered.
+    """
+    if 'next' not in links or 'last' not in links:
+        return None
+    first = _page_number(links['next'])
+    last = _page_number(links['last'])
+    if first is None or last is None or first > last:
+        return None
+    return (links['next'], first, last)
+
+
+def _has_next(links: Links) -> bool:
+    if 'next' not in links:
+        return False
+    return 'last' not in links or links.get('current') != links['last']
+
+
+def _sequential(fetch: Fetch, links: Links) -> Iterator[Any]:
+    while _has_next(links):
+        data, links = fetch(links['next'])
+        yield data
+
+
+def iter_pages(
+        fetch: Fetch, url: str,
+        workers: Optional[int] = None) -> Iterator[Any]:
+    """Yield the data of every page, in order, starting with ``url``.
+
+    ``fetch`` gets a single page, returning its data, and the parsed ``Link``
+    header. At most ``workers`` pages are in flight at any one time, so a
+    slow consumer does not cause all of the pages to pile up in memory."""
+    if workers is None:
+        workers = _workers
+
+    data, links = fetch(url)
+    yield data
+
+    numbered = _numbered_pages(links)
+    if numbered is None or workers <= 1:
+        yield from _sequential(fetch, links)
+        return
+
+    template, first, last = numbered
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    pending = collections.deque()  # type: Deque[concurrent.futures.Future]
+    pages = iter(range(first, last + 1))
+
+    def submit() -> None:
+        page = next(pages, None)
+        if page is not None:
+            pending.append(executor.submit(fetch, _with_page(template, page)))
+
+    try:
+        for _ in range(workers):
+            submit()
+        while pending:
+            data, links = pending.popleft().result()
+            submit()
+            yield data
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+    # Entries may have been added since we looked at the first page, in which
+    # case the last page is no longer the last.
+    yield from _sequential(fetch, links)
@@ -0,0 +1,117 @@
+"""Adapt the number of requests in flight to Canvas' rate limit.
+
+See <https://canvas.instructure.com/doc/api/file.throttling.html>.
+
+Canvas keeps a "leaky bucket" per user. Every request costs something, and is
+charged an additional, up-front penalty while it is in flight. Each response
+tells us what the request cost (``X-Request-Cost``), and what is left in the
+bucket (``X-Rate-Limit-Remaining``). If the bucket runs dry, Canvas answers
+``403 Forbidden (Rate Limit Exceeded)``.
+
+A ``Throttle`` uses additive-increase/multiplicative-decrease (AIMD), much like
+TCP congestion control: while there is room in the bucket for another round of
+requests at the going cost, it allows one more request in flight per round;
+when the bucket runs low, it halves the number of requests in flight; when we
+are throttled, it also pauses for a bit to let the bucket drain."""
+
+import threading
+import time
+
+from email.message import Message
+from typing import Dict, Optional
+
+# Canvas charges this much up front for every request in flight.
+PREFLIGHT_COST = 50.0
+
+DEFAULT_INITIAL = 4
+DEFAULT_MAXIMUM = 32
+
+# How long to pause all requests after being throttled, in seconds.
+COOLDOWN = 2.0
+
+
+def _float_header(headers: Optional[Message], name: str) -> Optional[float]:
+    if headers is None:
+        return None
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def is_throttled(status: int, body: bytes) -> bool:
+    return status == 429 or \
+        (status == 403 and b'Rate Limit Exceeded' in body)
+
+
+class Throttle:
+    def __init__(
+            self,
+            initial: int = DEFAULT_INITIAL,
+            minimum: int = 1,
+            maximum: int = DEFAULT_MAXIMUM) -> None:
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.limit = float(min(max(initial, minimum), self.maximum))
+        self.in_flight = 0
+        self._cond = threading.Condition()
+        self._resume_at = 0.0
+        self._last_decrease = 0.0
+        self._stats = {
+            'rate_limited': 0,
+            'throttle_decreases': 0
+        }
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return dict(self._stats)
+
+    def acquire(self) -> None:
+        """Wait for our turn to send a request."""
+        with self._cond:
+            while True:
+                pause = self._resume_at - time.monotonic()
+                if pause > 0:
+                    self._cond.wait(pause)
+                elif self.in_flight < int(self.limit):
+                    break
+                else:
+                    self._cond.wait()
+            self.in_flight += 1
+
+    def _decrease(self, now: float) -> None:
+        """Assumes the lock is held."""
+        # Responses to requests sent before the last decrease do not tell us
+        # anything new, so decrease at most once per round of requests.
+        if now - self._last_decrease < 1.0:
+            return
+        self._last_decrease = now
+        self.limit = max(float(self.minimum), self.limit / 2)
+        self._stats['throttle_decreases'] += 1
+
+    def release(
+            self, headers: Optional[Message] = None,
+            throttled: bool = False) -> None:
+        """Let the throttle know how the request went."""
+        remaining = _float_header(headers, 'X-Rate-Limit-Remaining')
+        cost = _float_header(headers, 'X-Request-Cost') or 0.0
+        now = time.monotonic()
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self._stats['rate_limited'] += 1
+                self._decrease(now)
+                self._resume_at = now + COOLDOWN
+            elif remaining is not None and remaining < PREFLIGHT_COST:
+                self._decrease(now)
+                self._resume_at = now + COOLDOWN / 2
+            elif remaining is not None and \
+                    remaining < (PREFLIGHT_COST + cost) * (self.limit + 1):
+                self._decrease(now)
+            else:
+                self.limit = min(
+                    float(self.maximum), self.limit + 1 / self.limit)
+            self._cond.notify_all()
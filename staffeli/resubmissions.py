@@ -2,6 +2,8 @@
 
 import os, os.path, re, shutil, sys, yaml
 
+from staffeli import blobstore
+
 from assignment import get_cwd_assignment
 from submission import find_student_id
 
@@ -64,7 +66,7 @@ def grader_names(canvas, grader_ids):
         names[grader_id] = name
     return names
 
-def download_last_graded(canvas, user_id, history, last_graded_path):
+def download_last_graded(canvas, user_id, history, last_graded_path, files):
     sub_history = history['submission_history']
     last_graded = None
     for sub in sub_history:
@@ -82,9 +84,9 @@ def download_last_graded(canvas, user_id, history, last_graded_path):
 
     for attachment in last_graded['attachments']:
         path = os.path.join(last_graded_path, attachment['filename'])
-        canvas.get_verified_file(path, attachment['url'])
+        files.append((path, attachment['url']))
 
-def download_last_comment(canvas, user_id, history, last_graded_path):
+def download_last_comment(canvas, user_id, history, last_graded_path, files):
     sub_comments = history['submission_comments']
     last_comment = None
     for comment in sub_comments:
@@ -103,9 +105,10 @@ def download_last_comment(canvas, user_id, history, last_graded_path):
 
     for attachment in last_comment['attachments']:
         path = os.path.join(last_graded_path, attachment['filename'])
-        canvas.get_verified_file(path, attachment['url'])
+        files.append((path, attachment['url']))
 
-def download_resub(assignment, resubsbase, graders, resub):
+def download_resub(assignment, resubsbase, graders, resub, files):
+    """Adds the (path, url) of each file to download to files."""
     canvas = assignment.canvas
     user_id = resub['user_id']
     dirpath = os.path.join(resubsbase,
@@ -117,7 +120,7 @@ def download_resub(assignment, resubsbase, graders, resub):
 
     for attachment in resub['attachments']:
         path = os.path.join(dirpath, attachment['filename'])
-        canvas.get_verified_file(path, attachment['url'])
+        files.append((path, attachment['url']))
 
     canvas_path = os.path.join(dirpath, "canvas.yaml")
     with open(canvas_path, 'w') as outfile:
@@ -131,8 +134,8 @@ def download_resub(assignment, resubsbase, graders, resub):
     last_graded_path = os.path.join(dirpath, "last_graded")
     mkdirp(last_graded_path)
 
-    download_last_graded(canvas, user_id, history, last_graded_path)
-    download_last_comment(canvas, user_id, history, last_graded_path)
+    download_last_graded(canvas, user_id, history, last_graded_path, files)
+    download_last_comment(canvas, user_id, history, last_graded_path, files)
 
 def download_all(assignment, resubs, subdirs):
     basename = os.path.basename(os.getcwd())
@@ -148,8 +151,12 @@ def download_all(assignment, resubs, subdirs):
         graderbase = os.path.join(resubsbase, grader)
         mkdirp(graderbase)
 
+    files = []
     for resub in resubs:
-        download_resub(assignment, resubsbase, graders, resub)
+        download_resub(assignment, resubsbase, graders, resub, files)
+    # The course is two levels up, like resubs/.
+    store = blobstore.BlobStore(os.path.join("..", "..", blobstore.DIRNAME))
+    assignment.canvas.get_verified_files(files, store)
 
 def main():
     assignment = get_cwd_assignment()
@@ -0,0 +1,73 @@
+"""Retry requests that fail for reasons that are likely to go away.
+
+Absalon occasionally answers with a ``502 Bad Gateway`` or ``503 Service
+Unavailable``, or not at all, especially on deadline nights. We retry such
+requests with capped exponential backoff, with "full jitter" so that many
+clients (or threads) do not all come back at the same time. See also
+<https://aws.amazon.com/blogs/architecture/exponential-backoff-and-jitter/>.
+
+Only idempotent requests are retried after a failure, since we cannot know
+whether, e.g., a POST took effect before the connection dropped. Requests
+refused by the rate limiter are retried regardless: these never took effect.
+"""
+
+import email.utils
+import random
+import time
+
+from typing import Optional
+
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+RETRY_STATUSES = frozenset([500, 502, 503, 504])
+
+DEFAULT_ATTEMPTS = 5
+DEFAULT_BASE_DELAY = 0.5
+DEFAULT_MAX_DELAY = 30.0
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """The number of seconds to wait, according to a Retry-After header."""
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    date = email.utils.parsedate_tz(value)
+    if date is None:
+        return None
+    return max(0.0, email.utils.mktime_tz(date) - time.time())
+
+
+class RetryPolicy:
+    def __init__(
+            self,
+            attempts: int = DEFAULT_ATTEMPTS,
+            base_delay: float = DEFAULT_BASE_DELAY,
+            max_delay: float = DEFAULT_MAX_DELAY) -> None:
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def should_retry(
+            self, attempt: int, method: str,
+            status: Optional[int], throttled: bool = False) -> bool:
+        """Whether to try again after the given attempt (counting from 0)
+        failed with the given status (None if there was no response)."""
+        if attempt + 1 >= self.attempts:
+            return False
+        if throttled:
+            return True
+        if method.upper() not in IDEMPOTENT_METHODS:
+            return False
+        return status is None or status in RETRY_STATUSES
+
+    def delay(
+            self, attempt: int,
+            retry_after: Optional[str] = None) -> float:
+        ceiling = min(self.max_delay, self.base_delay * 2 ** attempt)
+        backoff = random.uniform(0, ceiling)
+        wait = parse_retry_after(retry_after)
+        if wait is not None:
+            return max(wait, backoff)
+        return backoff
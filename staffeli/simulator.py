@@ -0,0 +1,1185 @@
+"""A stand-in for Canvas, for developing and testing without a network.
+
+A ``Simulator`` serves a seeded course over HTTP, from a thread in the current
+process, or from the command-line:
+
+    $ python3 -m staffeli.simulator --port 3000 --students 2000 --latency 50
+
+It implements the part of the Canvas API that Staffeli uses: courses,
+sections, group categories, groups, users and enrollments, assignments,
+submissions, bulk grading, and the file upload handshakes. Like Canvas, it
+paginates listings with a ``Link`` header. It can inject a fixed latency into
+every response, and rate-limit requests with a "leaky bucket", reporting what
+is left in the bucket in the ``X-Rate-Limit-Remaining`` header of every
+response (see also ratelimit.py). Files can be downloaded in part, with a
+``Range`` header, and a download can be made to drop halfway, or to fail
+(see ``Simulator.drop`` and ``Simulator.fail``). Like Canvas, it tags API
+responses with an ``ETag``, and answers ``If-None-Match`` with ``304 Not
+Modified`` if the response has not changed (see also httpcache.py), and
+compresses them if the client accepts ``gzip``.
+
+Submissions are not stored, but generated from the assignment and student on
+demand, so that large courses are cheap to seed. Only grades and comments
+given during the session, and resubmissions (see ``Simulator.resubmit``), are
+kept in memory.
+
+On port 3000, the simulator can stand in for ``start_local_canvas.py`` when
+running the tests under ``tests/``. Point the command-line interface at a
+simulator by setting the environment variable ``STAFFELI_API_BASE`` to
+``Simulator.api_base``."""
+
+import argparse
+import datetime
+import email.parser
+import gzip
+import hashlib
+import io
+import json
+import re
+import socketserver
+import threading
+import time
+import urllib.parse
+import uuid
+import zipfile
+
+from email.message import Message
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import (  # noqa: F401
+    Any, Callable, Dict, List, Optional, Set, Tuple)
+
+from staffeli import ratelimit
+
+DEFAULT_PER_PAGE = 10
+MAX_PER_PAGE = 100
+
+# Canvas' defaults, more or less.
+DEFAULT_RATE_LIMIT = 700.0
+LEAK_RATE = 10.0
+
+COURSE_ID = 1
+ADMIN_ID = 1
+USER_BASE = 1000
+SECTION_BASE = 100
+GCAT_BASE = 200
+ASSIGNMENT_BASE = 500
+GROUP_BASE = 10000
+FILE_BASE = 1000000
+# Entities created during the session get ids from here on.
+CREATED_BASE = 100000000
+
+EPOCH = datetime.datetime(2017, 9, 1, 12, 0, 0)
+
+Params = List[Tuple[str, str]]
+Reply = Tuple[int, Dict[str, str], bytes]
+
+
+class NotFound(Exception):
+    pass
+
+
+class BadRequest(Exception):
+    pass
+
+
+def _timestamp(seconds: float) -> str:
+    return (EPOCH + datetime.timedelta(seconds=seconds)).strftime(
+        '%Y-%m-%dT%H:%M:%SZ')
+
+
+def _now() -> str:
+    return datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def _parse_timestamp(timestamp: str) -> datetime.datetime:
+    return datetime.datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%SZ')
+
+
+def _param(params: Params, name: str) -> Optional[str]:
+    """The last value given for ``name``, as Rails would have it."""
+    values = _params(params, name)
+    return values[-1] if values else None
+
+
+def _params(params: Params, name: str) -> List[str]:
+    return [value for key, value in params if key == name]
+
+
+def _int_param(params: Params, name: str) -> int:
+    try:
+        return int(_param(params, name) or '')
+    except ValueError:
+        raise BadRequest('{} must be an integer'.format(name))
+
+
+def _kuid(i: int) -> str:
+    letters = ''
+    n = i // 1000
+    for _ in range(3):
+        letters = chr(ord('a') + n % 26) + letters
+        n //= 26
+    return '{}{:03d}'.format(letters, i % 1000)
+
+
+def _public(entity: Dict[str, Any]) -> Dict[str, Any]:
+    """Leave out our own bookkeeping, i.e., the keys starting with '_'."""
+    return {k: v for k, v in entity.items() if not k.startswith('_')}
+
+
+def file_content(file_id: int, size: int) -> bytes:
+    """The (deterministic) contents of the attachment with the given id."""
+    block = hashlib.sha256(str(file_id).encode('ascii')).hexdigest().encode()
+    return (block * (size // len(block) + 1))[:size]
+
+
+def _json_reply(status: int, data: Any) -> Reply:
+    body = json.dumps(data).encode('utf-8')
+    return (status, {'Content-Type': 'application/json; charset=utf-8'}, body)
+
+
+def _multipart_file(content_type: str, body: bytes) -> Tuple[str, bytes]:
+    """The name and contents of the file in a multipart/form-data body."""
+    message = email.parser.BytesParser().parsebytes(
+        b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' +
+        body)
+    if message.is_multipart():
+        for part in message.get_payload():
+            assert isinstance(part, Message)
+            filename = part.get_filename()
+            payload = part.get_payload(decode=True)
+            if filename is not None and isinstance(payload, bytes):
+                return (filename, payload)
+    raise BadRequest('no file in the upload')
+
+
+class _Bucket:
+    """Canvas' leaky bucket, see ratelimit.py."""
+
+    def __init__(self, capacity: float, leak_rate: float) -> None:
+        self.capacity = capacity
+        self.leak_rate = leak_rate
+        self.level = 0.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _leak(self) -> None:
+        """Assumes the lock is held."""
+        now = time.monotonic()
+        self.level = max(
+            0.0, self.level - (now - self._updated) * self.leak_rate)
+        self._updated = now
+
+    def start(self) -> bool:
+        """Charge the up-front cost of a request, if there is room."""
+        with self._lock:
+            self._leak()
+            if self.level + ratelimit.PREFLIGHT_COST > self.capacity:
+                return False
+            self.level += ratelimit.PREFLIGHT_COST
+            return True
+
+    def finish(self, cost: float) -> float:
+        """Charge the actual cost of a request; return what is left."""
+        with self._lock:
+            self._leak()
+            self.level = max(
+                0.0, self.level + cost - ratelimit.PREFLIGHT_COST)
+            return max(0.0, self.capacity - self.level)
+
+
+class Simulator:
+    def __init__(
+            self,
+            students: int = 100,
+            assignments: int = 5,
+            groups: int = 20,
+            sections: int = 2,
+            attachment_size: int = 4096,
+            latency: float = 0.0,
+            rate_limit: Optional[float] = None,
+            upload_delay: float = 0.0) -> None:
+        """Seed a course of the given size.
+
+        ``latency`` is in seconds. ``rate_limit`` is the size of the leaky
+        bucket (None for no rate-limiting). ``upload_delay`` is how long it
+        takes the simulator to "download" a file uploaded via a URL."""
+        self.latency = latency
+        self.attachment_size = attachment_size
+        self.upload_delay = upload_delay
+        self.bucket = None  # type: Optional[_Bucket]
+        if rate_limit is not None:
+            self.bucket = _Bucket(rate_limit, LEAK_RATE)
+        self.requests = 0
+        self.throttled = 0
+        # Downloads answered in part, for a Range header, and responses not
+        # sent again, for an If-None-Match header.
+        self.ranges = 0
+        self.not_modified = 0
+        self._lock = threading.Lock()
+        self._server = None  # type: Optional[HTTPServer]
+        self._next_id = CREATED_BASE
+        self.url = ''
+
+        self.courses = {}  # type: Dict[int, Dict[str, Any]]
+        self.course = self.courses[COURSE_ID] = {
+            'id': COURSE_ID,
+            'name': 'Simulated Course',
+            'course_code': 'SIM',
+            'workflow_state': 'available',
+            'enrollments': [{'type': 'teacher', 'role': 'TeacherEnrollment'}]
+        }
+
+        self.users = {ADMIN_ID: {
+            'id': ADMIN_ID,
+            'name': 'canvas@example.edu',
+            'sortable_name': 'canvas@example.edu',
+            'short_name': 'canvas@example.edu',
+            'login_id': 'canvas@example.edu'
+        }}  # type: Dict[int, Dict[str, Any]]
+        self.students = []  # type: List[Dict[str, Any]]
+        width = len(str(students))
+        for i in range(students):
+            name = 'Student {:0{}d}'.format(i + 1, width)
+            student = {
+                'id': USER_BASE + i,
+                'name': name,
+                'sortable_name': name,
+                'short_name': name,
+                'login_id': '{}@ku.dk'.format(_kuid(i))
+            }  # type: Dict[str, Any]
+            self.students.append(student)
+            self.users[student['id']] = student
+        self.enrollments = {COURSE_ID: [s['id'] for s in self.students]
+                            }  # type: Dict[int, List[int]]
+
+        self.sections = {}  # type: Dict[int, Dict[str, Any]]
+        for i in range(sections):
+            self.sections[SECTION_BASE + i] = {
+                'id': SECTION_BASE + i,
+                'name': 'Section {}'.format(i + 1),
+                'course_id': COURSE_ID,
+                '_members': [s['id'] for s in self.students[i::sections]]
+            }
+
+        self.group_categories = {GCAT_BASE: {
+            'id': GCAT_BASE,
+            'name': 'Hand-in groups',
+            'course_id': COURSE_ID,
+            'role': None,
+            'self_signup': None
+        }}  # type: Dict[int, Dict[str, Any]]
+
+        self.groups = {}  # type: Dict[int, Dict[str, Any]]
+        width = len(str(groups))
+        for i in range(groups):
+            self.groups[GROUP_BASE + i] = {
+                'id': GROUP_BASE + i,
+                'name': 'Group {:0{}d}'.format(i + 1, width),
+                'group_category_id': GCAT_BASE,
+                'course_id': COURSE_ID,
+                '_members': [s['id'] for s in self.students[i::groups]]
+            }
+
+        self.assignments = []  # type: List[Dict[str, Any]]
+        width = len(str(assignments))
+        for i in range(assignments):
+            assignment_id = ASSIGNMENT_BASE + i
+            self.assignments.append({
+                'id': assignment_id,
+                'name': 'Assignment {:0{}d}'.format(i + 1, width),
+                'course_id': COURSE_ID,
+                'grading_type': 'pass_fail',
+                'submission_types': ['online_upload', 'online_text_entry'],
+                'due_at': _timestamp(7 * 24 * 3600 * (i + 1)),
+                'submissions_download_url':
+                    '/courses/{}/assignments/{}/submissions?zip=1'.format(
+                        COURSE_ID, assignment_id)
+            })
+        self._assignments = {a['id']: a for a in self.assignments}
+
+        # Grades and comments given during the session.
+        self.grades = {}  # type: Dict[Tuple[int, int], Dict[str, Any]]
+
+        # Submissions handed in again during the session.
+        self.resubmissions = {
+        }  # type: Dict[Tuple[int, int], Dict[str, Any]]
+
+        # Files uploaded during the session, and uploads under way.
+        self.files = {}  # type: Dict[int, Dict[str, Any]]
+        self._uploads = {}  # type: Dict[str, Dict[str, Any]]
+
+        # Background jobs, e.g., bulk grading.
+        self.progress = {}  # type: Dict[int, Dict[str, Any]]
+
+        # Assignments whose submissions we have been asked to zip.
+        self._zips = set()  # type: Set[int]
+
+        # Files whose next download drops after so many bytes, and files
+        # whose next so many downloads fail.
+        self._drops = {}  # type: Dict[int, int]
+        self._failures = {}  # type: Dict[int, int]
+
+        sub = r'courses/(\d+)/assignments/(\d+)/submissions/(\d+)'
+        self._routes = [
+            ('GET', r'courses', self.get_courses),
+            ('POST', r'accounts/(\d+)/courses', self.post_course),
+            ('GET', r'courses/(\d+)', self.get_course),
+            ('GET', r'courses/(\d+)/sections', self.get_sections),
+            ('POST', r'courses/(\d+)/sections', self.post_section),
+            ('DELETE', r'sections/(\d+)', self.delete_section),
+            ('POST', r'sections/(\d+)/enrollments', self.post_enrollment),
+            ('POST', r'accounts/(\d+)/users', self.post_user),
+            ('GET', r'courses/(\d+)/users/(\d+)', self.get_course_user),
+            ('GET', r'users/(\d+)/profile', self.get_user),
+            ('POST', r'courses/(\d+)/enrollments',
+                self.post_course_enrollment),
+            ('GET', r'courses/(\d+)/group_categories',
+                self.get_group_categories),
+            ('POST', r'courses/(\d+)/group_categories',
+                self.post_group_category),
+            ('DELETE', r'group_categories/(\d+)',
+                self.delete_group_category),
+            ('GET', r'group_categories/(\d+)/groups', self.get_groups),
+            ('POST', r'group_categories/(\d+)/groups', self.post_group),
+            ('GET', r'courses/(\d+)/groups', self.get_course_groups),
+            ('GET', r'groups/(\d+)', self.get_group),
+            ('PUT', r'groups/(\d+)', self.put_group),
+            ('DELETE', r'groups/(\d+)', self.delete_group),
+            ('GET', r'groups/(\d+)/users', self.get_group_users),
+            ('GET', r'courses/(\d+)/assignments', self.get_assignments),
+            ('GET', r'courses/(\d+)/assignments/(\d+)', self.get_assignment),
+            ('GET', r'courses/(\d+)/assignments/(\d+)/submissions',
+                self.get_submissions),
+            ('GET', sub, self.get_submission),
+            ('PUT', sub, self.put_submission),
+            ('POST', r'courses/(\d+)/assignments/(\d+)/submissions/'
+                r'update_grades', self.post_update_grades),
+            ('GET', r'courses/(\d+)/students/submissions',
+                self.get_student_submissions),
+            ('GET', r'progress/(\d+)', self.get_progress),
+            ('POST', sub + r'/comments/files', self.post_comment_file),
+            ('GET', r'files/(\d+)', self.get_file),
+            ('GET', r'files/(\d+)/status', self.get_file_status),
+            ('GET', r'files/(\d+)/create_success', self.get_file),
+        ]  # type: List[Tuple[str, str, Callable[..., Any]]]
+
+    @property
+    def api_base(self) -> str:
+        return self.url + '/api/v1/'
+
+    def start(self, host: str = '127.0.0.1', port: int = 0) -> 'Simulator':
+        """Serve on the given port (by default, any free port), from a
+        daemon thread."""
+        self._server = _Server((host, port), _Handler)
+        setattr(self._server, 'simulator', self)
+        self.url = 'http://{}:{}'.format(host, self._server.server_port)
+        thread = threading.Thread(
+            target=self._server.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def close(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> 'Simulator':
+        return self.start()
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def _new_id(self) -> int:
+        """Assumes the lock is held."""
+        self._next_id += 1
+        return self._next_id
+
+    # Dispatch
+
+    def handle(
+            self, method: str, path: str, params: Params,
+            content_type: str = '', body: bytes = b'') -> Reply:
+        """Answer a request with a status, headers, and a body."""
+        with self._lock:
+            self.requests += 1
+        if self.bucket is not None and not self.bucket.start():
+            with self._lock:
+                self.throttled += 1
+            return (403, {
+                'Content-Type': 'text/plain',
+                'X-Rate-Limit-Remaining': '0.0'
+            }, b'403 Forbidden (Rate Limit Exceeded)\n')
+
+        start = time.monotonic()
+        if self.latency > 0:
+            time.sleep(self.latency)
+        reply = self._reply(method, path, params, content_type, body)
+        if self.bucket is not None:
+            # Canvas charges for the time spent on the request.
+            cost = 1.0 + 10 * (time.monotonic() - start)
+            remaining = self.bucket.finish(cost)
+            reply[1]['X-Request-Cost'] = '{:.4f}'.format(cost)
+            reply[1]['X-Rate-Limit-Remaining'] = '{:.1f}'.format(remaining)
+        return reply
+
+    def _reply(
+            self, method: str, path: str, params: Params,
+            content_type: str, body: bytes) -> Reply:
+        try:
+            with self._lock:
+                result = self._dispatch(
+                    method, path, params, content_type, body)
+            if method == 'GET' and isinstance(result, list):
+                return self._paginate(path, params, result)
+        except NotFound:
+            return _json_reply(404, {'errors': [
+                {'message': 'The specified resource does not exist.'}]})
+        except BadRequest as e:
+            return _json_reply(400, {'errors': [{'message': str(e)}]})
+        if isinstance(result, tuple):
+            return result
+        if isinstance(result, bytes):
+            return (200, {'Content-Type': 'application/octet-stream'}, result)
+        return _json_reply(200, result)
+
+    def _dispatch(
+            self, method: str, path: str, params: Params,
+            content_type: str, body: bytes) -> Any:
+        path = re.sub('/+', '/', path).strip('/')
+        match = re.match(r'^files/(\d+)/download$', path)
+        if match and method == 'GET':
+            file_id = int(match.group(1))
+            content = self.download(file_id)
+            if self._failures.get(file_id):
+                self._failures[file_id] -= 1
+                return (503, {
+                    'Content-Type': 'text/plain',
+                    'Retry-After': '0'
+                }, b'503 Service Unavailable\n')
+            if file_id in self._drops:
+                return (200, {
+                    'Content-Type': 'application/octet-stream',
+                    _DROP_AFTER: str(self._drops.pop(file_id))
+                }, content)
+            return content
+        match = re.match(
+            r'^courses/(\d+)/assignments/(\d+)/submissions$', path)
+        if match and method == 'GET' and _param(params, 'zip'):
+            return self.submissions_zip(
+                int(match.group(1)), int(match.group(2)))
+        match = re.match(r'^files/upload/(\w+)$', path)
+        if match and method == 'POST':
+            return self.upload(match.group(1), content_type, body)
+        if not path.startswith('api/v1/'):
+            raise NotFound()
+        path = path[len('api/v1/'):]
+        for route_method, pattern, handler in self._routes:
+            match = re.match('^' + pattern + '$', path)
+            if match and route_method == method:
+                ids = [int(g) for g in match.groups()]
+                return handler(params, *ids)
+        raise NotFound()
+
+    def _paginate(
+            self, path: str, params: Params, entries: List[Any]) -> Reply:
+        per_page = _int_param(params, 'per_page') \
+            if _param(params, 'per_page') else DEFAULT_PER_PAGE
+        page = _int_param(params, 'page') if _param(params, 'page') else 1
+        per_page = max(1, min(per_page, MAX_PER_PAGE))
+        last = max(1, (len(entries) + per_page - 1) // per_page)
+
+        def link(number: int, rel: str) -> str:
+            query = [(k, v) for k, v in params
+                     if k not in ('page', 'per_page')]
+            query += [('page', str(number)), ('per_page', str(per_page))]
+            return '<{}{}?{}>; rel="{}"'.format(
+                self.url, path, urllib.parse.urlencode(query), rel)
+
+        links = [link(page, 'current')]
+        if page < last:
+            links.append(link(page + 1, 'next'))
+        if page > 1:
+            links.append(link(page - 1, 'prev'))
+        links += [link(1, 'first'), link(last, 'last')]
+
+        start = (page - 1) * per_page
+        status, headers, body = _json_reply(
+            200, entries[start:start + per_page])
+        headers['Link'] = ','.join(links)
+        return (status, headers, body)
+
+    # Lookups
+
+    def _course(self, course_id: int) -> Dict[str, Any]:
+        if course_id not in self.courses:
+            raise NotFound()
+        return self.courses[course_id]
+
+    def _user(self, user_id: int) -> Dict[str, Any]:
+        if user_id not in self.users:
+            raise NotFound()
+        return self.users[user_id]
+
+    def _section(self, section_id: int) -> Dict[str, Any]:
+        if section_id not in self.sections:
+            raise NotFound()
+        return self.sections[section_id]
+
+    def _group_category(self, gcat_id: int) -> Dict[str, Any]:
+        if gcat_id not in self.group_categories:
+            raise NotFound()
+        return self.group_categories[gcat_id]
+
+    def _group(self, group_id: int) -> Dict[str, Any]:
+        if group_id not in self.groups:
+            raise NotFound()
+        return self.groups[group_id]
+
+    def _assignment(self, course_id: int, assignment_id: int
+                    ) -> Dict[str, Any]:
+        self._course(course_id)
+        assignment = self._assignments.get(assignment_id)
+        if assignment is None or assignment['course_id'] != course_id:
+            raise NotFound()
+        return assignment
+
+    def _public_group(self, group: Dict[str, Any]) -> Dict[str, Any]:
+        public = _public(group)
+        public['members_count'] = len(group['_members'])
+        return public
+
+    def submission(self, assignment_id: int, user_id: int
+                   ) -> Dict[str, Any]:
+        """The submission of a student for an assignment.
+
+        Most students hand in a file or two, some write their answer in the
+        text box, and a few do not hand in at all."""
+        a = assignment_id - ASSIGNMENT_BASE
+        s = user_id - USER_BASE
+        kind = (a * 7 + s * 13) % 10
+        sub = {
+            'id': a * len(self.students) + s + 1,
+            'user_id': user_id,
+            'assignment_id': assignment_id,
+            'attempt': 1,
+            'body': None,
+            'grade': None,
+            'score': None,
+            'graded_at': None,
+            'late': False,
+            'preview_url': '{}/courses/{}/assignments/{}/submissions/{}'
+                           '?preview=1'.format(
+                               self.url, COURSE_ID, assignment_id, user_id),
+            'submission_comments': []
+        }  # type: Dict[str, Any]
+        if kind == 0:
+            sub.update({
+                'workflow_state': 'unsubmitted',
+                'submission_type': None,
+                'submitted_at': None
+            })
+        else:
+            sub.update({
+                'workflow_state': 'submitted',
+                'submission_type':
+                    'online_text_entry' if kind < 3 else 'online_upload',
+                'submitted_at': _timestamp(7 * 24 * 3600 * a + 60 * s),
+                'late': kind == 9
+            })
+        sub.update(self.resubmissions.get((assignment_id, user_id), {}))
+        if sub['submission_type'] == 'online_text_entry':
+            sub['body'] = '<p>The answer of {} is 42.</p>'.format(
+                self.users[user_id]['name'])
+        elif sub['submission_type'] == 'online_upload':
+            filenames = ['handin.zip', 'report.pdf'][:1 + kind % 2]
+            sub['attachments'] = []
+            for k, filename in enumerate(filenames):
+                file_id = FILE_BASE + 2 * (sub['id'] - 1) + k
+                sub['attachments'].append({
+                    'id': file_id,
+                    'filename': filename,
+                    'display_name': filename,
+                    'size': self.attachment_size,
+                    'content-type': 'application/octet-stream',
+                    'updated_at': sub['submitted_at'],
+                    'url': '{}/files/{}/download?download_frd=1'.format(
+                        self.url, file_id)
+                })
+        sub.update(self.grades.get((assignment_id, user_id), {}))
+        return sub
+
+    def resubmit(self, assignment_id: int, user_id: int) -> None:
+        """Have a student hand in (again) now, as if from the browser."""
+        with self._lock:
+            sub = self.submission(assignment_id, user_id)
+            self.resubmissions[(assignment_id, user_id)] = {
+                'workflow_state': 'submitted',
+                'submission_type': sub['submission_type'] or 'online_upload',
+                'submitted_at': _now(),
+                'attempt': sub['attempt'] + 1
+            }
+            # The grade is for the previous attempt.
+            self.grades.get((assignment_id, user_id), {}).pop(
+                'workflow_state', None)
+
+    # Courses, users, and sections
+
+    def get_courses(self, params: Params) -> Any:
+        return list(self.courses.values())
+
+    def post_course(self, params: Params, account_id: int) -> Any:
+        course = {
+            'id': self._new_id(),
+            'name': _param(params, 'course[name]') or 'Unnamed Course',
+            'course_code': _param(params, 'course[course_code]') or '',
+            'license': _param(params, 'course[license]'),
+            'is_public': _param(params, 'course[is_public]') == '1',
+            'account_id': account_id,
+            'workflow_state': 'unpublished',
+            'enrollments': [{'type': 'teacher', 'role': 'TeacherEnrollment'}]
+        }  # type: Dict[str, Any]
+        self.courses[course['id']] = course
+        self.enrollments[course['id']] = []
+        return course
+
+    def get_course(self, params: Params, course_id: int) -> Any:
+        return self._course(course_id)
+
+    def get_sections(self, params: Params, course_id: int) -> Any:
+        self._course(course_id)
+        include = _params(params, 'include') + _params(params, 'include[]')
+        sections = []
+        for section in self.sections.values():
+            if section['course_id'] != course_id:
+                continue
+            public = _public(section)
+            if 'students' in include:
+                public['students'] = [
+                    self.users[uid] for uid in section['_members']
+                ] or None
+            sections.append(public)
+        return sections
+
+    def post_section(self, params: Params, course_id: int) -> Any:
+        self._course(course_id)
+        section = {
+            'id': self._new_id(),
+            'name': _param(params, 'course_section[name]') or '',
+            'course_id': course_id,
+            '_members': []
+        }  # type: Dict[str, Any]
+        self.sections[section['id']] = section
+        return _public(section)
+
+    def delete_section(self, params: Params, section_id: int) -> Any:
+        return _public(self.sections.pop(self._section(section_id)['id']))
+
+    def post_enrollment(self, params: Params, section_id: int) -> Any:
+        section = self._section(section_id)
+        user_id = _int_param(params, 'enrollment[user_id]')
+        self._user(user_id)
+        if user_id not in section['_members']:
+            section['_members'].append(user_id)
+        enrolled = self.enrollments[section['course_id']]
+        if user_id not in enrolled:
+            enrolled.append(user_id)
+        return {
+            'id': self._new_id(),
+            'user_id': user_id,
+            'course_id': section['course_id'],
+            'course_section_id': section_id,
+            'type': _param(params, 'enrollment[type]') or 'StudentEnrollment',
+            'enrollment_state': 'active'
+        }
+
+    def post_course_enrollment(self, params: Params, course_id: int) -> Any:
+        self._course(course_id)
+        user_id = _int_param(params, 'enrollment[user_id]')
+        self._user(user_id)
+        if user_id not in self.enrollments[course_id]:
+            self.enrollments[course_id].append(user_id)
+        return {
+            'id': self._new_id(),
+            'user_id': user_id,
+            'course_id': course_id,
+            'type': _param(params, 'enrollment[type]') or 'StudentEnrollment',
+            'enrollment_state':
+                _param(params, 'enrollment[enrollment_state]') or 'invited'
+        }
+
+    def post_user(self, params: Params, account_id: int) -> Any:
+        login_id = _param(params, 'pseudonym[unique_id]')
+        if not login_id:
+            raise BadRequest('pseudonym[unique_id] is required')
+        name = _param(params, 'user[name]') or login_id
+        user = {
+            'id': self._new_id(),
+            'name': name,
+            'sortable_name': name,
+            'short_name': name,
+            'login_id': login_id
+        }  # type: Dict[str, Any]
+        self.users[user['id']] = user
+        return user
+
+    def get_course_user(self, params: Params, course_id: int, user_id: int
+                        ) -> Any:
+        if user_id not in self.enrollments.get(course_id, []):
+            raise NotFound()
+        return self._user(user_id)
+
+    def get_user(self, params: Params, user_id: int) -> Any:
+        return self._user(user_id)
+
+    # Groups
+
+    def get_group_categories(self, params: Params, course_id: int) -> Any:
+        self._course(course_id)
+        return [gcat for gcat in self.group_categories.values()
+                if gcat['course_id'] == course_id]
+
+    def post_group_category(self, params: Params, course_id: int) -> Any:
+        self._course(course_id)
+        gcat = {
+            'id': self._new_id(),
+            'name': _param(params, 'name') or '',
+            'course_id': course_id,
+            'role': None,
+            'self_signup': _param(params, 'self_signup')
+        }  # type: Dict[str, Any]
+        self.group_categories[gcat['id']] = gcat
+        return gcat
+
+    def delete_group_category(self, params: Params, gcat_id: int) -> Any:
+        gcat = self.group_categories.pop(self._group_category(gcat_id)['id'])
+        for group_id, group in list(self.groups.items()):
+            if group['group_category_id'] == gcat_id:
+                del self.groups[group_id]
+        return gcat
+
+    def get_groups(self, params: Params, gcat_id: int) -> Any:
+        self._group_category(gcat_id)
+        return [self._public_group(g) for g in self.groups.values()
+                if g['group_category_id'] == gcat_id]
+
+    def post_group(self, params: Params, gcat_id: int) -> Any:
+        gcat = self._group_category(gcat_id)
+        group = {
+            'id': self._new_id(),
+            'name': _param(params, 'name') or '',
+            'group_category_id': gcat_id,
+            'course_id': gcat['course_id'],
+            'join_level': _param(params, 'join_level'),
+            '_members': []
+        }  # type: Dict[str, Any]
+        self.groups[group['id']] = group
+        return self._public_group(group)
+
+    def get_course_groups(self, params: Params, course_id: int) -> Any:
+        self._course(course_id)
+        return [self._public_group(g) for g in self.groups.values()
+                if g['course_id'] == course_id]
+
+    def get_group(self, params: Params, group_id: int) -> Any:
+        return self._public_group(self._group(group_id))
+
+    def put_group(self, params: Params, group_id: int) -> Any:
+        group = self._group(group_id)
+        if any(key == 'members[]' for key, _ in params):
+            members = [int(uid) for uid in _params(params, 'members[]')]
+            for uid in members:
+                self._user(uid)
+            group['_members'] = members
+        name = _param(params, 'name')
+        if name is not None:
+            group['name'] = name
+        return self._public_group(group)
+
+    def delete_group(self, params: Params, group_id: int) -> Any:
+        return self._public_group(
+            self.groups.pop(self._group(group_id)['id']))
+
+    def get_group_users(self, params: Params, group_id: int) -> Any:
+        return [self.users[uid] for uid in self._group(group_id)['_members']]
+
+    # Assignments and submissions
+
+    def get_assignments(self, params: Params, course_id: int) -> Any:
+        self._course(course_id)
+        return [a for a in self.assignments if a['course_id'] == course_id]
+
+    def get_assignment(self, params: Params, course_id: int,
+                       assignment_id: int) -> Any:
+        return self._assignment(course_id, assignment_id)
+
+    def get_submissions(self, params: Params, course_id: int,
+                        assignment_id: int) -> Any:
+        self._assignment(course_id, assignment_id)
+        return [self.submission(assignment_id, s['id'])
+                for s in self.students]
+
+    def get_submission(self, params: Params, course_id: int,
+                       assignment_id: int, user_id: int) -> Any:
+        self._assignment(course_id, assignment_id)
+        self._user(user_id)
+        return self.submission(assignment_id, user_id)
+
+    def put_submission(self, params: Params, course_id: int,
+                       assignment_id: int, user_id: int) -> Any:
+        self._assignment(course_id, assignment_id)
+        self._user(user_id)
+        self._grade(
+            assignment_id, user_id,
+            _param(params, 'submission[posted_grade]'),
+            _param(params, 'comment[text_comment]'),
+            _params(params, 'comment[file_ids][]'))
+        return self.submission(assignment_id, user_id)
+
+    def _grade(self, assignment_id: int, user_id: int, grade: Optional[str],
+               text: Optional[str], file_ids: List[str]) -> None:
+        """Assumes the lock is held."""
+        graded = self.grades.setdefault((assignment_id, user_id), {})
+        if grade is not None:
+            graded.update({
+                'grade': grade,
+                'score': 1.0 if grade == 'pass' else 0.0,
+                'workflow_state': 'graded',
+                'graded_at': _now()
+            })
+        if text is not None or file_ids:
+            comments = graded.setdefault('submission_comments', [])
+            comments.append({
+                'comment': text or '',
+                'attachments': [
+                    _public(self.files[int(i)]) for i in file_ids
+                    if int(i) in self.files]
+            })
+
+    def get_student_submissions(self, params: Params, course_id: int) -> Any:
+        self._course(course_id)
+        assignment_ids = [int(i) for i in _params(params, 'assignment_ids[]')]
+        if not assignment_ids:
+            assignment_ids = [a['id'] for a in self.assignments
+                              if a['course_id'] == course_id]
+        user_ids = _params(params, 'student_ids[]')
+        if user_ids in ([], ['all']):
+            students = self.enrollments.get(course_id, [])
+        else:
+            students = [int(i) for i in user_ids
+                        if int(i) in self.enrollments.get(course_id, [])]
+        subs = [self.submission(a, s)
+                for s in students for a in assignment_ids]
+        for field, since in [('submitted_at', 'submitted_since'),
+                             ('graded_at', 'graded_since')]:
+            timestamp = _param(params, since)
+            if timestamp:
+                subs = [sub for sub in subs if sub[field] and
+                        _parse_timestamp(sub[field]) >
+                        _parse_timestamp(timestamp)]
+        return subs
+
+    def post_update_grades(self, params: Params, course_id: int,
+                           assignment_id: int) -> Any:
+        """Grade many submissions at once, see bulkgrade.py. The job is done
+        by the time the progress is first polled."""
+        self._assignment(course_id, assignment_id)
+        grade_data = {}  # type: Dict[int, Params]
+        for key, value in params:
+            match = re.match(r'^grade_data\[(\d+)\](.*)$', key)
+            if match:
+                grade_data.setdefault(int(match.group(1)), []).append(
+                    (match.group(2), value))
+        progress_id = self._new_id()
+        self.progress[progress_id] = {
+            'id': progress_id,
+            'context_id': assignment_id,
+            'context_type': 'Assignment',
+            'tag': 'submissions_update',
+            'completion': 0,
+            'workflow_state': 'queued',
+            'message': None,
+            'url': '{}progress/{}'.format(self.api_base, progress_id),
+            '_job': (assignment_id, grade_data)
+        }
+        return _public(self.progress[progress_id])
+
+    def get_progress(self, params: Params, progress_id: int) -> Any:
+        if progress_id not in self.progress:
+            raise NotFound()
+        progress = self.progress[progress_id]
+        if progress['workflow_state'] == 'queued':
+            assignment_id, grade_data = progress.pop('_job')
+            students = set(self.enrollments.get(COURSE_ID, []))
+            for user_id, data in grade_data.items():
+                # Like Canvas, quietly skip users who are not students.
+                if user_id in students:
+                    self._grade(
+                        assignment_id, user_id,
+                        _param(data, '[posted_grade]'),
+                        _param(data, '[text_comment]'),
+                        _params(data, '[file_ids][]'))
+            progress.update({'completion': 100, 'workflow_state': 'completed'})
+        return _public(progress)
+
+    # Files
+
+    def _new_file(self, name: str, size: int) -> Dict[str, Any]:
+        """Assumes the lock is held."""
+        file_id = self._new_id()
+        attachment = {
+            'id': file_id,
+            'filename': name,
+            'display_name': name,
+            'size': size,
+            'content-type': 'application/octet-stream',
+            'url': '{}/files/{}/download?download_frd=1'.format(
+                self.url, file_id),
+            '_content': b''
+        }  # type: Dict[str, Any]
+        self.files[file_id] = attachment
+        return attachment
+
+    def post_comment_file(self, params: Params, course_id: int,
+                          assignment_id: int, user_id: int) -> Any:
+        """Step 1 of uploading a file, see upload.py and
+        <https://canvas.instructure.com/doc/api/file.file_uploads.html>."""
+        self._assignment(course_id, assignment_id)
+        self._user(user_id)
+        name = _param(params, 'name')
+        if not name:
+            raise BadRequest('name is required')
+        size = int(_param(params, 'size') or 0)
+
+        url = _param(params, 'url')
+        if url is not None:
+            # Canvas downloads the file from the URL, in its own good time.
+            attachment = self._new_file(name, size)
+            attachment['_content'] = file_content(attachment['id'], size)
+            attachment['_ready_at'] = time.monotonic() + self.upload_delay
+            return {
+                'id': attachment['id'],
+                'upload_status': 'pending',
+                'status_url': '{}files/{}/status'.format(
+                    self.api_base, attachment['id'])
+            }
+
+        key = uuid.uuid4().hex
+        self._uploads[key] = {'name': name, 'size': size}
+        return {
+            'upload_url': '{}/files/upload/{}'.format(self.url, key),
+            'upload_params': {'key': key, 'filename': name},
+            'file_param': 'file'
+        }
+
+    def upload(self, key: str, content_type: str, body: bytes) -> Reply:
+        """Step 2 of uploading a file: receive the file, and redirect the
+        client to confirm the upload (step 3)."""
+        upload = self._uploads.pop(key, None)
+        if upload is None:
+            raise NotFound()
+        _, content = _multipart_file(content_type, body)
+        attachment = self._new_file(upload['name'], len(content))
+        attachment['_content'] = content
+        location = '{}files/{}/create_success?uuid={}'.format(
+            self.api_base, attachment['id'], key)
+        return (303, {'Location': location}, b'')
+
+    def get_file(self, params: Params, file_id: int) -> Any:
+        if file_id not in self.files:
+            raise NotFound()
+        return _public(self.files[file_id])
+
+    def get_file_status(self, params: Params, file_id: int) -> Any:
+        if file_id not in self.files:
+            raise NotFound()
+        attachment = self.files[file_id]
+        if time.monotonic() < attachment.get('_ready_at', 0.0):
+            return {'upload_status': 'pending'}
+        return {'upload_status': 'ready', 'attachment': _public(attachment)}
+
+    def submissions_zip(self, course_id: int, assignment_id: int) -> Any:
+        """The submissions of an assignment in a zip file, named like Canvas
+        names them (see subzip.py). Like Canvas, the first request only gets
+        the zip file going."""
+        self._assignment(course_id, assignment_id)
+        if assignment_id not in self._zips:
+            self._zips.add(assignment_id)
+            return {'attachment': {'workflow_state': 'zipping'}}
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, 'w') as zf:
+            for student in self.students:
+                sub = self.submission(assignment_id, student['id'])
+                prefix = '{}_{}{}'.format(
+                    re.sub('[^a-z0-9]', '', student['sortable_name'].lower()),
+                    'late_' if sub['late'] else '', student['id'])
+                if sub['submission_type'] == 'online_text_entry':
+                    zf.writestr(prefix + '_text.html', sub['body'])
+                for att in sub.get('attachments', []):
+                    zf.writestr(
+                        '{}_{}_{}'.format(prefix, att['id'], att['filename']),
+                        self.download(att['id']))
+        return (200, {'Content-Type': 'application/zip'}, buf.getvalue())
+
+    def download(self, file_id: int) -> bytes:
+        if file_id in self.files:
+            return self.files[file_id]['_content']
+        if file_id < FILE_BASE:
+            raise NotFound()
+        return file_content(file_id, self.attachment_size)
+
+    def drop(self, file_id: int, after: int) -> None:
+        """Have the next download of the file stop after ``after`` bytes of
+        its body (or of the range asked for), as if the connection broke."""
+        with self._lock:
+            self._drops[file_id] = after
+
+    def fail(self, file_id: int, times: int = 1) -> None:
+        """Answer the next ``times`` downloads of the file with ``503
+        Service Unavailable``."""
+        with self._lock:
+            self._failures[file_id] = times
+
+
+class _Server(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+# Not sent; tells _Handler to drop the connection after so many bytes.
+_DROP_AFTER = 'X-Simulator-Drop-After'
+
+
+def _byte_range(
+        simulator: Simulator, header: Optional[str], status: int,
+        headers: Dict[str, str], data: bytes) -> Reply:
+    """Answer a ``Range: bytes=<start>-`` header of a file download."""
+    match = re.match(r'^bytes=(\d+)-$', header or '')
+    if match is None or status != 200 or \
+            headers.get('Content-Type') != 'application/octet-stream':
+        return (status, headers, data)
+    start = int(match.group(1))
+    if start >= len(data):
+        return (416, {
+            'Content-Range': 'bytes */{}'.format(len(data))
+        }, b'')
+    with simulator._lock:
+        simulator.ranges += 1
+    headers['Content-Range'] = 'bytes {}-{}/{}'.format(
+        start, len(data) - 1, len(data))
+    return (206, headers, data[start:])
+
+
+def _etag(
+        simulator: Simulator, command: str, if_none_match: Optional[str],
+        status: int, headers: Dict[str, str], data: bytes) -> Reply:
+    """Tag a JSON response, and answer ``If-None-Match``."""
+    if command != 'GET' or status != 200 or \
+            not headers.get('Content-Type', '').startswith(
+                'application/json'):
+        return (status, headers, data)
+    # Like Canvas, a weak tag, as it does not cover the headers.
+    etag = 'W/"{}"'.format(hashlib.sha256(data).hexdigest()[:32])
+    headers['ETag'] = etag
+    if if_none_match is None or etag not in \
+            [tag.strip() for tag in if_none_match.split(',')]:
+        return (status, headers, data)
+    with simulator._lock:
+        simulator.not_modified += 1
+    return (304, {'ETag': etag}, b'')
+
+
+def _compress(
+        accept_encoding: Optional[str], status: int,
+        headers: Dict[str, str], data: bytes) -> Reply:
+    """Compress a JSON response, if the client accepts it."""
+    codings = [coding.split(';')[0].strip().lower()
+               for coding in (accept_encoding or '').split(',')]
+    if 'gzip' not in codings or not data or \
+            not headers.get('Content-Type', '').startswith(
+                'application/json'):
+        return (status, headers, data)
+    headers['Content-Encoding'] = 'gzip'
+    headers['Vary'] = 'Accept-Encoding'
+    return (status, headers, gzip.compress(data))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def _handle(self) -> None:
+        simulator = getattr(self.server, 'simulator')  # type: Simulator
+        parts = urllib.parse.urlsplit(self.path)
+        params = urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length > 0 else b''
+        content_type = self.headers.get('Content-Type') or ''
+        if body and not content_type.startswith('multipart/'):
+            params += urllib.parse.parse_qsl(
+                body.decode('utf-8'), keep_blank_values=True)
+        status, headers, data = simulator.handle(
+            self.command, parts.path, params, content_type, body)
+        drop_after = headers.pop(_DROP_AFTER, None)
+        status, headers, data = _byte_range(
+            simulator, self.headers.get('Range'), status, headers, data)
+        status, headers, data = _etag(
+            simulator, self.command, self.headers.get('If-None-Match'),
+            status, headers, data)
+        status, headers, data = _compress(
+            self.headers.get('Accept-Encoding'), status, headers, data)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if drop_after is not None:
+            data = data[:int(drop_after)]
+            self.close_connection = True
+        self.wfile.write(data)
+
+    do_GET = _handle
+    do_POST = _handle
+    do_PUT = _handle
+    do_DELETE = _handle
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Serve a simulated Canvas course.')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=3000)
+    parser.add_argument('--students', type=int, default=100)
+    parser.add_argument('--assignments', type=int, default=5)
+    parser.add_argument('--groups', type=int, default=20)
+    parser.add_argument('--sections', type=int, default=2)
+    parser.add_argument('--attachment-size', type=int, default=4096)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='milliseconds added to every response')
+    parser.add_argument('--rate-limit', type=float, nargs='?',
+                        const=DEFAULT_RATE_LIMIT,
+                        help='rate-limit requests with a bucket of this size '
+                        '(default: {})'.format(DEFAULT_RATE_LIMIT))
+    parser.add_argument('--upload-delay', type=float, default=0.0,
+                        help='seconds to "download" files uploaded via a URL')
+    args = parser.parse_args()
+
+    simulator = Simulator(
+        students=args.students, assignments=args.assignments,
+        groups=args.groups, sections=args.sections,
+        attachment_size=args.attachment_size, latency=args.latency / 1000,
+        rate_limit=args.rate_limit, upload_delay=args.upload_delay)
+    simulator.start(args.host, args.port)
+    print('Serving a simulated Canvas at {}'.format(simulator.api_base))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        simulator.close()
+
+
+if __name__ == '__main__':
+    main()
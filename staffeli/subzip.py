@@ -0,0 +1,153 @@
+"""Fetch all the submissions of an assignment as one zip file.
+
+Rather than have us download the attachments one at a time, Canvas can put
+them all in a zip file, at the ``submissions_download_url`` of the
+assignment. Canvas takes a while to make the zip file, and until it is
+ready, tells us how it is going; we ask again, less and less often. The zip
+file is written to disk as it arrives, and then unpacked by a pool of
+workers.
+
+Canvas names each file in the zip after the student and the attachment, e.g.,
+
+    doejane_late_123456_7891011_report.pdf
+
+that is, the sortable name of the student, in lower case and without spaces
+or punctuation, ``late_`` if it was handed in late, the id of the student,
+the id of the attachment, and the name of the file as it was handed in. An
+answer written in the text box is named, e.g., ``doejane_123456_text.html``.
+"""
+
+import concurrent.futures
+import hashlib
+import json
+import os
+import re
+import time
+import zipfile
+
+from typing import Callable, List, Optional, Tuple  # noqa: F401
+from urllib.request import Request
+
+from staffeli import transport
+
+# How often to ask whether Canvas has made the zip file: soon, and then less
+# and less often.
+POLL_INTERVAL = 1.0
+MAX_POLL_INTERVAL = 10.0
+DEFAULT_TIMEOUT = 1800.0
+
+# Unpack this many files at a time.
+DEFAULT_WORKERS = 4
+
+# The name of an answer written in the text box.
+TEXT = 'text.html'
+
+_NAME = re.compile(r'^[^_/]*_(late_)?(\d+)_(?:(\d+)_(.+)|(text\.html))$')
+
+
+class Member:
+    """A file in the zip, by the student and attachment it is from."""
+
+    def __init__(
+            self, name: str, user_id: int, attachment_id: Optional[int],
+            filename: str, late: bool = False) -> None:
+        self.name = name
+        self.user_id = user_id
+        self.attachment_id = attachment_id
+        self.filename = filename
+        self.late = late
+
+
+def _plain(filename: str) -> bool:
+    """Whether the name is that of a file, and not a path."""
+    return '/' not in filename and '\\' not in filename and \
+        not os.path.splitdrive(filename)[0] and filename not in ('.', '..')
+
+
+def parse(name: str) -> Optional[Member]:
+    """The student and attachment of a file in the zip, or None if it is not
+    named as Canvas names them, or its name would take it out of the
+    directory of the submission."""
+    match = _NAME.match(name)
+    if match is None:
+        return None
+    late, user_id, attachment_id, filename, text = match.groups()
+    if text is not None:
+        return Member(name, int(user_id), None, TEXT, late is not None)
+    if not _plain(filename):
+        return None
+    return Member(
+        name, int(user_id), int(attachment_id), filename, late is not None)
+
+
+def download(
+        url: str, token: str, path: str,
+        timeout: float = DEFAULT_TIMEOUT,
+        say: Callable[[str], None] = print) -> int:
+    """Download the zip file of submissions at ``url`` to ``path``, once
+    Canvas has made it, and return its size."""
+    headers = {
+        'Authorization': 'Bearer ' + token,
+        'Accept': 'application/zip, application/json'
+    }
+    tmppath = path + '.tmp'
+    deadline = time.monotonic() + timeout
+    interval = POLL_INTERVAL
+    while True:
+        with open(tmppath, 'wb') as f:
+            resp = transport.stream(Request(url, headers=headers), f)
+        if 'json' not in (resp.getheader('Content-Type') or ''):
+            os.replace(tmppath, path)
+            return os.path.getsize(path)
+
+        with open(tmppath, encoding='utf-8') as f:
+            status = json.load(f).get('attachment', {})
+        os.remove(tmppath)
+        state = status.get('workflow_state')
+        if state == 'errored':
+            raise OSError("Canvas failed to make the zip file of {}.".format(
+                url))
+        if time.monotonic() + interval > deadline:
+            raise TimeoutError(
+                "Canvas did not make the zip file of {} in {} s.".format(
+                    url, timeout))
+        say("Canvas is making the zip file ({})..".format(state))
+        time.sleep(interval)
+        interval = min(2 * interval, MAX_POLL_INTERVAL)
+
+
+def _extract(zippath: str, name: str, path: str) -> Tuple[int, str]:
+    h = hashlib.sha256()
+    size = 0
+    tmppath = path + '.tmp'
+    # A zip file per worker; they cannot share one.
+    with zipfile.ZipFile(zippath) as zf:
+        with zf.open(name) as src, open(tmppath, 'wb') as dst:
+            for chunk in iter(lambda: src.read(transport.STREAM_CHUNK_SIZE),
+                              b''):
+                h.update(chunk)
+                size += len(chunk)
+                dst.write(chunk)
+    os.replace(tmppath, path)
+    return (size, h.hexdigest())
+
+
+def unpack(
+        zippath: str, targets: List[Tuple[str, str]],
+        workers: int = DEFAULT_WORKERS) -> List[Tuple[int, str]]:
+    """Extract each (name, path) from the zip file, several at a time.
+    Returns the size and SHA-256 of each."""
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(
+            lambda target: _extract(zippath, *target), targets))
+
+
+def read(zippath: str, name: str) -> bytes:
+    with zipfile.ZipFile(zippath) as zf:
+        with zf.open(name) as f:
+            return f.read()
+
+
+def names(zippath: str) -> List[str]:
+    with zipfile.ZipFile(zippath) as zf:
+        return zf.namelist()
@@ -0,0 +1,136 @@
+"""Fetch only the submissions that changed since the last fetch.
+
+When we fetch the submissions for an assignment, we remember when we started
+in ``.staffeli-sync.yml`` in the directory of the assignment. With ``--sync``,
+the next fetch asks Canvas only for the submissions that were submitted or
+graded since then, and updates only the directories of those students.
+
+The time is taken from our own clock, less a margin for the clocks of Canvas
+and ours disagreeing. So, a submission may be fetched twice, but is never
+missed. The time is only saved once the fetch is complete.
+
+Whether or not ``--sync`` is used, an attachment is only downloaded again if
+it changed. For each attachment, the ``.staffeli.yml`` of the submission
+records, under ``staffeli_downloads`` in the submission, where we put it, its
+size, when Canvas last updated it, and the SHA-256 of what we downloaded. If
+the id, size and time of update on Canvas are the same, and the file is still
+there, with the same size, it is skipped. With ``--verify``, its content
+must also still have the same hash. Otherwise, it is downloaded again, next to
+the old version."""
+
+import collections
+import datetime
+import os
+import os.path
+import yaml
+
+from staffeli import files, uploadcache
+
+from typing import Any, Dict, Iterable, List, Optional  # noqa: F401
+
+FILENAME = '.staffeli-sync.yml'
+
+# The key of the downloads in the cached submission.
+DOWNLOADS = 'staffeli_downloads'
+
+MARGIN = datetime.timedelta(minutes=5)
+
+_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def now() -> str:
+    """The time to save once a fetch that starts now is complete."""
+    return (datetime.datetime.utcnow() - MARGIN).strftime(_FORMAT)
+
+
+def load(path: str) -> Optional[str]:
+    """The time of the last fetch of the assignment in ``path``, if any."""
+    path = os.path.join(path, FILENAME)
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        data = yaml.safe_load(f) or {}
+    return data.get('since')
+
+
+def save(path: str, since: str) -> None:
+    path = os.path.join(path, FILENAME)
+    tmppath = path + '.tmp'
+    with open(tmppath, 'w') as f:
+        yaml.safe_dump({'since': since}, f, default_flow_style=False)
+    os.replace(tmppath, path)
+
+
+def latest(subs: Iterable[Any]) -> List[Any]:
+    """The submissions, with only the last of each student's kept."""
+    by_user = collections.OrderedDict()  # type: Dict[int, Any]
+    for sub in subs:
+        by_user.pop(sub.json['user_id'], None)
+        by_user[sub.json['user_id']] = sub
+    return list(by_user.values())
+
+
+def _cached(subpath: str) -> Dict[str, Any]:
+    """The ``.staffeli.yml`` of the submission fetched into ``subpath``."""
+    path = os.path.join(subpath, files.STAFFELI_FILENAME)
+    if not os.path.isfile(path):
+        return {}
+    model = files.load_staffeli_file(path)
+    if not isinstance(model, dict) or 'submission' not in model:
+        return {}
+    return model
+
+
+def resubmitted(subpath: str, json: Dict[str, Any]) -> bool:
+    """Whether the submission is new since it was last fetched into
+    ``subpath``, as opposed to only graded or commented on."""
+    cached = _cached(subpath).get('submission')
+    if cached is None:
+        return True
+    return (cached.get('submitted_at'), cached.get('attempt')) != \
+        (json.get('submitted_at'), json.get('attempt'))
+
+
+def downloads(subpath: str) -> Dict[int, Dict[str, Any]]:
+    """What was downloaded into ``subpath``, by attachment id.
+
+    Submissions fetched before we kept track have no such record; then we
+    assume that the attachments of the cached submission were downloaded
+    under their own names."""
+    cached = _cached(subpath).get('submission') or {}
+    if DOWNLOADS in cached:
+        return cached[DOWNLOADS] or {}
+    return {att['id']: record(
+                subpath, os.path.join(subpath, att['filename']), att)
+            for att in cached.get('attachments', [])}
+
+
+def record(
+        subpath: str, path: str, attachment: Dict[str, Any],
+        sha256: Optional[str] = None) -> Dict[str, Any]:
+    """What to remember about an attachment downloaded to ``path``, in the
+    directory of the submission ``subpath``."""
+    entry = {
+        'path': os.path.relpath(path, subpath),
+        'size': attachment.get('size'),
+        'updated_at': attachment.get('updated_at')
+    }  # type: Dict[str, Any]
+    if sha256 is not None:
+        entry['sha256'] = sha256
+    return entry
+
+
+def unchanged(
+        subpath: str, attachment: Dict[str, Any],
+        entry: Optional[Dict[str, Any]], verify: bool = False) -> bool:
+    """Whether the attachment is here, as it is on Canvas."""
+    if entry is None or \
+            (entry['size'], entry['updated_at']) != \
+            (attachment.get('size'), attachment.get('updated_at')):
+        return False
+    path = os.path.join(subpath, entry['path'])
+    if not os.path.isfile(path) or os.path.getsize(path) != entry['size']:
+        return False
+    if verify and 'sha256' in entry:
+        return uploadcache.sha256(path) == entry['sha256']
+    return True
@@ -0,0 +1,655 @@
+"""The HTTP transport underneath staffeli.
+
+All traffic to Canvas goes through ``urlopen`` below. It is a drop-in
+replacement for ``urllib.request.urlopen``, except that connections are kept
+alive, and pooled per host, so that a long sequence of requests (e.g., paging
+through the students of a large course) does not pay for a TCP and TLS
+handshake every time. Responses are also transferred compressed, if the
+server is willing."""
+
+import gzip
+import hashlib
+import http.client
+import io
+import ssl
+import threading
+import time
+import urllib.error
+import urllib.parse
+import zlib
+
+from email.message import Message
+from typing import Any, Dict, IO, List, Optional, Tuple  # noqa: F401
+from urllib.request import Request
+
+from staffeli import metrics, ratelimit, retry
+
+DEFAULT_POOL_SIZE = 8
+DEFAULT_TIMEOUT = 60.0
+MAX_REDIRECTS = 5
+# Write streamed response bodies this much at a time.
+STREAM_CHUNK_SIZE = 64 * 1024
+USER_AGENT = 'staffeli'
+ACCEPT_ENCODING = 'gzip, deflate'
+# How it looks when the server has closed an idle connection on us, before
+# it saw a request sent on it. This is harmless; the request is sent again
+# on a fresh connection.
+STALE_ERRORS = (http.client.RemoteDisconnected, BrokenPipeError)
+
+Connection = http.client.HTTPConnection
+
+
+class Response:
+    """A fully read HTTP response.
+
+    Provides the parts of ``http.client.HTTPResponse`` that staffeli uses,
+    but it does not hold on to the underlying connection."""
+
+    def __init__(
+            self, url: str, status: int, reason: str,
+            headers: Message, body: bytes,
+            wire_size: Optional[int] = None) -> None:
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+        self.wire_size = len(body) if wire_size is None else wire_size
+
+    def read(self) -> bytes:
+        return self.body
+
+    def getheader(
+            self, name: str, default: Optional[str] = None
+            ) -> Optional[str]:
+        return self.headers.get(name, default)
+
+    def info(self) -> Message:
+        return self.headers
+
+    def geturl(self) -> str:
+        return self.url
+
+    def getcode(self) -> int:
+        return self.status
+
+    def __enter__(self) -> 'Response':
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        pass
+
+
+def request_key(req: Request) -> str:
+    """Identify a request by its method, URL, query, and credentials."""
+    h = hashlib.sha256()
+    # Different tokens may well see different things.
+    for part in [req.get_method(), req.full_url,
+                 req.get_header('Authorization', '')]:
+        h.update(part.encode('utf-8'))
+        h.update(b'\0')
+    if isinstance(req.data, bytes):
+        h.update(req.data)
+    return h.hexdigest()
+
+
+def _decode(body: bytes, encoding: Optional[str]) -> Optional[bytes]:
+    """Decompress a response body, or return None if it is not compressed.
+    """
+    encoding = (encoding or 'identity').strip().lower()
+    if encoding in ('gzip', 'x-gzip'):
+        return gzip.decompress(body)
+    if encoding == 'deflate':
+        try:
+            return zlib.decompress(body)
+        except zlib.error:
+            # Some servers send a raw deflate stream, without the zlib header.
+            return zlib.decompress(body, -zlib.MAX_WBITS)
+    return None
+
+
+def _split_url(url: str) -> Tuple[str, str, str]:
+    parts = urllib.parse.urlsplit(url)
+    selector = parts.path or '/'
+    if parts.query:
+        selector += '?' + parts.query
+    return (parts.scheme, parts.netloc, selector)
+
+
+class ConnectionPool:
+    """Idle keep-alive connections to a single host.
+
+    At most ``maxsize`` connections to the host are in use at any one time,
+    and fewer if the host asks us to slow down (see ratelimit.py). Further
+    requests block until it is their turn."""
+
+    def __init__(
+            self, scheme: str, netloc: str,
+            maxsize: int, timeout: float) -> None:
+        self.scheme = scheme
+        self.netloc = netloc
+        self.timeout = timeout
+        self._idle = []  # type: List[Connection]
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(maxsize)
+        self.throttle = ratelimit.Throttle(maximum=maxsize)
+
+    def _connect(self) -> Connection:
+        if self.scheme == 'https':
+            return http.client.HTTPSConnection(
+                self.netloc, timeout=self.timeout,
+                context=ssl.create_default_context())
+        return http.client.HTTPConnection(self.netloc, timeout=self.timeout)
+
+    def acquire(self) -> Tuple[Connection, bool]:
+        """Get a connection, and whether it is reused."""
+        self._slots.acquire()
+        with self._lock:
+            if self._idle:
+                return (self._idle.pop(), True)
+        return (self._connect(), False)
+
+    def release(self, conn: Connection, reusable: bool) -> None:
+        if reusable:
+            with self._lock:
+                self._idle.append(conn)
+        else:
+            conn.close()
+        self._slots.release()
+
+    def close(self) -> None:
+        with self._lock:
+            for conn in self._idle:
+                conn.close()
+            self._idle = []
+
+
+def _restart(f: IO[bytes]) -> None:
+    f.seek(0)
+    f.truncate()
+
+
+class PoolManager:
+    """A connection pool per host, and counters to see how they fare."""
+
+    def __init__(
+            self,
+            pool_size: int = DEFAULT_POOL_SIZE,
+            timeout: float = DEFAULT_TIMEOUT,
+            attempts: int = retry.DEFAULT_ATTEMPTS) -> None:
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retry = retry.RetryPolicy(attempts)
+        self.recorder = None  # type: Optional[metrics.Recorder]
+        # A cassette.Recording or cassette.Replay, see cassette.py.
+        self.cassette = None  # type: Any
+        self._pools = {}  # type: Dict[Tuple[str, str], ConnectionPool]
+        self._lock = threading.Lock()
+        self._stats = {
+            'requests': 0,
+            'connections_opened': 0,
+            'connections_reused': 0,
+            'retries': 0,
+            'bytes_wire': 0,
+            'bytes_decoded': 0
+        }
+
+    def _count(self, key: str, n: int = 1) -> None:
+        with self._lock:
+            self._stats[key] += n
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            counters = dict(self._stats)
+            pools = list(self._pools.values())
+        for pool in pools:
+            for key, value in pool.throttle.stats().items():
+                counters[key] = counters.get(key, 0) + value
+        return counters
+
+    def pool(self, scheme: str, netloc: str) -> ConnectionPool:
+        with self._lock:
+            key = (scheme, netloc)
+            if key not in self._pools:
+                self._pools[key] = ConnectionPool(
+                    scheme, netloc, self.pool_size, self.timeout)
+            return self._pools[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            pools = list(self._pools.values())
+            self._pools = {}
+        for pool in pools:
+            pool.close()
+
+    def _exchange(
+            self, pool: ConnectionPool, method: str, url: str,
+            selector: str, headers: Dict[str, str], body: Optional[bytes]
+            ) -> Response:
+        while True:
+            conn, reused = pool.acquire()
+            self._count(
+                'connections_reused' if reused else 'connections_opened')
+            try:
+                conn.request(method, selector, body=body, headers=headers)
+                resp = conn.getresponse()
+            except (http.client.HTTPException, OSError) as e:
+                pool.release(conn, False)
+                if reused and isinstance(e, STALE_ERRORS):
+                    continue
+                raise urllib.error.URLError(e)
+            # Once a response has begun, the server has seen the request, so
+            # do not send it again if the body fails to arrive.
+            try:
+                data = resp.read()
+            except (http.client.HTTPException, OSError) as e:
+                pool.release(conn, False)
+                raise urllib.error.URLError(e)
+            pool.release(conn, not resp.will_close)
+            self._count('requests')
+            wire_size = len(data)
+            self._count('bytes_wire', wire_size)
+            try:
+                decoded = _decode(data, resp.getheader('Content-Encoding'))
+            except (OSError, EOFError, zlib.error) as e:
+                raise urllib.error.URLError(e)
+            if decoded is not None:
+                data = decoded
+                del resp.msg['Content-Encoding']
+                del resp.msg['Content-Length']
+            self._count('bytes_decoded', len(data))
+            return Response(
+                url, resp.status, resp.reason, resp.msg, data, wire_size)
+
+    def _send(
+            self, method: str, url: str,
+            headers: Dict[str, str], body: Optional[bytes]
+            ) -> Response:
+        if self.cassette is not None:
+            return self.cassette.send(
+                method, url, headers, body, self._send_wire)
+        return self._send_wire(method, url, headers, body)
+
+    def _send_wire(
+            self, method: str, url: str,
+            headers: Dict[str, str], body: Optional[bytes]
+            ) -> Response:
+        scheme, netloc, selector = _split_url(url)
+        pool = self.pool(scheme, netloc)
+        pool.throttle.acquire()
+        resp = None  # type: Optional[Response]
+        try:
+            resp = self._exchange(pool, method, url, selector, headers, body)
+            return resp
+        finally:
+            if resp is None:
+                pool.throttle.release()
+            else:
+                pool.throttle.release(
+                    resp.headers,
+                    ratelimit.is_throttled(resp.status, resp.body))
+
+    def _send_retrying(
+            self, method: str, url: str,
+            headers: Dict[str, str], body: Optional[bytes]
+            ) -> Response:
+        """Send the request, retrying as prescribed by retry.py."""
+        start = time.monotonic()
+        attempt = 0
+        resp = None  # type: Optional[Response]
+        try:
+            while True:
+                try:
+                    resp = self._send(method, url, headers, body)
+                except urllib.error.URLError:
+                    if not self.retry.should_retry(attempt, method, None):
+                        raise
+                    retry_after = None  # type: Optional[str]
+                else:
+                    throttled = ratelimit.is_throttled(resp.status, resp.body)
+                    if not self.retry.should_retry(
+                            attempt, method, resp.status, throttled):
+                        return resp
+                    retry_after = resp.getheader('Retry-After')
+                self._count('retries')
+                time.sleep(self.retry.delay(attempt, retry_after))
+                attempt += 1
+        finally:
+            if self.recorder is not None:
+                self._record(method, url, start, attempt, resp)
+
+    def _record(
+            self, method: str, url: str, start: float, retries: int,
+            resp: Optional[Response],
+            bytes_decoded: Optional[int] = None) -> None:
+        """Record the request; ``bytes_decoded`` defaults to the size of
+        the body of the response."""
+        assert self.recorder is not None
+        seconds = time.monotonic() - start
+        if resp is None:
+            self.recorder.record(
+                method, url, seconds, error=True, retries=retries)
+        else:
+            self.recorder.record(
+                method, url, seconds,
+                page=resp.getheader('Link') is not None,
+                error=resp.status >= 400, retries=retries,
+                bytes_wire=resp.wire_size,
+                bytes_decoded=len(resp.body) if bytes_decoded is None
+                else bytes_decoded)
+
+    def _stream_exchange(
+            self, pool: ConnectionPool, url: str, selector: str,
+            headers: Dict[str, str], f: IO[bytes]) -> Response:
+        """Like _exchange for a GET request, but write a successful body to
+        ``f`` as it arrives."""
+        while True:
+            conn, reused = pool.acquire()
+            self._count(
+                'connections_reused' if reused else 'connections_opened')
+            size = 0
+            try:
+                conn.request('GET', selector, headers=headers)
+                resp = conn.getresponse()
+            except (http.client.HTTPException, OSError) as e:
+                pool.release(conn, False)
+                if reused and isinstance(e, STALE_ERRORS):
+                    continue
+                raise urllib.error.URLError(e)
+            try:
+                if 200 <= resp.status < 300:
+                    if 'Range' in headers and resp.status != 206:
+                        _restart(f)
+                    for chunk in iter(
+                            lambda: resp.read(STREAM_CHUNK_SIZE), b''):
+                        f.write(chunk)
+                        size += len(chunk)
+                    if resp.length:
+                        # The connection closed before the whole body came.
+                        raise http.client.IncompleteRead(b'', resp.length)
+                    data = b''
+                else:
+                    data = resp.read()
+                    size = len(data)
+            except (http.client.HTTPException, OSError) as e:
+                pool.release(conn, False)
+                raise urllib.error.URLError(e)
+            pool.release(conn, not resp.will_close)
+            self._count('requests')
+            self._count('bytes_wire', size)
+            self._count('bytes_decoded', size)
+            return Response(
+                url, resp.status, resp.reason, resp.msg, data, size)
+
+    def _stream_wire(
+            self, url: str, headers: Dict[str, str], f: IO[bytes]
+            ) -> Response:
+        scheme, netloc, selector = _split_url(url)
+        pool = self.pool(scheme, netloc)
+        pool.throttle.acquire()
+        resp = None  # type: Optional[Response]
+        try:
+            resp = self._stream_exchange(pool, url, selector, headers, f)
+            return resp
+        finally:
+            if resp is None:
+                pool.throttle.release()
+            else:
+                pool.throttle.release(
+                    resp.headers,
+                    ratelimit.is_throttled(resp.status, resp.body))
+
+    def _stream_send(
+            self, url: str, headers: Dict[str, str], f: IO[bytes]
+            ) -> Response:
+        """Like _send_retrying for a GET request, but write the body to
+        ``f``. Once some of the body has been written, a failure is left to
+        the caller, who may ask for the rest with a Range header."""
+        start = time.monotonic()
+        attempt = 0
+        resp = None  # type: Optional[Response]
+        try:
+            while True:
+                offset = f.tell()
+                try:
+                    resp = self._stream_wire(url, headers, f)
+                except urllib.error.URLError:
+                    if f.tell() != offset or \
+                            not self.retry.should_retry(attempt, 'GET', None):
+                        raise
+                    retry_after = None  # type: Optional[str]
+                else:
+                    throttled = ratelimit.is_throttled(resp.status, resp.body)
+                    if not self.retry.should_retry(
+                            attempt, 'GET', resp.status, throttled):
+                        return resp
+                    retry_after = resp.getheader('Retry-After')
+                self._count('retries')
+                time.sleep(self.retry.delay(attempt, retry_after))
+                attempt += 1
+        finally:
+            if self.recorder is not None:
+                # The body went to f, uncompressed.
+                self._record(
+                    'GET', url, start, attempt, resp,
+                    resp.wire_size if resp is not None else None)
+
+    def stream(self, req: Request, f: IO[bytes]) -> Response:
+        """Like urlopen for a GET request, but write the body of a successful
+        response to ``f`` as it arrives, rather than keep it in memory. The
+        body of the returned response is empty.
+
+        The body is asked for uncompressed. Like urlopen, the request is
+        retried as prescribed by retry.py, but not once the body has started
+        to arrive. With a Range header, ``f`` should hold the
+        bytes before the range; if the server sends the whole body instead,
+        ``f`` is emptied first."""
+        if self.cassette is not None:
+            replayed = self.urlopen(req)
+            if req.has_header('Range') and replayed.status != 206:
+                _restart(f)
+            f.write(replayed.body)
+            return replayed
+
+        url = req.full_url
+        headers = {'User-Agent': USER_AGENT}
+        headers.update(req.header_items())
+        headers['Accept-Encoding'] = 'identity'
+        for _ in range(MAX_REDIRECTS + 1):
+            resp = self._stream_send(url, headers, f)
+            location = resp.getheader('Location')
+            if resp.status not in (301, 302, 303, 307, 308) \
+                    or location is None:
+                break
+            newurl = urllib.parse.urljoin(url, location)
+            if urllib.parse.urlsplit(newurl).netloc != \
+                    urllib.parse.urlsplit(url).netloc:
+                headers = {k: v for k, v in headers.items()
+                           if k.lower() != 'authorization'}
+            url = newurl
+
+        if resp.status >= 400:
+            raise urllib.error.HTTPError(
+                url, resp.status, resp.reason, resp.headers,
+                io.BytesIO(resp.body))
+        return resp
+
+    def urlopen(self, req: Request, redirect: bool = True) -> Response:
+        """Perform the request, following redirects if asked to.
+
+        Like ``urllib.request.urlopen``, raise ``urllib.error.HTTPError`` on
+        4xx and 5xx responses, and ``urllib.error.URLError`` if we never got
+        a response."""
+        method = req.get_method()
+        url = req.full_url
+        body = req.data  # type: Any
+        headers = {
+            'User-Agent': USER_AGENT,
+            'Accept-Encoding': ACCEPT_ENCODING
+        }
+        headers.update(req.header_items())
+        if body is not None and not req.has_header('Content-type'):
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+        for _ in range(MAX_REDIRECTS + 1):
+            resp = self._send_retrying(method, url, headers, body)
+            location = resp.getheader('Location')
+            if not redirect or resp.status not in (301, 302, 303, 307, 308) \
+                    or location is None:
+                break
+            newurl = urllib.parse.urljoin(url, location)
+            if resp.status == 303 or \
+                    (resp.status in (301, 302) and method == 'POST'):
+                method, body = 'GET', None
+                headers = {k: v for k, v in headers.items()
+                           if k.lower() != 'content-type'}
+            # Do not hand our credentials to a third party, e.g., the storage
+            # service a file download redirects to.
+            if urllib.parse.urlsplit(newurl).netloc != \
+                    urllib.parse.urlsplit(url).netloc:
+                headers = {k: v for k, v in headers.items()
+                           if k.lower() != 'authorization'}
+            url = newurl
+
+        if resp.status >= 400:
+            raise urllib.error.HTTPError(
+                url, resp.status, resp.reason, resp.headers,
+                io.BytesIO(resp.body))
+        return resp
+
+
+_manager = PoolManager()
+_cache = None  # type: Any
+_memo = None  # type: Any
+
+
+def urlopen(req: Request, redirect: bool = True) -> Response:
+    """A GET request may be answered from, and its response kept in, the
+    memo and the on-disk cache."""
+    if req.get_method() != 'GET':
+        # Also afterwards, lest a GET that overlapped the change remembered
+        # what it looked like before.
+        invalidate()
+        try:
+            return _manager.urlopen(req, redirect)
+        finally:
+            invalidate()
+
+    def send(req: Request) -> Response:
+        if _cache is not None:
+            return _cache.urlopen(req, lambda r: _manager.urlopen(r, redirect))
+        return _manager.urlopen(req, redirect)
+
+    # E.g., to poll for a change, ask not to be answered from memory.
+    if _memo is not None and \
+            'no-cache' not in (req.get_header('Cache-control') or ''):
+        return _memo.urlopen(req, send)
+    return send(req)
+
+
+def stream(req: Request, f: IO[bytes]) -> Response:
+    """Perform a GET request, writing the body to ``f`` as it arrives; see
+    PoolManager.stream. Neither the memo nor the on-disk cache is used."""
+    return _manager.stream(req, f)
+
+
+def enable_memo() -> None:
+    """Remember GET responses for the rest of the session, see memo.py."""
+    global _memo
+    from staffeli import memo
+    _memo = memo.Memo()
+
+
+def enable_metrics() -> metrics.Recorder:
+    """Record every request, see metrics.py."""
+    if _manager.recorder is None:
+        _manager.recorder = metrics.Recorder()
+    return _manager.recorder
+
+
+def recorder() -> Optional[metrics.Recorder]:
+    return _manager.recorder
+
+
+def record(path: str) -> None:
+    """Write all traffic to a cassette at path, see cassette.py."""
+    from staffeli import cassette
+    stop_cassette()
+    _manager.cassette = cassette.Recording(path)
+
+
+def replay(path: str, timing: bool = False) -> None:
+    """Answer all requests from the cassette at path, see cassette.py."""
+    from staffeli import cassette
+    stop_cassette()
+    _manager.cassette = cassette.Replay(path, timing)
+
+
+def stop_cassette() -> None:
+    if _manager.cassette is not None:
+        _manager.cassette.close()
+        _manager.cassette = None
+
+
+def invalidate() -> None:
+    """Forget remembered GET responses, e.g., after changing something on
+    Canvas by other means than through this transport."""
+    if _memo is not None:
+        _memo.invalidate()
+
+
+def enable_cache(
+        path: Optional[str] = None,
+        max_size: Optional[int] = None) -> None:
+    """Revalidate GET requests against an on-disk cache, see httpcache.py."""
+    global _cache
+    from staffeli import httpcache
+    if path is None:
+        path = httpcache.default_path()
+    if max_size is None:
+        max_size = httpcache.DEFAULT_MAX_SIZE
+    _cache = httpcache.ResponseCache(path, max_size)
+
+
+def disable_cache() -> None:
+    global _cache
+    _cache = None
+
+
+def configure(
+        pool_size: Optional[int] = None,
+        timeout: Optional[float] = None,
+        attempts: Optional[int] = None) -> None:
+    """Change the pool size per host, the socket timeout, or the number of
+    attempts at a request (1 to disable retries).
+
+    Connections that are already open are dropped."""
+    global _manager
+    if pool_size is None:
+        pool_size = _manager.pool_size
+    if timeout is None:
+        timeout = _manager.timeout
+    if attempts is None:
+        attempts = _manager.retry.attempts
+    recorder, cassette = _manager.recorder, _manager.cassette
+    _manager.clear()
+    _manager = PoolManager(pool_size, timeout, attempts)
+    _manager.recorder, _manager.cassette = recorder, cassette
+
+
+def pool_size() -> int:
+    return _manager.pool_size
+
+
+def stats() -> Dict[str, int]:
+    """Counters for requests made and retried, connections opened and
+    reused, and bytes received, as sent, and after decompression.
+
+    Every reused connection is a TCP (and TLS) handshake saved. If the
+    cache or the memo is enabled, also count what they saved us."""
+    counters = _manager.stats()
+    if _cache is not None:
+        counters.update(_cache.stats())
+    if _memo is not None:
+        counters.update(_memo.stats())
+    return counters
@@ -4,11 +4,11 @@ import urllib.parse
 import urllib.request
 
 from typing import Dict  # noqa: F401
-from typing import Any, BinaryIO, List, Optional, Tuple, Union
+from typing import Any, BinaryIO, Iterator, List, Optional, Tuple, Union
 from urllib.request import Request
-from http.client import HTTPResponse
 
-from staffeli import files
+from staffeli import files, pagination, transport
+from staffeli.transport import Response
 
 QueryArg = Union[int, str]
 
@@ -27,7 +27,7 @@ def _req(token: str, method: str, url: str, **args: QueryArg) -> Request:
         url, data=query_string, method=method, headers=headers)
 
 
-def _read_json(f: Union[HTTPResponse, BinaryIO]) -> Any:
+def _read_json(f: Union[Response, BinaryIO]) -> Any:
     return json.loads(f.read().decode('utf-8'))
 
 
@@ -38,55 +38,41 @@ def _list_req(token: str, method: str, url: str, **args: QueryArg) -> Request:
     return _req(token, method, url, **args)
 
 
-def _parse_pagination_link(s: str) -> Tuple[str, str]:
-    link, rel = s.split('; rel="')
-    link = link[1:-1]
-    rel = rel[:-1]
-    return (rel, link)
-
-
 def _api(
         token: str, method: str, url: str,
         **args: QueryArg) -> Any:
     req = _req(token, method, url, **args)
-    with urllib.request.urlopen(req) as f:
-        assert isinstance(f, HTTPResponse)
+    with transport.urlopen(req) as f:
         return _read_json(f)
 
 
+def _iter_list_api(
+        token: str, method: str, url: str,
+        **args: QueryArg) -> Iterator[Any]:
+    def fetch(url: str) -> Tuple[Any, pagination.Links]:
+        req = _list_req(token, method, url, **args)
+        with transport.urlopen(req) as f:
+            links = pagination.parse_link_header(f.getheader('Link'))
+            return (_read_json(f), links)
+
+    # In some cases we want to extract many entries, e.g. the students in a
+    # course.  However, some Absalon instances set a per_page limit to 100, so
+    # we cannot just set per_page to 9000 and hope for the best.  Instead we
+    # utilize the API's pagination facilities, see staffeli/pagination.py.
+    # This works, although it is not foolproof in the extreme case that
+    # entries are added or removed from Absalon between our requests.  This is
+    # probably not something to worry about.
+    for data in pagination.iter_pages(fetch, url):
+        if type(data) is list:
+            yield from data
+        else:
+            yield data
+
+
 def _list_api(
         token: str, method: str, url: str,
         **args: QueryArg) -> List[Any]:
-    req = _list_req(token, method, url, **args)
-    entries = []  # type: List[Any]
-    while True:
-        with urllib.request.urlopen(req) as f:
-            assert isinstance(f, HTTPResponse)
-
-            data = _read_json(f)
-            if type(data) is list:
-                entries.extend(data)
-            else:
-                entries.append(data)
-
-            # In some cases we want to extract many entries, e.g. the students
-            # in a course.  However, some Absalon instances set a per_page
-            # limit to 100, so we cannot just set per_page to 9000 and hope
-            # for the best.  Instead we utilize the API's pagination facilities
-            # documented at
-            # <https://canvas.instructure.com/doc/api/file.pagination.html>.
-            # This works, although it is not foolproof in the extreme case that
-            # entries are added or removed from Absalon between our requests.
-            # This is probably not something to worry about.
-            messages = str(f.getheader('Link')).split(',')
-            links = [_parse_pagination_link(m) for m in messages]
-            pagination_links = {rel: link for rel, link in links}
-            if pagination_links['current'] == pagination_links['last']:
-                break
-            else:
-                url = pagination_links['next']
-                req = _list_req(token, method, url, **args)
-    return entries
+    return list(_iter_list_api(token, method, url, **args))
 
 
 def _api_bool(value: bool) -> int:
@@ -138,6 +124,11 @@ class Canvas:
     def get_list(self, rel_url: str, **args: QueryArg) -> List[Any]:
         return _list_api(self.token, 'GET', self.api_url(rel_url), **args)
 
+    def iter_list(self, rel_url: str, **args: QueryArg) -> Iterator[Any]:
+        """Like get_list, but yield the entries as the pages arrive."""
+        return _iter_list_api(
+            self.token, 'GET', self.api_url(rel_url), **args)
+
     def post(self, rel_url: str, **args: QueryArg) -> List[Any]:
         return _api(self.token, 'POST', self.api_url(rel_url), **args)
 
@@ -1,12 +1,92 @@
+import concurrent.futures
 import json
 import os
 import os.path
-import requests
+import time
+import urllib.parse
+import uuid
+
+from typing import Any, Callable, Iterator, List, Tuple
+from urllib.request import Request
+
+from staffeli import transport
+
+# Read files this much at a time when uploading them.
+CHUNK_SIZE = 64 * 1024
+
+# Upload this many files at a time.
+DEFAULT_WORKERS = 4
+
+# How often to check whether Canvas has fetched a file (see via_url): soon,
+# and then less and less often.
+POLL_INTERVAL = 0.25
+MAX_POLL_INTERVAL = 3.0
+DEFAULT_POLL_TIMEOUT = 600.0
+
+
+def _read_json(f: transport.Response) -> Any:
+    return json.loads(f.read().decode('utf-8'))
+
+
+class MultipartBody:
+    """A multipart/form-data body with a single file.
+
+    The file is read from disk in chunks as the body is sent, rather than all
+    at once, so that large files need not fit in memory. The body can be sent
+    any number of times, e.g., again on a fresh connection."""
+
+    def __init__(
+            self, fields: List[Tuple[str, str]],
+            file_field: str, filepath: str) -> None:
+        boundary = uuid.uuid4().hex
+        lines = []  # type: List[bytes]
+        for name, value in fields:
+            lines.append('--{}\r\n'.format(boundary).encode('utf-8'))
+            lines.append((
+                'Content-Disposition: form-data; name="{}"\r\n\r\n'
+                ).format(name).encode('utf-8'))
+            lines.append('{}\r\n'.format(value).encode('utf-8'))
+        lines.append('--{}\r\n'.format(boundary).encode('utf-8'))
+        lines.append((
+            'Content-Disposition: form-data; name="{}"; filename="{}"\r\n'
+            'Content-Type: application/octet-stream\r\n\r\n'
+            ).format(file_field, os.path.basename(filepath)).encode('utf-8'))
+        self.head = b''.join(lines)
+        self.tail = '\r\n--{}--\r\n'.format(boundary).encode('utf-8')
+        self.filepath = filepath
+        self.size = os.stat(filepath).st_size
+        self.content_type = \
+            'multipart/form-data; boundary={}'.format(boundary)
+
+    def __len__(self) -> int:
+        return len(self.head) + self.size + len(self.tail)
+
+    def __iter__(self) -> Iterator[bytes]:
+        yield self.head
+        with open(self.filepath, 'rb') as f:
+            remaining = self.size
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    raise OSError(
+                        "{} shrank while uploading it.".format(self.filepath))
+                remaining -= len(chunk)
+                yield chunk
+        yield self.tail
+
+
+def _record(name: str, size: int, start: float,
+            polls: int = 0, waited: float = 0.0) -> None:
+    recorder = transport.recorder()
+    if recorder is not None:
+        recorder.record_upload(
+            name, size, time.monotonic() - start, polls, waited)
 
 
 def via_post(
         api_base: str, url_relative: str, token: str, filepath: str) -> int:
 
+    start = time.monotonic()
     url = api_base + url_relative
     headers = {
         'Authorization': 'Bearer ' + token
@@ -15,19 +95,112 @@ def via_post(
     name = os.path.basename(filepath)
     size = os.stat(filepath).st_size
 
-    params = {
-        'name': name,
-        'size': size
-    }
+    params = [
+        ('name', name),
+        ('size', str(size))
+    ]
 
-    resp = requests.post(url, headers=headers, params=params).json()
+    req = Request(
+        url + '?' + urllib.parse.urlencode(params),
+        method='POST', headers=headers)
+    resp = _read_json(transport.urlopen(req))
 
     upload_url = resp['upload_url']
-    data = resp['upload_params']
-    name = resp['file_param']
+    data = list(resp['upload_params'].items())
+
+    body = MultipartBody(data, resp['file_param'], filepath)
+    req = Request(
+        upload_url, data=body, method='POST',
+        headers={
+            'Content-Type': body.content_type,
+            'Content-Length': str(len(body))
+        })
+
+    # Canvas may confirm the upload by redirecting us back to the API, in
+    # which case we must follow the redirect with our token.
+    f = transport.urlopen(req, redirect=False)
+    location = f.getheader('Location')
+    if f.status in (301, 302, 303) and location is not None:
+        f = transport.urlopen(Request(location, headers=headers))
+
+    file_id = _read_json(f)['id']
+    _record(name, size, start)
+    return file_id
+
+
+def via_url(
+        api_base: str, url_relative: str, token: str, filepath: str,
+        viaurl: str, timeout: float = DEFAULT_POLL_TIMEOUT) -> int:
+    """Have Canvas fetch the file from ``viaurl``, and wait for it to do so.
+
+    Canvas fetches the file in the background. Small files are usually there
+    in a moment, so we check back soon, and then less and less often."""
+    start = time.monotonic()
+    url = api_base + url_relative
+    headers = {
+        'Authorization': 'Bearer ' + token
+    }
+
+    name = os.path.basename(filepath)
+    size = os.stat(filepath).st_size
+
+    params = [
+        ('url', viaurl),
+        ('name', name),
+        ('size', str(size))
+    ]
+
+    req = Request(
+        url + '?' + urllib.parse.urlencode(params),
+        method='POST', headers=headers)
+    status = _read_json(transport.urlopen(req))
+
+    # The status changes under our feet; do not answer polls from memory.
+    poll_headers = dict(headers)
+    poll_headers['Cache-Control'] = 'no-cache'
+    status_url = status.get('status_url')
+    waiting = time.monotonic()
+    deadline = waiting + timeout
+    interval = POLL_INTERVAL
+    polls = 0
+    while status['upload_status'] == 'pending':
+        if time.monotonic() + interval > deadline:
+            raise Exception(
+                "Canvas did not fetch {} within {:.0f} seconds.".format(
+                    name, timeout))
+        time.sleep(interval)
+        interval = min(interval * 2, MAX_POLL_INTERVAL)
+        req = Request(status_url, headers=poll_headers)
+        status = _read_json(transport.urlopen(req))
+        polls += 1
+
+    if status['upload_status'] != 'ready':
+        raise Exception(
+            "Canvas refused to upload the file(s):\n{}".format(status))
+
+    _record(name, size, start, polls, time.monotonic() - waiting)
+    return status['attachment']['id']
+
+
+def concurrently(
+        upload: Callable[[str], int], filepaths: List[str],
+        workers: int = DEFAULT_WORKERS) -> List[int]:
+    """Upload the files with ``upload``, a few at a time, and return their
+    ids, in order.
+
+    Each upload is a handshake of several requests, mostly spent waiting for
+    Canvas; there is no need to wait for one to finish to start the next."""
+    if len(filepaths) <= 1:
+        return list(map(upload, filepaths))
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(workers, len(filepaths))) as executor:
+        return list(executor.map(upload, filepaths))
 
-    with open(filepath, "rb") as f:
-        resp = requests.post(
-            upload_url, data=data, files=[(name, f)])
 
-    return json.loads(resp.text)['id']
+def via_post_many(
+        api_base: str, url_relative: str, token: str,
+        filepaths: List[str], workers: int = DEFAULT_WORKERS) -> List[int]:
+    """Like ``via_post``, but for several files, concurrently."""
+    return concurrently(
+        lambda filepath: via_post(api_base, url_relative, token, filepath),
+        filepaths, workers)
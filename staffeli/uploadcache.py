@@ -0,0 +1,87 @@
+"""Upload each feedback file only once.
+
+Uploading a file to Canvas gives us a file id, which can be attached to any
+number of submission comments. We remember the id of every file we upload,
+by assignment, content hash and file name, in ``.staffeli-uploads.yml`` at
+the root of the course. So, if the same file is attached for several
+students, or ``staffeli grade`` is run again, e.g., after a network failure,
+the file is not uploaded again.
+
+If a file is deleted on Canvas, delete the cache file too."""
+
+import hashlib
+import os
+import os.path
+import threading
+import yaml
+
+from typing import Any, Callable, Dict, List, Tuple  # noqa: F401
+
+FILENAME = '.staffeli-uploads.yml'
+
+_CHUNK_SIZE = 1024 * 1024
+
+Key = Tuple[int, str, str]
+
+
+def sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class UploadCache:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._key_locks = {}  # type: Dict[Key, threading.Lock]
+        self._ids = {}  # type: Dict[Key, int]
+        self.hits = 0
+        self.uploads = 0
+        if os.path.isfile(path):
+            with open(path) as f:
+                data = yaml.safe_load(f) or {}
+            for assignment_id, entries in data.get('uploads', {}).items():
+                for entry in entries:
+                    key = (int(assignment_id), entry['sha256'], entry['name'])
+                    self._ids[key] = entry['id']
+
+    def _save(self) -> None:
+        """Assumes the lock is held."""
+        uploads = {}  # type: Dict[int, List[Dict[str, Any]]]
+        for (assignment_id, digest, name), file_id in sorted(
+                self._ids.items()):
+            uploads.setdefault(assignment_id, []).append({
+                'sha256': digest,
+                'name': name,
+                'id': file_id
+            })
+        tmppath = self.path + '.tmp'
+        with open(tmppath, 'w') as f:
+            yaml.safe_dump(
+                {'uploads': uploads}, f, default_flow_style=False)
+        os.replace(tmppath, self.path)
+
+    def upload(
+            self, assignment_id: int, filepath: str,
+            upload: Callable[[], int]) -> int:
+        """The id of the file, calling ``upload`` to upload it if it has not
+        been uploaded for this assignment before."""
+        key = (assignment_id, sha256(filepath), os.path.basename(filepath))
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # Upload the same file only once, even if asked to concurrently.
+        with key_lock:
+            with self._lock:
+                if key in self._ids:
+                    self.hits += 1
+                    return self._ids[key]
+            file_id = upload()
+            with self._lock:
+                self.uploads += 1
+                self._ids[key] = file_id
+                self._save()
+            return file_id
@@ -25,13 +25,32 @@ mypy_files = [
         "staffeli/names.py",
         "staffeli/cachable.py",
         "staffeli/upload.py",
+        "staffeli/transport.py",
+        "staffeli/pagination.py",
+        "staffeli/async_canvas.py",
+        "staffeli/httpcache.py",
+        "staffeli/ratelimit.py",
+        "staffeli/retry.py",
+        "staffeli/memo.py",
+        "staffeli/metrics.py",
+        "staffeli/cassette.py",
+        "staffeli/bulkgrade.py",
+        "staffeli/manifest.py",
+        "staffeli/uploadcache.py",
+        "staffeli/journal.py",
+        "staffeli/sync.py",
+        "staffeli/download.py",
+        "staffeli/blobstore.py",
+        "staffeli/subzip.py",
+        "staffeli/simulator.py",
         "tests/"
     ]
 
 flake8_files = mypy_files + [
         "staffeli/files.py",
         "staffeli/assignment.py",
-        "staffeli/listed.py"
+        "staffeli/listed.py",
+        "benchmarks/bench.py"
     ]
 
 run(["flake8"] + flake8_files)
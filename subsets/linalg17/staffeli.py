@@ -9,17 +9,22 @@
 # https://web.archive.org/web/20160822183947/http://ec.europa.eu/idabc/eupl.html
 # or see it verbatim in LICENSE.md.
 
+import concurrent.futures
 import configparser
+import gzip
 import json
 import os
 import os.path
 import sys
+import threading
+import time
 import urllib
 import urllib.parse
 import urllib.request
+import zlib
 
-from typing import Any, BinaryIO, Dict, List, Tuple, Union
-from urllib.request import Request, urlretrieve
+from typing import Any, Dict, List, Tuple, Union
+from urllib.request import Request
 from http.client import HTTPResponse
 
 RC_FILE = os.path.join(os.path.expanduser('~'), '.staffelirc')
@@ -30,6 +35,14 @@ API_BASE = "https://absalon.ku.dk/api/v1/"
 
 QueryArg = Union[int, str]
 
+# Bytes received from Canvas, as sent, and after decompression.
+BYTES = {'wire': 0, 'decoded': 0}
+
+# Download this many attachments at a time, but at most this many from the
+# same host.
+DOWNLOAD_WORKERS = 8
+DOWNLOADS_PER_HOST = 4
+
 
 def _get_rc() -> Tuple[str, int]:
     config = configparser.ConfigParser()
@@ -47,15 +60,34 @@ def _req(token: str, method: str, url: str, **args: QueryArg) -> Request:
         list(args.items()),
         safe='[]@', doseq=True).encode('utf-8')
 
-    headers = {'Authorization': 'Bearer ' + token}
+    headers = {
+        'Authorization': 'Bearer ' + token,
+        'Accept-Encoding': 'gzip, deflate'
+    }
 
     print(url)
     return urllib.request.Request(
         url, data=query_string, method=method, headers=headers)
 
 
-def _read_json(f: Union[HTTPResponse, BinaryIO]) -> Any:
-    return json.loads(f.read().decode('utf-8'))
+def _decode(body: bytes, encoding: str) -> bytes:
+    encoding = encoding.strip().lower()
+    if encoding in ('gzip', 'x-gzip'):
+        return gzip.decompress(body)
+    if encoding == 'deflate':
+        try:
+            return zlib.decompress(body)
+        except zlib.error:
+            return zlib.decompress(body, -zlib.MAX_WBITS)
+    return body
+
+
+def _read_json(f: HTTPResponse) -> Any:
+    body = f.read()
+    BYTES['wire'] += len(body)
+    body = _decode(body, f.getheader('Content-Encoding') or 'identity')
+    BYTES['decoded'] += len(body)
+    return json.loads(body.decode('utf-8'))
 
 
 def _list_req(token: str, method: str, url: str, **args: QueryArg) -> Request:
@@ -183,16 +215,59 @@ def _write_name(path: str, student: Dict[str, Any]) -> None:
 
 def _fetch_attachments(
         path: str,
-        attachments: List[Dict[str, Any]]
+        attachments: List[Dict[str, Any]],
+        downloads: List[Tuple[str, str]]
         ) -> None:
     for att in attachments:
         targetpath = os.path.join(path, att['filename'])
-        print("Downloading {}..".format(targetpath))
         if os.path.isfile(targetpath):
-            print("Skipped. Looks like it is already here.")
+            print("Skipped {}. Looks like it is already here.".format(
+                targetpath))
             # TODO: Do this smarter
             continue
-        urlretrieve(att['url'], targetpath)
+        downloads.append((att['url'], targetpath))
+
+
+def _download(url: str, path: str) -> int:
+    with urllib.request.urlopen(url) as f:
+        data = f.read()
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(path + '.tmp', path)
+    return len(data)
+
+
+def _download_all(downloads: List[Tuple[str, str]]) -> None:
+    """Download each (url, path), several at a time, showing how far along
+    we are on stderr."""
+    hosts = {}  # type: Dict[str, threading.BoundedSemaphore]
+    for url, _ in downloads:
+        hosts.setdefault(
+            urllib.parse.urlsplit(url).netloc,
+            threading.BoundedSemaphore(DOWNLOADS_PER_HOST))
+    lock = threading.Lock()
+    start = time.monotonic()
+    done = {'files': 0, 'bytes': 0}
+
+    def download(url: str, path: str) -> None:
+        with hosts[urllib.parse.urlsplit(url).netloc]:
+            size = _download(url, path)
+        with lock:
+            done['files'] += 1
+            done['bytes'] += size
+            mib = done['bytes'] / (1024 * 1024)
+            print("\rDownloaded {}/{} files, {:.1f} MiB, {:.1f} MiB/s".format(
+                done['files'], len(downloads), mib,
+                mib / (time.monotonic() - start)),
+                end='', file=sys.stderr, flush=True)
+
+    with concurrent.futures.ThreadPoolExecutor(DOWNLOAD_WORKERS) as pool:
+        futures = [pool.submit(download, url, path)
+                   for url, path in downloads]
+    if downloads:
+        print(file=sys.stderr)
+    for future in futures:
+        future.result()
 
 
 ASSIGNMENT = _normalize_pathname(sys.argv[1])
@@ -208,6 +283,7 @@ for section in sections.keys():
     _mkdir(os.path.join(ASSIGNMENT, pathname))
 
 submissions = _get_submissions(assignment_id)
+downloads = []  # type: List[Tuple[str, str]]
 for user_id, sub in submissions.items():
     student = students[user_id]
     kuid = student['login_id'][:6]
@@ -222,4 +298,8 @@ for user_id, sub in submissions.items():
             "looks like an empty submission :-/ see also the following URL:")
         print(' ', sub['preview_url'])
         continue
-    _fetch_attachments(path, sub['attachments'])
+    _fetch_attachments(path, sub['attachments'], downloads)
+_download_all(downloads)
+
+print("Received {} bytes of metadata ({} bytes uncompressed).".format(
+    BYTES['wire'], BYTES['decoded']))
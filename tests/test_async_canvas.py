@@ -0,0 +1,51 @@
+import asyncio
+import time
+
+from staffeli.async_canvas import AsyncCanvas
+from staffeli.simulator import Simulator, GCAT_BASE
+from staffeli.typed_canvas import Canvas
+
+from typing import Any, List  # noqa: F401
+
+
+def test_gather() -> None:
+    with Simulator(students=5, latency=0.1) as sim:
+        canvas = AsyncCanvas(
+            token='simulated', account_id=1, base_url=sim.url + '/',
+            concurrency=4)
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        start = time.monotonic()
+        # Each an awaitable, though typed_canvas.Canvas says otherwise.
+        calls = [canvas.list_sections(1) for _ in range(12)]  # type: Any
+        sections = loop.run_until_complete(asyncio.gather(*calls))
+        elapsed = time.monotonic() - start
+        canvas.close()
+        loop.close()
+        asyncio.set_event_loop(None)
+        expected = Canvas(
+            token='simulated', account_id=1,
+            base_url=sim.url + '/').list_sections(1)
+    assert sections == [expected] * 12
+    # Four at a time.
+    assert 3 * 0.1 <= elapsed < 12 * 0.1 / 2
+
+
+def test_iter_list() -> None:
+    with Simulator(students=5, groups=250) as sim:
+        canvas = AsyncCanvas(
+            token='simulated', account_id=1, base_url=sim.url + '/')
+        ids = []  # type: List[int]
+
+        async def collect() -> None:
+            async for group in canvas.iter_list(
+                    'group_categories/{}/groups'.format(GCAT_BASE)):
+                ids.append(group['id'])
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(collect())
+        canvas.close()
+        loop.close()
+        asyncio.set_event_loop(None)
+        assert ids == sorted(sim.groups)
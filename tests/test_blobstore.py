@@ -0,0 +1,45 @@
+import os
+import shutil
+
+from staffeli.blobstore import BlobStore, DIRNAME, copy
+
+from typing import List  # noqa: F401
+
+
+def test_fetch_once(tmpdir: str) -> None:
+    store = BlobStore(os.path.join(str(tmpdir), DIRNAME))
+    downloads = []  # type: List[int]
+
+    def download(path: str) -> None:
+        downloads.append(7)
+        with open(path, 'wb') as out:
+            out.write(b'handin')
+
+    a = os.path.join(str(tmpdir), 'a')
+    b = os.path.join(str(tmpdir), 'b')
+    assert store.fetch(7, a, download)[2]
+    size, sha256, fresh = store.fetch(7, b, download)
+    assert (size, fresh) == (len(b'handin'), False)
+    assert downloads == [7]
+    assert os.path.samefile(a, b)
+
+    # Linked along, e.g., into splits/.
+    os.mkdir(os.path.join(str(tmpdir), 'sub'))
+    with open(os.path.join(str(tmpdir), 'sub', 'notes.txt'), 'w') as notes:
+        notes.write('Good.')
+    shutil.move(b, os.path.join(str(tmpdir), 'sub', 'b'))
+    split = os.path.join(str(tmpdir), 'split')
+    shutil.copytree(
+        os.path.join(str(tmpdir), 'sub'), split, copy_function=copy)
+    assert os.path.samefile(a, os.path.join(split, 'b'))
+    assert os.stat(os.path.join(split, 'notes.txt')).st_nlink == 1
+
+    # Edited in place, so the blob no longer matches; download it again.
+    with open(a, 'wb') as edit:
+        edit.write(b'graded')
+    c = os.path.join(str(tmpdir), 'c')
+    assert store.fetch(7, c, download)[1:] == (sha256, True)
+    assert downloads == [7, 7]
+    with open(c, 'rb') as f:
+        assert f.read() == b'handin'
+    assert (store.downloads, store.hits) == (2, 1)
@@ -0,0 +1,101 @@
+import os
+import pytest
+
+from staffeli import bulkgrade, canvas
+from staffeli.bulkgrade import Feedback
+from staffeli.journal import Journal, BEGUN, DONE
+from staffeli.simulator import Simulator, ASSIGNMENT_BASE, USER_BASE
+
+from typing import Any, Dict, Iterable, List, Optional  # noqa: F401
+
+
+def test_grade_data() -> None:
+    args = bulkgrade.grade_data({
+        2: Feedback('fail'),
+        1: Feedback('pass', 'Well done.', [7, 8])
+    })
+    assert args == [
+        ('grade_data[1][posted_grade]', 'pass'),
+        ('grade_data[1][text_comment]', 'Well done.'),
+        ('grade_data[1][file_ids][]', 7),
+        ('grade_data[1][file_ids][]', 8),
+        ('grade_data[1][group_comment]', 1),
+        ('grade_data[2][posted_grade]', 'fail'),
+    ]
+
+
+def test_outcomes() -> None:
+    feedback = {1: Feedback('pass'), 2: Feedback('7'), 3: Feedback('pass')}
+    subs = [
+        {'user_id': 1, 'grade': 'complete'},
+        {'user_id': 2, 'grade': '8', 'entered_grade': '8'}
+    ]
+    assert bulkgrade.outcomes(feedback, subs) == {
+        1: None, 2: 'grade is 8, not 7', 3: 'no submission'}
+
+
+def test_bulk_give_feedback() -> None:
+    with Simulator(students=5) as sim:
+        c = canvas.Canvas(
+            token='simulated', account_id=1, api_base=sim.api_base)
+        feedback = {
+            USER_BASE: Feedback('pass', 'Well done.'),
+            USER_BASE + 1: Feedback('fail', 'Try again.'),
+            # Not a student in the course.
+            1: Feedback('pass')
+        }
+        before = sim.requests
+        outcomes = c.bulk_give_feedback(1, ASSIGNMENT_BASE, feedback)
+        assert outcomes == {
+            USER_BASE: None, USER_BASE + 1: None, 1: 'no submission'}
+        # Post, poll, and check, regardless of the number of students.
+        assert sim.requests - before == 3
+
+        graded = sim.grades[(ASSIGNMENT_BASE, USER_BASE + 1)]
+        assert graded['grade'] == 'fail'
+        assert graded['submission_comments'][0]['comment'] == 'Try again.'
+
+
+def test_resume(tmpdir: str) -> None:
+    path = os.path.join(str(tmpdir), 'journal')
+    feedback = {1: Feedback('pass', 'Good.'), 2: Feedback('fail', 'Bad.')}
+    sent = []  # type: List[List[int]]
+
+    def crash(todo: Dict[int, Feedback]) -> Dict[int, Optional[str]]:
+        raise OSError("The network is down.")
+
+    def send(todo: Dict[int, Feedback]) -> Dict[int, Optional[str]]:
+        sent.append(sorted(todo))
+        return {user_id: None for user_id in todo}
+
+    def fetch(user_ids: List[int]) -> Iterable[Dict[str, Any]]:
+        # Only the first student's feedback made it to Canvas.
+        return [
+            {'user_id': 1, 'grade': 'complete',
+             'submission_comments': [{'comment': 'Good.'}]},
+            {'user_id': 2, 'grade': None}
+        ]
+
+    with pytest.raises(OSError):
+        bulkgrade.resume(Journal(path), 500, feedback, crash, fetch)
+    journal = Journal(path)
+    assert journal.state(bulkgrade.key(500, 1, feedback[1])) == BEGUN
+
+    assert bulkgrade.resume(journal, 500, feedback, send, fetch) == \
+        ({1: None, 2: None}, 1)
+    assert sent == [[2]]
+
+    # A partial last line, as if we crashed while writing it.
+    with open(path, 'a') as f:
+        f.write('{"op": "beg')
+    journal = Journal(path)
+    assert journal.state(bulkgrade.key(500, 2, feedback[2])) == DONE
+    assert bulkgrade.resume(journal, 500, feedback, send, fetch) == \
+        ({1: None, 2: None}, 2)
+    assert sent == [[2]]
+
+    # Different feedback is given anew.
+    feedback[2] = Feedback('pass', 'Better.')
+    bulkgrade.resume(journal, 500, feedback, send, fetch)
+    assert sent == [[2], [2]]
+    assert Journal(path).state(bulkgrade.key(500, 2, feedback[2])) == DONE
@@ -0,0 +1,14 @@
+from staffeli import canvas
+from staffeli.simulator import Simulator, GCAT_BASE
+
+
+def test_arg_list_untouched() -> None:
+    with Simulator(students=5, groups=250) as sim:
+        c = canvas.Canvas(
+            token='simulated', account_id=1, api_base=sim.api_base)
+        args = [('include[]', 'users')]
+        groups = list(c.iter_list(
+            'group_categories/{}/groups'.format(GCAT_BASE), _arg_list=args))
+    assert len(groups) == 250
+    # Each page is asked for with the same arguments, not ever more of them.
+    assert args == [('include[]', 'users')]
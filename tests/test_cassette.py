@@ -0,0 +1,75 @@
+import os
+import time
+
+from staffeli import transport, upload
+from staffeli.simulator import Simulator, ASSIGNMENT_BASE, USER_BASE
+from staffeli.typed_canvas import Canvas
+
+TOKEN = 'secret-token'
+
+
+def test_record_and_replay(tmpdir: str) -> None:
+    path = os.path.join(str(tmpdir), 'canvas.cassette')
+    with Simulator(students=30, groups=25, latency=0.05) as sim:
+        canvas = Canvas(token=TOKEN, account_id=1, base_url=sim.url + '/')
+        transport.record(path)
+        try:
+            groups = canvas.list_groups(200)
+            course = canvas.create_course('Recorded')
+        finally:
+            transport.stop_cassette()
+        recorded = sim.requests
+
+    with open(path, 'rb') as f:
+        assert TOKEN.encode('ascii') not in f.read()
+
+    # The simulator is gone; everything comes from the cassette.
+    transport.replay(path)
+    try:
+        start = time.monotonic()
+        assert canvas.list_groups(200) == groups
+        assert canvas.create_course('Recorded') == course
+        assert time.monotonic() - start < 0.05 * recorded
+    finally:
+        transport.stop_cassette()
+
+
+def test_replay_timing(tmpdir: str) -> None:
+    path = os.path.join(str(tmpdir), 'canvas.cassette')
+    with Simulator(students=1, latency=0.1) as sim:
+        canvas = Canvas(token=TOKEN, account_id=1, base_url=sim.url + '/')
+        transport.record(path)
+        try:
+            canvas.list_courses()
+        finally:
+            transport.stop_cassette()
+
+    transport.replay(path, timing=True)
+    try:
+        start = time.monotonic()
+        canvas.list_courses()
+        assert time.monotonic() - start >= 0.1
+    finally:
+        transport.stop_cassette()
+
+
+def test_replay_upload(tmpdir: str) -> None:
+    path = os.path.join(str(tmpdir), 'upload.cassette')
+    feedback = os.path.join(str(tmpdir), 'feedback.txt')
+    with open(feedback, 'w') as f:
+        f.write('Well done.')
+    url = 'courses/1/assignments/{}/submissions/{}/comments/files'.format(
+        ASSIGNMENT_BASE, USER_BASE)
+    with Simulator(students=1) as sim:
+        transport.record(path)
+        try:
+            file_id = upload.via_post(sim.api_base, url, TOKEN, feedback)
+        finally:
+            transport.stop_cassette()
+
+    # Even though the multipart body has a new boundary.
+    transport.replay(path)
+    try:
+        assert upload.via_post(sim.api_base, url, TOKEN, feedback) == file_id
+    finally:
+        transport.stop_cassette()
@@ -0,0 +1,109 @@
+import io
+import os
+import pytest
+import time
+import urllib.error
+
+from urllib.request import Request
+
+from staffeli import blobstore, download, metrics, transport
+from staffeli.simulator import Simulator, FILE_BASE, file_content
+
+
+def test_downloader(tmpdir: str) -> None:
+    stream = io.StringIO()
+    with Simulator(students=1, latency=0.1, attachment_size=1000) as sim:
+        start = time.monotonic()
+        with download.Downloader(
+                workers=8, per_host=4, stream=stream) as downloader:
+            for i in range(8):
+                downloader.add(
+                    '{}/files/{}/download'.format(sim.url, FILE_BASE + i),
+                    os.path.join(str(tmpdir), str(i)))
+        elapsed = time.monotonic() - start
+    for i in range(8):
+        with open(os.path.join(str(tmpdir), str(i)), 'rb') as f:
+            assert f.read() == file_content(FILE_BASE + i, 1000)
+    assert sorted(os.listdir(str(tmpdir))) == [str(i) for i in range(8)]
+    # Four at a time from the one host.
+    assert 2 * 0.1 <= elapsed < 8 * 0.1 / 2
+    assert stream.getvalue().startswith('Downloaded 8/8 files')
+
+
+def test_download_fails(tmpdir: str) -> None:
+    with Simulator(students=1) as sim:
+        with pytest.raises(urllib.error.HTTPError):
+            download.download_all([
+                ('{}/files/1/download'.format(sim.url),
+                 os.path.join(str(tmpdir), 'missing')),
+                ('{}/files/{}/download'.format(sim.url, FILE_BASE),
+                 os.path.join(str(tmpdir), 'found'))
+            ])
+    # The other files still arrive, and nothing is left half-done.
+    assert os.listdir(str(tmpdir)) == ['found']
+
+
+def test_blob_store(tmpdir: str) -> None:
+    stream = io.StringIO()
+    store = blobstore.BlobStore(os.path.join(str(tmpdir), blobstore.DIRNAME))
+    with Simulator(students=1) as sim:
+        url = '{}/files/{}/download?download_frd=1'.format(sim.url, FILE_BASE)
+        with download.Downloader(stream=stream, store=store) as downloader:
+            for name in ['a', 'b', 'c']:
+                downloader.add(url, os.path.join(str(tmpdir), name))
+    assert (store.downloads, store.hits) == (1, 2)
+    assert stream.getvalue().startswith(
+        'Downloaded 3/3 files (2 from the blob store)')
+
+
+def test_resume(tmpdir: str) -> None:
+    path = os.path.join(str(tmpdir), 'video.mp4')
+    with Simulator(students=1, attachment_size=100000) as sim:
+        url = '{}/files/{}/download'.format(sim.url, FILE_BASE)
+        sim.drop(FILE_BASE, 30000)
+        assert download.fetch(url, path, 100000)[0] == 100000
+        assert sim.ranges == 1
+
+        # A part left by an earlier run is picked up.
+        with open(path + '.part', 'wb') as f:
+            f.write(file_content(FILE_BASE, 100000)[:60000])
+        download.fetch(url, path)
+        assert sim.ranges == 2
+
+        # Even when it is no part of the file.
+        with open(path + '.part', 'wb') as f:
+            f.write(b'x' * 200000)
+        download.fetch(url, path)
+    with open(path, 'rb') as f:
+        assert f.read() == file_content(FILE_BASE, 100000)
+    assert os.listdir(str(tmpdir)) == ['video.mp4']
+
+
+def test_retry(tmpdir: str) -> None:
+    path = os.path.join(str(tmpdir), 'report.pdf')
+    with Simulator(students=1, attachment_size=1000) as sim:
+        url = '{}/files/{}/download'.format(sim.url, FILE_BASE)
+        sim.fail(FILE_BASE, 2)
+        before = sim.requests
+        assert download.fetch(url, path)[0] == 1000
+        assert sim.requests - before == 3
+
+
+def test_wrong_size(tmpdir: str) -> None:
+    path = os.path.join(str(tmpdir), 'report.pdf')
+    with Simulator(students=1, attachment_size=1000) as sim:
+        url = '{}/files/{}/download'.format(sim.url, FILE_BASE)
+        with pytest.raises(OSError):
+            download.fetch(url, path, 2000)
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_stream_metrics(tmpdir: str) -> None:
+    manager = transport.PoolManager()
+    manager.recorder = metrics.Recorder()
+    with Simulator(students=1, attachment_size=1000) as sim:
+        url = '{}/files/{}/download'.format(sim.url, FILE_BASE)
+        with open(os.path.join(str(tmpdir), 'report.pdf'), 'wb') as f:
+            manager.stream(Request(url), f)
+    [endpoint] = manager.recorder.publicjson().values()
+    assert endpoint['bytes_wire'] == endpoint['bytes_decoded'] == 1000
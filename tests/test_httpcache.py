@@ -0,0 +1,76 @@
+from email.message import Message
+from typing import List, Optional  # noqa: F401
+from urllib.request import Request
+
+from staffeli import transport
+from staffeli.httpcache import ResponseCache
+from staffeli.simulator import Simulator
+from staffeli.transport import Response
+
+
+def test_revalidate(tmpdir: str) -> None:
+    cache = ResponseCache(str(tmpdir))
+    manager = transport.PoolManager()
+    with Simulator(students=5) as sim:
+        url = sim.api_base + 'courses/1/sections'
+        first = cache.urlopen(Request(url), manager.urlopen)
+        assert first.getheader('ETag') is not None
+        second = cache.urlopen(Request(url), manager.urlopen)
+        assert sim.not_modified == 1
+    assert (second.status, second.body) == (200, first.body)
+    assert cache.stats() == {
+        'cache_hits': 1, 'cache_misses': 1, 'cache_evictions': 0}
+
+
+class Server:
+    """Answers each request with the next response, and remembers what it
+    was asked."""
+
+    def __init__(self, *responses: Response) -> None:
+        self.responses = list(responses)
+        self.asked = []  # type: List[Optional[str]]
+
+    def send(self, req: Request) -> Response:
+        self.asked.append(req.get_header('If-none-match'))
+        return self.responses.pop(0)
+
+
+def response(
+        status: int = 200, body: bytes = b'[]', etag: str = '"1"',
+        cache_control: Optional[str] = None) -> Response:
+    headers = Message()
+    headers['ETag'] = etag
+    if cache_control is not None:
+        headers['Cache-Control'] = cache_control
+    return Response('http://canvas/api/v1/courses', status, 'OK', headers,
+                    body)
+
+
+def test_not_cachable(tmpdir: str) -> None:
+    cache = ResponseCache(str(tmpdir))
+    req = Request('http://canvas/api/v1/courses')
+    server = Server(response(), response(cache_control='no-store'),
+                    response(body=b'[1]'))
+    for _ in range(3):
+        cache.urlopen(req, server.send)
+    # The response that may not be stored takes the old one with it.
+    assert server.asked == [None, '"1"', None]
+    assert cache.stats()['cache_hits'] == 0
+
+
+def test_evict(tmpdir: str) -> None:
+    cache = ResponseCache(str(tmpdir), max_size=250)
+    server = Server(
+        response(body=b'x' * 100), response(body=b'y' * 100), response(304),
+        response(body=b'z' * 100), response(304))
+    reqs = [Request('http://canvas/api/v1/courses/{}'.format(i))
+            for i in range(3)]
+    cache.urlopen(reqs[0], server.send)
+    cache.urlopen(reqs[1], server.send)
+    cache.urlopen(reqs[0], server.send)
+    cache.urlopen(reqs[2], server.send)
+    # The least recently used response goes.
+    assert cache.lookup(transport.request_key(reqs[1])) is None
+    assert cache.stats()['cache_evictions'] == 1
+    assert cache.urlopen(reqs[0], server.send).body == b'x' * 100
+    assert cache.stats()['cache_hits'] == 2
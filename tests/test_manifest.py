@@ -0,0 +1,47 @@
+import os
+import pytest
+
+from staffeli import manifest
+
+
+def write(tmpdir: str, name: str, content: str) -> str:
+    path = os.path.join(str(tmpdir), name)
+    with open(path, 'w') as f:
+        f.write(content)
+    return path
+
+
+def test_csv(tmpdir: str) -> None:
+    path = write(tmpdir, 'grades.csv', (
+        'kuid,grade,comment,attachments\n'
+        'abc123,pass,"Well done, really.",a/feedback.pdf; a/tests.txt\n'
+        'def456,7,,\n'))
+    first, second = manifest.load(path)
+    assert (first.kuid, first.grade) == ('abc123', 'pass')
+    assert first.comment == 'Well done, really.'
+    assert first.attachments == [
+        os.path.join(str(tmpdir), 'a', 'feedback.pdf'),
+        os.path.join(str(tmpdir), 'a', 'tests.txt')]
+    assert (second.grade, second.comment, second.attachments) == \
+        ('7', None, [])
+
+
+def test_yaml(tmpdir: str) -> None:
+    path = write(tmpdir, 'grades.yml', (
+        '- kuid: abc123\n'
+        '  grade: 7\n'
+        '  attachments: [feedback.pdf]\n'))
+    entry, = manifest.load(path)
+    assert entry.grade == '7'
+    assert entry.attachments == [os.path.join(str(tmpdir), 'feedback.pdf')]
+
+
+@pytest.mark.parametrize('content', [
+    'kuid,grade\nabc123,\n',
+    'kuid,grade,points\nabc123,pass,7\n',
+    'kuid,grade\nabc123,pass,too many\n',
+    'kuid,grade\nabc123,pass\nabc123,fail\n',
+])
+def test_errors(tmpdir: str, content: str) -> None:
+    with pytest.raises(ValueError):
+        manifest.load(write(tmpdir, 'grades.csv', content))
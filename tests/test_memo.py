@@ -0,0 +1,106 @@
+import threading
+
+from email.message import Message
+from staffeli import transport
+from staffeli.memo import Memo
+from staffeli.transport import Response
+from typing import Any, Callable, List
+from urllib.request import Request
+
+URL = 'http://localhost:3000/api/v1/courses'
+
+
+def _send(
+        sent: List[str],
+        release: threading.Event) -> Callable[[Request], Response]:
+    def send(req: Request) -> Response:
+        sent.append(req.full_url)
+        release.wait()
+        return Response(req.full_url, 200, 'OK', Message(), b'[]')
+    return send
+
+
+def test_memo_coalesces_and_remembers() -> None:
+    memo = Memo()
+    sent = []  # type: List[str]
+    release = threading.Event()
+    send = _send(sent, release)
+
+    threads = [
+        threading.Thread(target=memo.urlopen, args=(Request(URL), send))
+        for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join()
+    memo.urlopen(Request(URL), send)
+
+    assert sent == [URL]
+
+
+def test_memo_invalidate() -> None:
+    memo = Memo()
+    sent = []  # type: List[str]
+    release = threading.Event()
+    release.set()
+    send = _send(sent, release)
+
+    memo.urlopen(Request(URL), send)
+    memo.invalidate()
+    memo.urlopen(Request(URL), send)
+
+    assert sent == [URL, URL]
+
+
+def test_memo_evicts() -> None:
+    memo = Memo(max_size=5)
+    sent = []  # type: List[str]
+    release = threading.Event()
+    release.set()
+    send = _send(sent, release)
+
+    # Each response is 2 bytes; the memo holds two.
+    urls = [URL + '/{}'.format(i) for i in range(3)]
+    memo.urlopen(Request(urls[0]), send)
+    memo.urlopen(Request(urls[1]), send)
+    memo.urlopen(Request(urls[0]), send)
+    memo.urlopen(Request(urls[2]), send)
+    memo.urlopen(Request(urls[0]), send)
+    memo.urlopen(Request(urls[1]), send)
+
+    assert sent == [urls[0], urls[1], urls[2], urls[1]]
+    assert memo.stats()['memo_evictions'] == 2
+
+
+class Canvas:
+    """Holds on to a POST until told to let it through, and only then
+    changes what a GET sees."""
+
+    def __init__(self) -> None:
+        self.body = b'[]'
+        self.posting = threading.Event()
+        self.release = threading.Event()
+
+    def urlopen(self, req: Request, redirect: bool = True) -> Response:
+        if req.get_method() == 'POST':
+            self.posting.set()
+            self.release.wait()
+            self.body = b'[1]'
+        return Response(req.full_url, 200, 'OK', Message(), self.body)
+
+
+def test_memo_overlapping_write(monkeypatch: Any) -> None:
+    canvas = Canvas()
+    monkeypatch.setattr(transport, '_manager', canvas)
+    monkeypatch.setattr(transport, '_memo', Memo())
+
+    post = threading.Thread(
+        target=transport.urlopen, args=(Request(URL, b'{}'),))
+    post.start()
+    canvas.posting.wait()
+    assert transport.urlopen(Request(URL)).body == b'[]'
+    canvas.release.set()
+    post.join()
+
+    assert transport.urlopen(Request(URL)).body == b'[1]'
@@ -0,0 +1,41 @@
+from staffeli.metrics import Recorder, endpoint_template
+
+
+def test_endpoint_template_replaces_ids() -> None:
+    assert endpoint_template(
+        'GET',
+        'https://absalon.ku.dk/api/v1/courses/42/assignments/7/submissions'
+        '?per_page=100&page=3') == \
+        'GET courses/:id/assignments/:id/submissions'
+    assert endpoint_template(
+        'PUT', 'https://absalon.ku.dk/api/v1//users/self/files') == \
+        'PUT users/:id/files'
+    assert endpoint_template(
+        'POST', 'https://uploads.example.com/upload/12') == \
+        'POST uploads.example.com/upload/:id'
+    assert endpoint_template(
+        'POST', 'http://localhost:3000/files/upload/'
+        'd100103f87b24b2398353c13d150fe48') == \
+        'POST localhost:3000/files/upload/:id'
+
+
+def test_recorder_groups_by_endpoint() -> None:
+    recorder = Recorder()
+    for course in range(3):
+        recorder.record(
+            'GET', 'http://localhost:3000/api/v1/courses/{}'.format(course),
+            0.1, page=True, bytes_wire=100, bytes_decoded=400)
+    recorder.record(
+        'GET', 'http://localhost:3000/api/v1/courses/1', 0.2,
+        error=True, retries=2)
+    stats = recorder.publicjson()
+    assert list(stats) == ['GET courses/:id']
+    endpoint = stats['GET courses/:id']
+    assert endpoint['calls'] == 4
+    assert endpoint['pages'] == 3
+    assert endpoint['errors'] == 1
+    assert endpoint['retries'] == 2
+    assert endpoint['bytes_wire'] == 300
+    assert endpoint['bytes_decoded'] == 1200
+    assert sum(endpoint['histogram'].values()) == 4
+    assert 'GET courses/:id' in recorder.table()
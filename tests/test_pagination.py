@@ -0,0 +1,50 @@
+from hypothesis import given
+from hypothesis.strategies import booleans, integers
+from staffeli import pagination
+from typing import Any, List, Tuple
+
+BASE = 'http://localhost:3000/api/v1/courses?per_page=100'
+
+
+def _fetcher(npages: int, bookmarks: bool) -> Tuple[
+        pagination.Fetch, List[str]]:
+    fetched = []  # type: List[str]
+
+    def url(page: int) -> str:
+        if bookmarks:
+            return '{}&page=bookmark:{}'.format(BASE, page)
+        return '{}&page={}'.format(BASE, page)
+
+    def fetch(u: str) -> Tuple[Any, pagination.Links]:
+        fetched.append(u)
+        page = 1 if u == BASE else \
+            int(u.split('page=')[-1].replace('bookmark:', ''))
+        links = {'current': url(page), 'first': url(1), 'last': url(npages)}
+        if page < npages:
+            links['next'] = url(page + 1)
+        return ([page], links)
+
+    return (fetch, fetched)
+
+
+def test_parse_link_header() -> None:
+    header = \
+        '<https://a/b?page=2&per_page=100>; rel="current",' + \
+        '<https://a/b?page=3&per_page=100>; rel="next",' + \
+        '<https://a/b?page=9&per_page=100>; rel="last"'
+    links = pagination.parse_link_header(header)
+    assert links['next'] == 'https://a/b?page=3&per_page=100'
+    assert links['last'] == 'https://a/b?page=9&per_page=100'
+    assert pagination.parse_link_header(None) == {}
+
+
+@given(
+    npages=integers(min_value=1, max_value=30),
+    workers=integers(min_value=1, max_value=8),
+    bookmarks=booleans())
+def test_iter_pages_in_order(
+        npages: int, workers: int, bookmarks: bool) -> None:
+    fetch, fetched = _fetcher(npages, bookmarks)
+    pages = list(pagination.iter_pages(fetch, BASE, workers))
+    assert pages == [[page] for page in range(1, npages + 1)]
+    assert len(fetched) == npages
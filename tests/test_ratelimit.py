@@ -0,0 +1,33 @@
+from email.message import Message
+from staffeli.ratelimit import Throttle
+
+
+def _headers(remaining: float, cost: float = 1.0) -> Message:
+    headers = Message()
+    headers['X-Rate-Limit-Remaining'] = str(remaining)
+    headers['X-Request-Cost'] = str(cost)
+    return headers
+
+
+def test_throttle_grows_with_room_to_spare() -> None:
+    throttle = Throttle(initial=2, maximum=8)
+    for _ in range(100):
+        throttle.acquire()
+        throttle.release(_headers(700.0))
+    assert throttle.limit == 8
+
+
+def test_throttle_halves_when_bucket_runs_low() -> None:
+    throttle = Throttle(initial=8, maximum=8)
+    throttle.acquire()
+    throttle.release(_headers(200.0))
+    assert throttle.limit == 4
+    assert throttle.stats()['throttle_decreases'] == 1
+
+
+def test_throttle_backs_off_when_throttled() -> None:
+    throttle = Throttle(initial=8, maximum=8)
+    throttle.acquire()
+    throttle.release(None, throttled=True)
+    assert throttle.limit == 4
+    assert throttle.stats()['rate_limited'] == 1
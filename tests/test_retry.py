@@ -0,0 +1,27 @@
+from hypothesis import given
+from hypothesis.strategies import integers
+from staffeli.retry import RetryPolicy, parse_retry_after
+
+
+def test_parse_retry_after() -> None:
+    assert parse_retry_after('3') == 3.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+    assert parse_retry_after('soon') is None
+
+
+def test_retries_only_idempotent_requests() -> None:
+    policy = RetryPolicy(attempts=3)
+    assert policy.should_retry(0, 'GET', 503)
+    assert policy.should_retry(0, 'PUT', None)
+    assert not policy.should_retry(0, 'POST', 503)
+    assert policy.should_retry(0, 'POST', 403, throttled=True)
+    assert not policy.should_retry(0, 'GET', 404)
+    assert not policy.should_retry(2, 'GET', 503)
+
+
+@given(attempt=integers(min_value=0, max_value=20))
+def test_delay_is_capped(attempt: int) -> None:
+    policy = RetryPolicy(base_delay=0.5, max_delay=30.0)
+    assert 0 <= policy.delay(attempt) <= 30.0
+    assert policy.delay(attempt, '60') >= 60.0
@@ -0,0 +1,70 @@
+import os
+import pytest
+
+from staffeli import pagination, ratelimit, transport, upload
+from staffeli.simulator import Simulator, GCAT_BASE, USER_BASE
+from staffeli.typed_canvas import Canvas
+from typing import Iterator
+from urllib.request import Request
+
+SUBMISSION = 'courses/1/assignments/500/submissions/{}'.format(USER_BASE)
+
+
+@pytest.fixture(scope='module')
+def sim() -> Iterator[Simulator]:
+    with Simulator(students=30, groups=250) as sim:
+        yield sim
+
+
+@pytest.fixture(scope='module')
+def canvas(sim: Simulator) -> Canvas:
+    return Canvas(token='simulated', account_id=1, base_url=sim.url + '/')
+
+
+def test_pagination(sim: Simulator, canvas: Canvas) -> None:
+    before = sim.requests
+    groups = canvas.list_groups(GCAT_BASE)
+    assert [g['id'] for g in groups] == sorted(sim.groups)
+    assert sim.requests - before == 3
+
+    req = Request(canvas.api_url('courses/1/sections?per_page=1'))
+    with transport.urlopen(req) as f:
+        links = pagination.parse_link_header(f.getheader('Link'))
+    assert set(links) == {'current', 'next', 'first', 'last'}
+    assert 'page=2' in links['last']
+
+
+def test_create_and_delete(canvas: Canvas) -> None:
+    course = canvas.create_course('Offline')
+    assert course['name'] == 'Offline'
+    section = canvas.create_section(course['id'], 'Lab')
+    assert canvas.list_sections(course['id']) == [section]
+    assert canvas.delete_section(section['id']) == section
+    assert canvas.list_sections(course['id']) == []
+
+
+def test_upload_via_post(sim: Simulator, tmpdir: str) -> None:
+    path = os.path.join(str(tmpdir), 'feedback.txt')
+    with open(path, 'wb') as f:
+        f.write(b'Well done.\n')
+    file_id = upload.via_post(
+        sim.api_base, SUBMISSION + '/comments/files', 'simulated', path)
+    assert sim.download(file_id) == b'Well done.\n'
+
+
+def test_rate_limit() -> None:
+    sim = Simulator(students=1, rate_limit=2 * ratelimit.PREFLIGHT_COST)
+    assert sim.bucket is not None
+
+    # With two requests in flight, there is no room for a third.
+    assert sim.bucket.start() and sim.bucket.start()
+    status, headers, body = sim.handle('GET', '/api/v1/courses', [])
+    assert ratelimit.is_throttled(status, body)
+    assert sim.throttled == 1
+
+    sim.bucket.finish(1.0)
+    sim.bucket.finish(1.0)
+    status, headers, body = sim.handle('GET', '/api/v1/courses', [])
+    assert status == 200
+    assert float(headers['X-Rate-Limit-Remaining']) > 0
+    assert float(headers['X-Request-Cost']) >= 1.0
@@ -0,0 +1,56 @@
+import os
+import time
+
+from staffeli import canvas, subzip
+from staffeli.simulator import Simulator, ASSIGNMENT_BASE, USER_BASE
+from staffeli.simulator import file_content
+
+from typing import List  # noqa: F401
+
+
+def test_parse() -> None:
+    member = subzip.parse('doejane_late_123456_7891011_my_report.pdf')
+    assert member is not None
+    assert (member.user_id, member.attachment_id, member.filename,
+            member.late) == (123456, 7891011, 'my_report.pdf', True)
+    member = subzip.parse('doejane_123456_text.html')
+    assert member is not None
+    assert (member.user_id, member.attachment_id, member.filename,
+            member.late) == (123456, None, subzip.TEXT, False)
+    assert subzip.parse('__MACOSX/doejane_123456_7_a.pdf') is None
+
+    # Nothing may end up outside the directory of the submission.
+    for filename in ['../../../.bashrc', '/etc/passwd', 'a/../../b',
+                     '..\\..\\x.exe', '..']:
+        assert subzip.parse('doejane_123456_7_' + filename) is None
+
+
+def test_download_and_unpack(tmpdir: str) -> None:
+    path = os.path.join(str(tmpdir), 'submissions.zip')
+    members = []  # type: List[subzip.Member]
+    with Simulator(students=3, attachment_size=100) as sim:
+        c = canvas.Canvas(
+            token='simulated', account_id=1, api_base=sim.api_base)
+        start = time.monotonic()
+        size = c.download_submissions_zip(1, ASSIGNMENT_BASE, path)
+        # Asked once while it is made, and once more when it is.
+        assert time.monotonic() - start >= subzip.POLL_INTERVAL
+        subs = {sub['user_id']: sub for sub in c.list_submissions(
+            1, ASSIGNMENT_BASE)}
+    assert size == os.path.getsize(path)
+    assert os.listdir(str(tmpdir)) == ['submissions.zip']
+
+    targets = []
+    for name in subzip.names(path):
+        member = subzip.parse(name)
+        assert member is not None and member.user_id in subs
+        if member.attachment_id is not None:
+            members.append(member)
+            targets.append((name, os.path.join(str(tmpdir), name)))
+    extracted = subzip.unpack(path, targets, workers=2)
+    assert len(extracted) == len(targets) > 0
+    for member, (size, _) in zip(members, extracted):
+        assert member.user_id >= USER_BASE and size == 100
+        with open(os.path.join(str(tmpdir), member.name), 'rb') as f:
+            assert f.read() == file_content(
+                member.attachment_id or 0, 100)
@@ -0,0 +1,95 @@
+import os
+import time
+
+from staffeli import canvas, cli, sync, uploadcache
+from staffeli.simulator import Simulator, ASSIGNMENT_BASE, USER_BASE
+
+from typing import Any, List  # noqa: F401
+
+
+def changed(c: canvas.Canvas, since: str) -> List[int]:
+    subs = c.iter_submissions_since(1, ASSIGNMENT_BASE, since)
+    return sorted(sub['user_id'] for sub in subs)
+
+
+def test_submissions_since() -> None:
+    with Simulator(students=5) as sim:
+        c = canvas.Canvas(
+            token='simulated', account_id=1, api_base=sim.api_base)
+        since = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        assert changed(c, since) == []
+
+        time.sleep(1)
+        sim.resubmit(ASSIGNMENT_BASE, USER_BASE + 1)
+        c.put('courses/1/assignments/{}/submissions/{}'.format(
+            ASSIGNMENT_BASE, USER_BASE + 3),
+            _arg_list=[('submission[posted_grade]', 'pass')])
+        assert changed(c, since) == [USER_BASE + 1, USER_BASE + 3]
+
+
+def test_watermark(tmpdir: str) -> None:
+    path = str(tmpdir)
+    assert sync.load(path) is None
+    sync.save(path, '2017-09-08T12:00:00Z')
+    assert sync.load(path) == '2017-09-08T12:00:00Z'
+    assert os.listdir(path) == [sync.FILENAME]
+
+
+def test_resubmitted(tmpdir: str) -> None:
+    sub = canvas.Submission({
+        'user_id': USER_BASE, 'attempt': 1,
+        'submitted_at': '2017-09-08T12:00:00Z', 'grade': None})
+    subpath = str(tmpdir)
+    assert sync.resubmitted(subpath, sub.json)
+    sub.cache(subpath)
+
+    graded = dict(sub.json, grade='complete')
+    assert not sync.resubmitted(subpath, graded)
+    handed_in = dict(sub.json, attempt=2, submitted_at='2017-09-09T12:00:00Z')
+    assert sync.resubmitted(subpath, handed_in)
+
+
+def test_unchanged(tmpdir: str) -> None:
+    subpath = str(tmpdir)
+    path = os.path.join(subpath, 'a.txt')
+    att = {'id': 7, 'filename': 'a.txt', 'size': 5, 'updated_at': 'T1'}
+    sub = canvas.Submission({'user_id': USER_BASE, 'attachments': [att]})
+    sub.cache(subpath)
+
+    # Without a record, the attachments of the cached submission are taken
+    # to be downloaded under their own names.
+    entry = sync.downloads(subpath)[7]
+    assert not sync.unchanged(subpath, att, entry)
+    with open(path, 'w') as f:
+        f.write('hello')
+    assert sync.unchanged(subpath, att, entry)
+    assert not sync.unchanged(subpath, dict(att, updated_at='T2'), entry)
+
+    entry = sync.record(subpath, path, att, uploadcache.sha256(path))
+    sub.downloads = {7: entry}
+    sub.cache(subpath)
+    assert sync.downloads(subpath) == {7: {
+        'path': 'a.txt', 'size': 5, 'updated_at': 'T1',
+        'sha256': uploadcache.sha256(path)}}
+    with open(path, 'w') as f:
+        f.write('HELLO')
+    assert sync.unchanged(subpath, att, entry)
+    assert not sync.unchanged(subpath, att, entry, verify=True)
+
+
+def test_fetch_then_load(tmpdir: str, monkeypatch: Any) -> None:
+    with Simulator(students=3) as sim:
+        c = canvas.Canvas(
+            token='simulated', account_id=1, api_base=sim.api_base)
+        json = [sub for sub in c.list_submissions(1, ASSIGNMENT_BASE)
+                if sub.get('attachments')][0]
+        students = {json['user_id']: {'kuid': 'abc123'}}
+        cli.fetch_sub(students, str(tmpdir), canvas.Submission(dict(json)))
+
+    # The download record does not get in the way of finding the submission.
+    monkeypatch.chdir(os.path.join(
+        str(tmpdir), 'abc123_{}'.format(json['user_id'])))
+    sub = canvas.Submission()
+    assert sub.json == json
+    assert sorted(sub.downloads) == sorted(
+        att['id'] for att in json['attachments'])
@@ -0,0 +1,172 @@
+import gzip
+import json
+import pytest
+import socket
+import struct
+import threading
+import time
+import zlib
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Any, Iterator, Type
+from urllib.error import URLError
+from urllib.request import Request
+
+from staffeli import transport
+from staffeli.simulator import Simulator
+
+BODY = json.dumps([{'id': i, 'name': 'Section'} for i in range(100)]).encode()
+
+
+def test_reuse() -> None:
+    manager = transport.PoolManager()
+    with Simulator(students=5) as sim:
+        for _ in range(3):
+            manager.urlopen(Request(sim.api_base + 'courses/1'))
+    stats = manager.stats()
+    assert (stats['connections_opened'], stats['connections_reused']) == \
+        (1, 2)
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Redirects ``/redirect?<url>`` to the url, and tells what
+    ``Authorization`` header it was sent otherwise. It closes every
+    connection after the response, but does not say so, like a server that
+    drops idle keep-alive connections."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self) -> None:
+        if self.path.startswith('/redirect?'):
+            self.send_response(302)
+            self.send_header('Location', self.path[len('/redirect?'):])
+            body = b''
+        else:
+            self.send_response(200)
+            body = (self.headers.get('Authorization') or 'none').encode()
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.close_connection = True
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+class ResetHandler(BaseHTTPRequestHandler):
+    """Keeps connections alive for GET, but resets the connection halfway
+    through the response to a POST, after counting it."""
+
+    protocol_version = 'HTTP/1.1'
+    posts = 0
+
+    def do_GET(self) -> None:
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def do_POST(self) -> None:
+        self.rfile.read(int(self.headers['Content-Length']))
+        type(self).posts += 1
+        self.send_response(200)
+        self.send_header('Content-Length', '100')
+        self.end_headers()
+        self.wfile.write(b'x' * 10)
+        self.wfile.flush()
+        # Let the client wait for the rest.
+        time.sleep(0.2)
+        self.connection.setsockopt(
+            socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+        self.connection.close()
+        self.close_connection = True
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+def serve(handler: Type[BaseHTTPRequestHandler]) -> Iterator[HTTPServer]:
+    server = HTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def server() -> Iterator[HTTPServer]:
+    yield from serve(Handler)
+
+
+@pytest.fixture
+def reset_server() -> Iterator[HTTPServer]:
+    ResetHandler.posts = 0
+    yield from serve(ResetHandler)
+
+
+def get(manager: transport.PoolManager, url: str) -> bytes:
+    return manager.urlopen(
+        Request(url, headers={'Authorization': 'Bearer secret'})).body
+
+
+def test_stale_connection(server: HTTPServer) -> None:
+    manager = transport.PoolManager()
+    url = 'http://127.0.0.1:{}/'.format(server.server_port)
+    assert get(manager, url) == get(manager, url) == b'Bearer secret'
+    # The second request found its connection closed, and tried a new one,
+    # without counting it as a retry.
+    stats = manager.stats()
+    assert (stats['connections_opened'], stats['connections_reused']) == \
+        (2, 1)
+    assert stats['retries'] == 0
+
+
+def test_no_resend(reset_server: HTTPServer) -> None:
+    manager = transport.PoolManager()
+    url = 'http://127.0.0.1:{}/'.format(reset_server.server_port)
+    assert manager.urlopen(Request(url)).body == b'ok'
+    # The POST goes out on the connection kept from the GET. The server may
+    # have acted on it, so it must not be sent again on a fresh connection.
+    with pytest.raises(URLError):
+        manager.urlopen(Request(url, data=b'{}', method='POST'))
+    assert ResetHandler.posts == 1
+
+
+def test_redirect(server: HTTPServer) -> None:
+    manager = transport.PoolManager()
+    port = server.server_port
+    same = 'http://127.0.0.1:{}/redirect?/file'.format(port)
+    assert get(manager, same) == b'Bearer secret'
+    # Not to another host, e.g., where Canvas keeps the files.
+    other = 'http://127.0.0.1:{}/redirect?http://localhost:{}/file'.format(
+        port, port)
+    assert get(manager, other) == b'none'
+    resp = manager.urlopen(Request(same), redirect=False)
+    assert (resp.status, resp.getheader('Location')) == (302, '/file')
+
+
+def test_decode() -> None:
+    assert transport._decode(gzip.compress(BODY), 'gzip') == BODY
+    assert transport._decode(gzip.compress(BODY), ' X-GZIP') == BODY
+    assert transport._decode(zlib.compress(BODY), 'deflate') == BODY
+    raw = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    assert transport._decode(
+        raw.compress(BODY) + raw.flush(), 'deflate') == BODY
+    assert transport._decode(BODY, None) is None
+    assert transport._decode(BODY, 'identity') is None
+    with pytest.raises(OSError):
+        transport._decode(BODY, 'gzip')
+
+
+def test_compressed() -> None:
+    manager = transport.PoolManager()
+    with Simulator(students=200) as sim:
+        url = sim.api_base + 'courses/1/assignments/500/submissions'
+        resp = manager.urlopen(Request(url + '?per_page=100'))
+    entries = json.loads(resp.body.decode('utf-8'))
+    assert len(entries) == 100
+    assert resp.getheader('Content-Encoding') is None
+    stats = manager.stats()
+    assert stats['bytes_decoded'] == len(resp.body)
+    assert stats['bytes_wire'] == resp.wire_size < len(resp.body) / 2
@@ -0,0 +1,68 @@
+import os
+import time
+
+from staffeli import memo, metrics, transport, upload
+from staffeli.simulator import Simulator, USER_BASE, _multipart_file
+
+from typing import Any
+
+SUBMISSION = 'courses/1/assignments/500/submissions/{}'.format(USER_BASE)
+
+
+def write(tmpdir: str, name: str, content: bytes) -> str:
+    path = os.path.join(str(tmpdir), name)
+    with open(path, 'wb') as f:
+        f.write(content)
+    return path
+
+
+def test_multipart_body(tmpdir: str) -> None:
+    content = os.urandom(3 * upload.CHUNK_SIZE + 17)
+    body = upload.MultipartBody(
+        [('key', 'abc')], 'file', write(tmpdir, 'report.pdf', content))
+    chunks = list(body)
+    assert max(map(len, chunks[1:-1])) <= upload.CHUNK_SIZE
+    data = b''.join(chunks)
+    assert len(body) == len(data)
+    # It can be sent again.
+    assert b''.join(body) == data
+    assert _multipart_file(body.content_type, data) == (
+        'report.pdf', content)
+
+
+def test_via_post_many(tmpdir: str) -> None:
+    paths = [write(tmpdir, 'f{}.txt'.format(i), str(i).encode())
+             for i in range(4)]
+    with Simulator(students=1, latency=0.1) as sim:
+        start = time.monotonic()
+        ids = upload.via_post_many(
+            sim.api_base, SUBMISSION + '/comments/files', 'simulated', paths)
+        elapsed = time.monotonic() - start
+        assert [sim.download(i) for i in ids] == [b'0', b'1', b'2', b'3']
+    # Three round trips per file, but the files go up side by side.
+    assert elapsed < 3 * 0.1 * len(paths) / 2
+
+
+def test_via_url(tmpdir: str, monkeypatch: Any) -> None:
+    # Polls must get through the memo of the command-line interface.
+    monkeypatch.setattr(transport, '_memo', memo.Memo())
+    recorder = metrics.Recorder()
+    monkeypatch.setattr(transport._manager, 'recorder', recorder)
+
+    paths = [write(tmpdir, 'f{}.txt'.format(i), b'feedback')
+             for i in range(3)]
+    with Simulator(students=1, upload_delay=0.3) as sim:
+        start = time.monotonic()
+        ids = upload.concurrently(
+            lambda path: upload.via_url(
+                sim.api_base, SUBMISSION + '/comments/files', 'simulated',
+                path, 'https://example.com/' + os.path.basename(path)),
+            paths)
+        elapsed = time.monotonic() - start
+        assert all(sim.files[i]['size'] == len(b'feedback') for i in ids)
+    assert elapsed < 2 * 0.3 + 0.5
+
+    uploads = recorder.uploads_publicjson()
+    assert sorted(u['name'] for u in uploads) == ['f0.txt', 'f1.txt', 'f2.txt']
+    assert all(u['polls'] >= 1 and u['seconds_waiting'] >= 0.25
+               for u in uploads)
@@ -0,0 +1,44 @@
+import concurrent.futures
+import os
+import threading
+import time
+
+from staffeli.uploadcache import UploadCache, FILENAME
+
+from typing import List  # noqa: F401
+
+
+def write(tmpdir: str, name: str, content: bytes) -> str:
+    path = os.path.join(str(tmpdir), name)
+    with open(path, 'wb') as f:
+        f.write(content)
+    return path
+
+
+def test_upload_once(tmpdir: str) -> None:
+    cachepath = os.path.join(str(tmpdir), FILENAME)
+    feedback = write(tmpdir, 'feedback.txt', b'Well done.\n')
+    uploaded = []  # type: List[str]
+    lock = threading.Lock()
+
+    def upload() -> int:
+        time.sleep(0.05)
+        with lock:
+            uploaded.append(feedback)
+            return len(uploaded)
+
+    cache = UploadCache(cachepath)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as pool:
+        ids = list(pool.map(
+            lambda _: cache.upload(500, feedback, upload), range(4)))
+    assert ids == [1, 1, 1, 1]
+    assert (cache.uploads, cache.hits) == (1, 3)
+
+    # Remembered across runs, but per assignment, content, and name.
+    cache = UploadCache(cachepath)
+    assert cache.upload(500, feedback, upload) == 1
+    assert cache.upload(501, feedback, upload) == 2
+    renamed = write(tmpdir, 'other.txt', b'Well done.\n')
+    assert cache.upload(500, renamed, upload) == 3
+    write(tmpdir, 'feedback.txt', b'Try again.\n')
+    assert cache.upload(500, feedback, upload) == 4